@@ -0,0 +1,232 @@
+"""Micro-benchmarks for the node's hot paths. Run with "python3 benchmarks.py"."""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import tracemalloc
+from time import perf_counter, time
+
+import codec
+import mining
+from records import Block, StudentRecord
+from storage import BlockStore
+from uninode2 import UniversityNode
+
+LAST_PROOF = 35293
+LAST_HASH = hashlib.sha256(b'benchmark').hexdigest()
+
+
+def naive_search(last_proof, last_hash, start, stop):
+    # The original proof_of_work loop, one valid_proof call per nonce
+    for proof in range(start, stop):
+        guess = f'{last_proof}{proof}{last_hash}'.encode()
+        if hashlib.sha256(guess).hexdigest()[:4] == "0000":
+            return proof
+    return None
+
+
+def bench_pow(nonces=500000):
+    """
+    Nonces per second of the proof search, before and after the
+    prefix-hashing optimization. The range has no valid proof in it so
+    both searches check every nonce.
+    """
+
+    start = 10 ** 9
+    while naive_search(LAST_PROOF, LAST_HASH, start, start + nonces) is not None:
+        start += nonces
+
+    print("Proof of work search")
+    for name, search in [('before', naive_search), ('after', mining.search)]:
+        began = perf_counter()
+        search(LAST_PROOF, LAST_HASH, start, start + nonces)
+        elapsed = perf_counter() - began
+        print(f'  {name:>6}: {nonces / elapsed:,.0f} nonces/s')
+
+
+def sample_block(students=1000):
+    # A block shaped like the ones new_block makes, with 1024-bit signatures
+    return {
+        'index': 2,
+        'timestamp': time(),
+        'students': [{
+            'first_name': f'First{i}',
+            'last_name': f'Last{i}',
+            'student_id': str(3030000000 + i),
+            'date_enrolled_through': '12/15/2018',
+            'institution_name': 'University of California, Berkeley',
+            'signature': os.urandom(128).hex(),
+        } for i in range(students)],
+        'merkle_root': LAST_HASH,
+        'proof': 35293,
+        'previous_hash': LAST_HASH,
+    }
+
+
+def bench_codec(rounds=20):
+    """
+    Size and encode/decode speed of a block in the binary encoding
+    against the sorted-keys JSON it replaces for storage and transfer
+    """
+
+    block = sample_block()
+    formats = [
+        ('json', lambda value: json.dumps(value, sort_keys=True).encode(), json.loads),
+        ('binary', codec.dumps, codec.loads),
+    ]
+
+    print(f"Block of {len(block['students'])} students")
+    for name, encode, decode in formats:
+        data = encode(block)
+        assert decode(data) == block
+
+        began = perf_counter()
+        for _ in range(rounds):
+            encode(block)
+        encoded = (perf_counter() - began) / rounds
+
+        began = perf_counter()
+        for _ in range(rounds):
+            decode(data)
+        decoded = (perf_counter() - began) / rounds
+
+        print(f'  {name:>6}: {len(data):,} bytes, encode {encoded * 1000:.2f} ms, decode {decoded * 1000:.2f} ms')
+
+
+def bench_memory(records=100000):
+    """
+    Memory held per student record, as loaded from a stored or downloaded
+    chain, for the plain dicts records used to be and for StudentRecords
+    """
+
+    data = json.dumps(sample_block(records)['students'])
+    formats = [
+        ('dict', json.loads),
+        ('slots', lambda text: [StudentRecord.from_dict(student) for student in json.loads(text)]),
+    ]
+
+    print("Memory per student record")
+    tracemalloc.start()
+    for name, load in formats:
+        before = tracemalloc.get_traced_memory()[0]
+        loaded = load(data)
+        size = tracemalloc.get_traced_memory()[0] - before
+        del loaded
+        print(f'  {name:>6}: {size / records:,.0f} bytes')
+    tracemalloc.stop()
+
+
+def write_chain(path, blocks, students):
+    """
+    Store a chain of sample blocks
+    :return: The BlockStore
+    """
+
+    store = BlockStore(path)
+    store.load(UniversityNode.hash)
+    previous = LAST_HASH
+    for index in range(1, blocks + 1):
+        values = sample_block(students)
+        values.update(index=index, previous_hash=previous)
+        for i, student in enumerate(values['students']):
+            student['student_id'] = str(3030000000 + index * students + i)
+        block = Block.from_dict(values)
+        previous = UniversityNode.hash(block)
+        store.append(block, previous)
+    return store
+
+
+def bench_store(blocks=1000, students=50, reads=1000):
+    """
+    Restarting a node over a stored chain. The chain is opened with the
+    blocks decoded into a list up front, as they used to be, and mapped
+    from the log through the index. The node's student index is kept in a
+    database beside the log: the first start indexes every block, and a
+    restart only checks it against the log, so the time and memory of both
+    are given, with what looking up a student costs through it.
+    """
+
+    with open('./berkeley.json') as data_file:
+        institution_properties = json.load(data_file, strict=False)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.chain')
+        store = write_chain(path, blocks, students)
+
+        print(f'Chain of {blocks} blocks of {students} students')
+        for name, open_chain in [('list', lambda: list(store.views()[0])), ('mapped', lambda: store.load(UniversityNode.hash)[0])]:
+            store.cache.clear()
+            tracemalloc.start()
+            chain = open_chain()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del chain
+
+            store.cache.clear()
+            began = perf_counter()
+            chain = open_chain()
+            opened = perf_counter() - began
+
+            began = perf_counter()
+            for _ in range(reads):
+                chain[random.randrange(len(chain))]
+            read = (perf_counter() - began) / reads
+            del chain
+            print(f'  {name:>6}: open {opened * 1000:,.1f} ms holding {size / 2 ** 20:,.1f} MiB, '
+                  f'chain[i] {read * 1e6:,.1f} us')
+
+        for name in ('first start', 'restart'):
+            began = perf_counter()
+            node = UniversityNode(institution_properties, 'berkeley', store=BlockStore(path))
+            started = perf_counter() - began
+            node.index.close()
+            print(f'  node {name}: {started * 1000:,.1f} ms')
+        tracemalloc.start()
+        node = UniversityNode(institution_properties, 'berkeley', store=BlockStore(path))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'  student index: {os.path.getsize(path + ".students.db") / 2 ** 20:,.1f} MiB on disk '
+              f'beside a {os.path.getsize(path) / 2 ** 20:,.1f} MiB block log, {size / 2 ** 20:,.1f} MiB to restart')
+
+        wanted = []
+        for _ in range(reads):
+            position = random.randrange(blocks)
+            student = node.chain[position].students[random.randrange(students)]
+            wanted.append((student.first_name, student.last_name, student.student_id))
+        node.store.cache.clear()
+        began = perf_counter()
+        for first_name, last_name, student_id in wanted:
+            node.find_students(first_name, last_name, student_id)
+        found = (perf_counter() - began) / reads
+        print(f'  find_students {found * 1e6:,.1f} us')
+
+
+def bench_restart(sizes=(250, 1000), students=50):
+    """
+    Restarting a node over stored chains of different lengths, once the
+    first start has indexed them. It should take about as long for each.
+    """
+
+    with open('./berkeley.json') as data_file:
+        institution_properties = json.load(data_file, strict=False)
+
+    print(f'Restart over a chain of blocks of {students} students')
+    for blocks in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.chain')
+            write_chain(path, blocks, students)
+            UniversityNode(institution_properties, 'berkeley', store=BlockStore(path)).index.close()
+            began = perf_counter()
+            UniversityNode(institution_properties, 'berkeley', store=BlockStore(path)).index.close()
+            started = perf_counter() - began
+            print(f'  {blocks:>6} blocks: {started * 1000:,.1f} ms')
+
+
+if __name__ == '__main__':
+    bench_pow()
+    bench_codec()
+    bench_memory()
+    bench_store()
+    bench_restart()
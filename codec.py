@@ -0,0 +1,238 @@
+"""Compact binary encoding of blocks, headers and the other documents nodes exchange.
+
+Values are JSON-like (None, bool, int, float, str, list, dict) and decode to
+exactly what was encoded, so a block hashes the same after a round trip.
+Dict keys and institution names are written once into a string table at the
+start of the document and referred to by number afterwards. A list of dicts
+that all have the same keys, like a block's students, is written as a table
+with the keys given once. Strings of lowercase hex, such as hashes and
+signatures, are stored as raw bytes.
+"""
+
+import re
+import struct
+
+MIMETYPE = 'application/x-studentchain'
+
+MAGIC = b'SC\x01'
+
+# Values whose strings repeat across records, so are worth putting in the string table
+INTERNED_FIELDS = {'institution_name'}
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, HEX, LIST, DICT, REF, TABLE = range(11)
+
+HEX_STRING = re.compile('(?:[0-9a-f]{2})+')
+
+DOUBLE = struct.Struct('>d')
+
+# Lists, tables and dicts nested deeper than this are not decoded
+MAX_DEPTH = 64
+
+
+class CodecError(ValueError):
+    """Raised when a document cannot be decoded"""
+    pass
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_bytes(out, data):
+    _write_varint(out, len(data))
+    out += data
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings = {}
+        self.body = bytearray()
+
+    def ref(self, string):
+        if string not in self.strings:
+            self.strings[string] = len(self.strings)
+        return self.strings[string]
+
+    def value(self, value, interned=False):
+        out = self.body
+        if value is None:
+            out.append(NONE)
+        elif value is False:
+            out.append(FALSE)
+        elif value is True:
+            out.append(TRUE)
+        elif isinstance(value, int):
+            out.append(INT)
+            # Zigzag so that small negative numbers stay short
+            _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += DOUBLE.pack(value)
+        elif isinstance(value, str):
+            if interned:
+                out.append(REF)
+                _write_varint(out, self.ref(value))
+            elif HEX_STRING.fullmatch(value):
+                out.append(HEX)
+                _write_bytes(out, bytes.fromhex(value))
+            else:
+                out.append(STR)
+                _write_bytes(out, value.encode())
+        elif isinstance(value, (list, tuple)):
+            keys = self.table_keys(value)
+            if keys is not None:
+                out.append(TABLE)
+                _write_varint(out, len(keys))
+                for key in keys:
+                    _write_varint(out, self.ref(key))
+                _write_varint(out, len(value))
+                interned = [key in INTERNED_FIELDS for key in keys]
+                for row in value:
+                    for key, intern in zip(keys, interned):
+                        self.value(row[key], intern)
+                return
+            out.append(LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, dict):
+            out.append(DICT)
+            _write_varint(out, len(value))
+            # Keys in sorted order, so that equal dicts encode the same
+            for key in sorted(value):
+                _write_varint(out, self.ref(key))
+                self.value(value[key], key in INTERNED_FIELDS)
+        else:
+            raise TypeError(f'Cannot encode {type(value).__name__}')
+
+    @staticmethod
+    def table_keys(rows):
+        # The shared keys of a list of dicts, or None if it is not one
+        if not rows or not isinstance(rows[0], dict) or not rows[0]:
+            return None
+        keys = sorted(rows[0])
+        for row in rows:
+            if not isinstance(row, dict) or len(row) != len(keys) or any(key not in row for key in keys):
+                return None
+        return keys
+
+
+def dumps(value):
+    """
+    Encode a JSON-like value
+    :param value: Block, header, or any document made of JSON types
+    :return: <bytes>
+    """
+
+    encoder = _Encoder()
+    encoder.value(value)
+
+    out = bytearray(MAGIC)
+    _write_varint(out, len(encoder.strings))
+    for string in encoder.strings:
+        _write_bytes(out, string.encode())
+    out += encoder.body
+    return bytes(out)
+
+
+class _Decoder:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+        self.strings = []
+
+    def varint(self):
+        result = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def count(self, size=1):
+        # A number of items that take at least size bytes each, which must fit in what is left
+        count = self.varint()
+        if count * size > len(self.data) - self.offset:
+            raise CodecError('Count larger than the document')
+        return count
+
+    def bytes(self):
+        length = self.varint()
+        end = self.offset + length
+        if end > len(self.data):
+            raise CodecError('Truncated document')
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def value(self, depth=0):
+        tag = self.data[self.offset]
+        self.offset += 1
+        if tag == NONE:
+            return None
+        if tag == FALSE:
+            return False
+        if tag == TRUE:
+            return True
+        if tag == INT:
+            value = self.varint()
+            return value // 2 if value % 2 == 0 else -(value + 1) // 2
+        if tag == FLOAT:
+            value, = DOUBLE.unpack_from(self.data, self.offset)
+            self.offset += DOUBLE.size
+            return value
+        if tag == STR:
+            return str(self.bytes(), 'utf-8')
+        if tag == HEX:
+            return self.bytes().hex()
+        if tag == REF:
+            return self.strings[self.varint()]
+        if tag in (LIST, TABLE, DICT):
+            depth += 1
+            if depth > MAX_DEPTH:
+                raise CodecError('Document nested too deeply')
+        if tag == LIST:
+            return [self.value(depth) for _ in range(self.count())]
+        if tag == TABLE:
+            keys = [self.strings[self.varint()] for _ in range(self.count())]
+            if not keys:
+                # Rows without values would take no space, however many there were said to be
+                raise CodecError('Table without keys')
+            value = self.value
+            return [{key: value(depth) for key in keys} for _ in range(self.count(len(keys)))]
+        if tag == DICT:
+            result = {}
+            for _ in range(self.count(2)):
+                key = self.strings[self.varint()]
+                result[key] = self.value(depth)
+            return result
+        raise CodecError(f'Unknown tag {tag}')
+
+
+def loads(data):
+    """
+    Decode a document made by dumps
+    :param data: <bytes>
+    :return: The decoded value
+    :raises CodecError: If the data is not a valid document
+    """
+
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise CodecError('Not an encoded document')
+    decoder = _Decoder(data)
+    decoder.offset = len(MAGIC)
+    try:
+        decoder.strings = [str(decoder.bytes(), 'utf-8') for _ in range(decoder.count())]
+        value = decoder.value()
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise CodecError(f'Truncated or damaged document: {e}')
+    except RecursionError:
+        raise CodecError('Document nested too deeply')
+    if decoder.offset != len(decoder.data):
+        raise CodecError('Trailing data after document')
+    return value
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+from threading import Lock
+
+from Crypto.PublicKey import RSA
+
+logger = logging.getLogger(__name__)
+
+
+class KeyRegistry:
+    """
+    Public keys of the institutions in the consortium, read from a
+    JSON file mapping institution names to PEM keys. Keys are imported
+    once and cached; the file is re-read when its mtime changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.pems = {}
+        self.mtime = None
+        # Bumped on every reload so callers can drop results derived from old keys
+        self.generation = 0
+        self.lock = Lock()
+        self.reload()
+
+    def reload(self):
+        """
+        Re-read the key file and re-import every key in it. The keys only
+        change once the whole file has been read and imported.
+        :return: Names of the institutions with a registered key
+        :raises ValueError: If the file does not hold valid keys, which are then left as they were
+        """
+
+        with self.lock:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as pub_file:
+                pub_properties = json.load(pub_file, strict=False)
+            if not isinstance(pub_properties, dict) or not all(isinstance(pem, str) for pem in pub_properties.values()):
+                raise ValueError('expected an object mapping institution names to PEM keys')
+            self.keys = {name: RSA.importKey(pem) for name, pem in pub_properties.items()}
+            self.pems = pub_properties
+            self.mtime = mtime
+            self.generation += 1
+        return sorted(self.keys)
+
+    def refresh(self):
+        """
+        Reload the key file if it has changed since it was last read
+        """
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime != self.mtime:
+                self.reload()
+        except OSError:
+            # Keep serving the keys we have if the file is briefly missing
+            pass
+        except ValueError as e:
+            # Or half written; it is read again once it changes
+            logger.warning('Keeping the public keys loaded before %s changed: %s', self.path, e)
+            self.mtime = mtime
+
+    def get(self, institution_name):
+        """
+        Public key of an institution
+        :param institution_name: Name of the institution
+        :return: The imported RSA key, or None if the institution is unknown
+        """
+
+        self.refresh()
+        return self.keys.get(institution_name)
+
+    def institutions(self):
+        """
+        Names of the institutions with a registered key, sorted
+        """
+
+        self.refresh()
+        return sorted(self.keys)
@@ -0,0 +1,287 @@
+import logging
+from urllib.parse import urlparse
+
+import requests
+from flask import Flask, jsonify, request, render_template
+
+import codec
+import crypto
+import merkle
+from keyregistry import KeyRegistry
+from records import StudentRecord
+from mining import RETARGET_BLOCKS, TARGET_BLOCK_TIME, required_difficulty, required_producer
+from uninode2 import CONSENSUS_MODES, MAX_HEADERS_PER_REQUEST, PEER_TIMEOUT, PUBLIC_KEYS_FILE_PATH, UniversityNode
+
+logger = logging.getLogger(__name__)
+
+
+class LightNode:
+    """
+    Read-only node that keeps only block headers. Student records are
+    fetched from full nodes when they are checked, together with a Merkle
+    proof tying them to a header we already hold.
+    """
+
+    def __init__(self, target_block_time=TARGET_BLOCK_TIME, consensus='pow'):
+        self.headers = []
+        self.hashes = []
+        self.nodes = set()
+        self.session = requests.Session()
+        self.session.headers['Accept'] = f'{codec.MIMETYPE}, application/json;q=0.9'
+        self.ciph = crypto.Crypto()
+        self.key_registry = KeyRegistry(PUBLIC_KEYS_FILE_PATH)
+        self.target_block_time = target_block_time
+        self.consensus = consensus
+
+    def register_node(self, address):
+        """
+        Add a full node to fetch headers and records from
+        :param address: Address of node. Eg. 'http://192.168.0.5:5000'
+        """
+
+        parsed_url = urlparse(address)
+        if parsed_url.netloc:
+            self.nodes.add(parsed_url.netloc)
+        elif parsed_url.path:
+            self.nodes.add(parsed_url.path)
+        else:
+            raise ValueError('Invalid URL')
+
+    def fetch(self, node, path, method='GET', **kwargs):
+        try:
+            response = self.session.request(method, f'http://{node}{path}', timeout=PEER_TIMEOUT, **kwargs)
+            if response.status_code != 200:
+                return None
+            if response.headers.get('Content-Type', '').startswith(codec.MIMETYPE):
+                return codec.loads(response.content)
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Skipping node %s: %s', node, e)
+            return None
+
+    @staticmethod
+    def header_hash(header):
+        """
+        Recompute the hash of a header received from a full node
+        :return: The hash, or None for old blocks whose hash covers their students
+        """
+
+        if 'merkle_root' not in header:
+            return None
+        return UniversityNode.hash({key: value for key, value in header.items() if key != 'hash'})
+
+    def valid_headers(self, fork, headers):
+        """
+        Check headers following our first fork headers: each must hash to the
+        hash it claims, link to the one before it, and either carry the difficulty
+        the headers before it call for and a Proof of Work meeting it or, under
+        proof of authority, be signed by the registered institution whose turn it was
+        :return: True if valid, False if not
+        """
+
+        window = [(header['timestamp'], header.get('difficulty')) for header in self.headers[max(0, fork - RETARGET_BLOCKS):fork]]
+        if fork:
+            last_proof, last_hash = self.headers[fork - 1]['proof'], self.hashes[fork - 1]
+        else:
+            last_proof, last_hash = None, None
+
+        for position, header in enumerate(headers, fork):
+            block_hash = self.header_hash(header)
+            if block_hash is not None and block_hash != header['hash']:
+                return False
+            if last_hash is not None:
+                if header['previous_hash'] != last_hash:
+                    return False
+                if self.consensus == 'poa':
+                    producer = required_producer(window[-1][0], header['timestamp'], self.key_registry.institutions(),
+                                                 self.target_block_time)
+                    if producer is None or producer != header.get('producer'):
+                        return False
+                    if not UniversityNode.valid_authority(header, self.key_registry, self.ciph):
+                        return False
+                else:
+                    difficulty = required_difficulty(position, window[-RETARGET_BLOCKS:], header.get('difficulty'),
+                                                     header['timestamp'], self.target_block_time)
+                    if difficulty is None:
+                        return False
+                    if not UniversityNode.valid_proof(last_proof, header['proof'], header['previous_hash'], difficulty):
+                        return False
+            last_proof, last_hash = header['proof'], header['hash']
+            window.append((header['timestamp'], header.get('difficulty')))
+        return True
+
+    def sync_with(self, node):
+        """
+        Fetch the headers a full node has that we do not, walking back from our
+        tip until its headers meet ours
+        :param node: Address of the full node
+        :return: True if our headers were extended or replaced, False if not
+        """
+
+        def fetch_page(start):
+            return self.fetch(node, '/chain/headers', params={'from': start, 'to': start + MAX_HEADERS_PER_REQUEST})
+        found = UniversityNode.fork_headers(fetch_page, self.hashes)
+        if found is None:
+            return False
+        fork, headers = found
+        if fork + len(headers) <= len(self.headers):
+            return False
+        try:
+            if not self.valid_headers(fork, headers):
+                logger.warning('Node %s sent invalid headers', node)
+                return False
+        except (KeyError, TypeError):
+            return False
+
+        self.headers = self.headers[:fork] + headers
+        self.hashes = self.hashes[:fork] + [header['hash'] for header in headers]
+        return True
+
+    def resolve_conflicts(self):
+        """
+        Sync headers from every full node, keeping the longest valid chain
+        :return: True if our headers changed, False if not
+        """
+
+        replaced = False
+        for node in list(self.nodes):
+            replaced = self.sync_with(node) or replaced
+        return replaced
+
+    def check_proof(self, proof):
+        """
+        Check a record proof from a full node against our headers
+        :param proof: Response of a full node's /proof/<record_id>
+        :return: True if the record is in a block on our chain, False if not
+        """
+
+        record, header = proof['record'], proof['header']
+        position = header['index'] - 1
+        if position >= len(self.hashes) or self.hashes[position] != header['hash']:
+            return False
+        if self.header_hash(header) != header['hash']:
+            return False
+
+        leaf = merkle.leaf_hash(record)
+        return leaf == proof['record_id'] and merkle.verify_path(leaf, proof['path'], header['merkle_root'])
+
+    def verify_student(self, first_name, last_name, student_id):
+        """
+        Ask the full nodes for a student's record, then check its inclusion
+        proof against our headers and its signature against the institution's key
+        :return: The verified record, or None
+        """
+
+        query = {'first_name': first_name, 'last_name': last_name, 'student_id': student_id}
+        for node in list(self.nodes):
+            found = self.fetch(node, '/verify', 'POST', json=query)
+            if not found or not found.get('result') or 'record_id' not in found:
+                continue
+            proof = self.fetch(node, f"/proof/{found['record_id']}")
+            if proof is None:
+                continue
+
+            try:
+                # The record may be in a block newer than our headers
+                if proof['header']['index'] > len(self.headers):
+                    self.sync_with(node)
+                if not self.check_proof(proof):
+                    logger.warning('Node %s sent an invalid proof', node)
+                    continue
+                record = proof['record']
+                student = StudentRecord.from_dict(record)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if any(record.get(key) != value for key, value in query.items()):
+                continue
+            public_key = self.key_registry.get(student.institution_name)
+            if public_key is None:
+                continue
+            if self.ciph.asymmetric_verify(student.sign_string(), record['signature'], public_key):
+                return record
+        return None
+
+
+app = Flask(__name__)
+
+node = None
+
+
+@app.route('/verify', methods=['POST'])
+def verify_student():
+    values = request.get_json()
+
+    # Check that the required fields are in the POST'ed data
+    required = ['first_name', 'last_name', 'student_id']
+    if not all(k in values for k in required):
+        return 'Missing values', 400
+
+    record = node.verify_student(values['first_name'], values['last_name'], values['student_id'])
+    if record is None:
+        return jsonify({"result" : False}), 200
+    return jsonify({"result" : True, "school" : record['institution_name'], "signature": record['signature']}), 200
+
+
+@app.route('/nodes/register', methods=['POST'])
+def register_nodes():
+    values = request.get_json()
+
+    endpoints = values.get('nodes')
+    if endpoints is None:
+        return "Error: Please supply a valid list of nodes", 400
+
+    for endpoint in endpoints:
+        node.register_node(endpoint)
+
+    response = {
+        'message': 'New nodes have been added',
+        'total_nodes': list(node.nodes),
+    }
+    return jsonify(response), 201
+
+
+@app.route('/nodes/resolve', methods=['GET'])
+def consensus():
+    replaced = node.resolve_conflicts()
+
+    response = {
+        'message': 'Our headers were updated' if replaced else 'Our headers are up to date',
+        'length': len(node.headers),
+    }
+    return jsonify(response), 200
+
+
+@app.route('/chain/headers', methods=['GET'])
+def chain_headers():
+    start = max(request.args.get('from', 0, type=int), 0)
+    end = min(request.args.get('to', len(node.headers), type=int), start + MAX_HEADERS_PER_REQUEST)
+
+    response = {
+        'headers': node.headers[start:end],
+        'length': len(node.headers),
+    }
+    return jsonify(response), 200
+
+
+@app.route('/check')
+def check():
+    return render_template('check.html')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', default=5001, type=int, help='port to listen on')
+    parser.add_argument('-n', '--node', action='append', default=[], help='full node to sync from, can be given more than once')
+    parser.add_argument('-l', '--log-level', default='INFO', type=str, help='logging level')
+    parser.add_argument('--target-block-time', default=TARGET_BLOCK_TIME, type=float, help='seconds between blocks the full nodes adjust mining difficulty towards, or the length of each turn to make a block under poa')
+    parser.add_argument('--consensus', default='pow', choices=CONSENSUS_MODES, help='consensus mode of the full nodes')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    node = LightNode(args.target_block_time, args.consensus)
+    for address in args.node:
+        node.register_node(address)
+    node.resolve_conflicts()
+    app.run(host='0.0.0.0', port=args.port)
@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+# Leaves and interior nodes are hashed with different prefixes so that one can never pass for the other
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(record):
+    """
+    Hash of a student record as a Merkle leaf, which also serves as its record id
+    :param record: Student record
+    :return: <str> hex digest
+    """
+
+    record_string = json.dumps(record, sort_keys=True).encode()
+    return hashlib.sha256(LEAF_PREFIX + record_string).hexdigest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def next_level(level):
+    # A node without a sibling is carried up to the next level as it is
+    return [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)]
+
+
+def merkle_root(leaves):
+    """
+    Merkle root over a list of leaf hashes
+    :param leaves: List of leaf hashes
+    :return: <str> hex digest
+    """
+
+    if not leaves:
+        return hashlib.sha256(b'').hexdigest()
+    level = list(leaves)
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0]
+
+
+def merkle_path(leaves, position):
+    """
+    Inclusion path for one leaf
+    :param leaves: List of leaf hashes
+    :param position: Position of the leaf
+    :return: List of {'hash', 'side'} siblings from the leaf up, side being where the sibling sits
+    """
+
+    path = []
+    level = list(leaves)
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            path.append({'hash': level[sibling], 'side': 'left' if sibling < position else 'right'})
+        level = next_level(level)
+        position //= 2
+    return path
+
+
+def verify_path(leaf, path, root):
+    """
+    Check that a leaf is included under a Merkle root
+    :param leaf: Leaf hash
+    :param path: Inclusion path from merkle_path
+    :param root: Merkle root
+    :return: True if the path leads from the leaf to the root, False if not
+    """
+
+    current = leaf
+    for step in path:
+        if step['side'] == 'left':
+            current = node_hash(step['hash'], current)
+        else:
+            current = node_hash(current, step['hash'])
+    return current == root
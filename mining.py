@@ -0,0 +1,247 @@
+import hashlib
+from collections import deque
+from multiprocessing import get_context
+from time import time
+
+# Difficulty is the number of leading zero bits a proof's hash must have.
+# 16 bits is the four leading zero hex digits proofs have always needed.
+DEFAULT_DIFFICULTY = 16
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 64
+# Difficulty is adjusted every RETARGET_BLOCKS blocks, by at most MAX_RETARGET_STEP bits
+RETARGET_BLOCKS = 10
+MAX_RETARGET_STEP = 2
+# Seconds between blocks that retargeting aims for
+TARGET_BLOCK_TIME = 60
+# How far ahead of our clock a block's timestamp may be
+MAX_CLOCK_DRIFT = 600
+
+# Pools are started from a server process rather than forked from the node, which runs threads
+_context = get_context('forkserver')
+
+# Set in each pool worker so that a search can be abandoned once a proof is found
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def meets_difficulty(digest, difficulty):
+    """
+    Check that a hash starts with enough zero bits
+    :param digest: <bytes> The hash
+    :param difficulty: <int> Number of leading zero bits needed
+    :return: <bool>
+    """
+
+    full, bits = divmod(difficulty, 8)
+    return digest[:full] == bytes(full) and (not bits or digest[full] >> (8 - bits) == 0)
+
+
+def next_difficulty(position, window, target_block_time=TARGET_BLOCK_TIME):
+    """
+    The difficulty the block at a position must carry. It is the difficulty of
+    the block before it, except every RETARGET_BLOCKS blocks, when it goes up a
+    bit for each halving (or down a bit for each doubling) that would bring the
+    time the last RETARGET_BLOCKS blocks took back to target_block_time apart.
+    Blocks from before difficulties were stored count as DEFAULT_DIFFICULTY.
+    :param position: Position of the block in the chain
+    :param window: (timestamp, difficulty) of up to RETARGET_BLOCKS blocks before it, oldest first
+    :param target_block_time: Seconds between blocks to aim for
+    :return: <int>
+    """
+
+    difficulty = window[-1][1]
+    if difficulty is None:
+        return DEFAULT_DIFFICULTY
+    if position % RETARGET_BLOCKS or len(window) < RETARGET_BLOCKS:
+        return difficulty
+
+    # Powers of two keep the comparisons exact, so every node gets the same answer
+    elapsed = window[-1][0] - window[0][0]
+    expected = target_block_time * (len(window) - 1)
+    step = 0
+    while step < MAX_RETARGET_STEP and elapsed * 2 ** (step + 1) <= expected:
+        step += 1
+    while step > -MAX_RETARGET_STEP and elapsed >= expected * 2 ** (1 - step):
+        step -= 1
+    return min(max(difficulty + step, MIN_DIFFICULTY), MAX_DIFFICULTY)
+
+
+def required_difficulty(position, window, difficulty, timestamp, target_block_time=TARGET_BLOCK_TIME):
+    """
+    Check the difficulty and timestamp a block carries against the blocks before it.
+    Timestamps may not go backwards or run ahead of our clock, since they steer retargeting.
+    :param position: Position of the block in the chain
+    :param window: (timestamp, difficulty) of up to RETARGET_BLOCKS blocks before it, oldest first
+    :param difficulty: The difficulty the block carries, None for blocks from before difficulties were stored
+    :param timestamp: The block's timestamp
+    :return: The difficulty the block's proof must meet, or None if the block is invalid
+    """
+
+    last_timestamp, last_difficulty = window[-1]
+    if difficulty is None:
+        # Blocks without a difficulty can only follow each other
+        return DEFAULT_DIFFICULTY if last_difficulty is None else None
+    if not last_timestamp <= timestamp <= time() + MAX_CLOCK_DRIFT:
+        return None
+    expected = next_difficulty(position, window, target_block_time)
+    return expected if difficulty == expected else None
+
+
+def producer_slot(timestamp, target_block_time=TARGET_BLOCK_TIME):
+    # Under proof of authority time is cut into slots of target_block_time seconds
+    return int(timestamp // target_block_time)
+
+
+def required_producer(last_timestamp, timestamp, producers, target_block_time=TARGET_BLOCK_TIME):
+    """
+    Check the timestamp a block made by proof of authority carries against the block before it.
+    The producers take the slots in turn, one block per slot, and the slot must be after that of
+    the block before it and not ahead of our clock, so a chain grows no faster than time passes
+    and no producer makes more than its share of it.
+    :param last_timestamp: Timestamp of the block before it
+    :param timestamp: The block's timestamp
+    :param producers: Names of the institutions producing blocks, sorted
+    :return: Name of the institution whose turn the block is in, or None if the block is invalid
+    """
+
+    if not producers or not last_timestamp <= timestamp <= time() + MAX_CLOCK_DRIFT:
+        return None
+    slot = producer_slot(timestamp, target_block_time)
+    if slot <= producer_slot(last_timestamp, target_block_time):
+        return None
+    return producers[slot % len(producers)]
+
+
+def next_turn(last_timestamp, producers, producer, target_block_time=TARGET_BLOCK_TIME):
+    """
+    When the next slot a producer may make a block in after a block starts, the current slot if it is its turn
+    :param last_timestamp: Timestamp of the block
+    :param producers: Names of the institutions producing blocks, sorted
+    :param producer: Name of the producer
+    :return: Timestamp the slot starts at, or None if the producer is not one of producers
+    """
+
+    if producer not in producers:
+        return None
+    slot = max(producer_slot(last_timestamp, target_block_time) + 1, producer_slot(time(), target_block_time))
+    slot += (producers.index(producer) - slot) % len(producers)
+    return slot * target_block_time
+
+
+def search(last_proof, last_hash, start, stop, difficulty=DEFAULT_DIFFICULTY, batch_size=1000):
+    """
+    Look for a valid proof in [start, stop)
+    The guess hashed for a proof p is f'{last_proof}{p}{last_hash}'. Nonces
+    are processed in batches that share every digit but the last few, so the
+    hasher state after f'{last_proof}{leading digits}' is computed once per
+    batch and copied for each nonce, which only adds its precomputed tail.
+    Leading zero bits are checked on the digest bytes, which skips the
+    hexdigest(): whole zero bytes first, then the bits of the byte after them.
+    :param last_proof: <int> Previous Proof
+    :param last_hash: <str> The hash of the Previous Block
+    :param difficulty: <int> Number of leading zero bits needed
+    :param batch_size: Nonces per batch, a power of ten
+    :return: The smallest valid proof in the range, or None
+    """
+
+    full, bits = divmod(difficulty, 8)
+    zeros = bytes(full)
+    # The byte after the zero bytes must be below this
+    limit = 1 << (8 - bits)
+    suffix = last_hash.encode()
+    width = len(str(batch_size)) - 1
+    tails = [b'%0*d%s' % (width, low, suffix) for low in range(batch_size)]
+    base = hashlib.sha256(str(last_proof).encode())
+
+    for high in range(start // batch_size, -(-stop // batch_size)):
+        if _stop is not None and _stop.is_set():
+            return None
+        prefix = base.copy()
+        if high:
+            prefix.update(b'%d' % high)
+            batch_tails = tails
+        else:
+            # Nonces below batch_size have no leading digits to pad to
+            batch_tails = [b'%d%s' % (low, suffix) for low in range(batch_size)]
+
+        offset = high * batch_size
+        copy = prefix.copy
+        for low in range(max(start - offset, 0), min(stop - offset, batch_size)):
+            guess = copy()
+            guess.update(batch_tails[low])
+            digest = guess.digest()
+            if digest[:full] == zeros and digest[full] < limit:
+                return offset + low
+    return None
+
+
+def _search_chunk(args):
+    return search(*args)
+
+
+class ParallelMiner:
+    """
+    Proof of Work search spread over a pool of worker processes.
+    The nonce space is handed out in chunks of chunk_size; chunks are
+    collected in order so the proof found is the same one a sequential
+    search would return.
+    """
+
+    def __init__(self, workers=1, chunk_size=10000):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.stop = None
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.stop = _context.Event()
+            self.pool = _context.Pool(self.workers, initializer=_init_worker, initargs=(self.stop,))
+        return self.pool
+
+    def mine(self, last_proof, last_hash, difficulty=DEFAULT_DIFFICULTY):
+        """
+        Find the next proof
+        :param last_proof: <int> Previous Proof
+        :param last_hash: <str> The hash of the Previous Block
+        :param difficulty: <int> Number of leading zero bits needed
+        :return: <int>
+        """
+
+        if self.workers <= 1:
+            start = 0
+            while True:
+                proof = search(last_proof, last_hash, start, start + self.chunk_size, difficulty)
+                if proof is not None:
+                    return proof
+                start += self.chunk_size
+
+        pool = self._get_pool()
+        pending = deque()
+        start = 0
+        try:
+            while True:
+                # Keep every worker busy with one chunk queued behind it
+                while len(pending) < 2 * self.workers:
+                    args = (last_proof, last_hash, start, start + self.chunk_size, difficulty)
+                    pending.append(pool.apply_async(_search_chunk, (args,)))
+                    start += self.chunk_size
+
+                proof = pending.popleft().get()
+                if proof is not None:
+                    return proof
+        finally:
+            # Stop the chunks still in flight and wait for them before the next search
+            self.stop.set()
+            for result in pending:
+                result.wait()
+            self.stop.clear()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
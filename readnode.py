@@ -0,0 +1,307 @@
+"""
+Read-only worker processes for a node that keeps its chain in SQLite.
+
+The node itself stays the one writer: it enrolls students, mines and accepts
+blocks. Each worker answers /verify, /proof and the /chain routes straight
+from the database, so reads are spread over as many processes as there are
+workers without each of them holding a copy of the chain.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import socket
+from threading import Thread
+from time import sleep
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+import crypto
+import merkle
+from keyregistry import KeyRegistry
+from sqlitestore import ChainView
+from studentindex import normalize, similarity, trigrams
+from uninode2 import (FUZZY_THRESHOLD, MAX_BLOCKS_PER_REQUEST, MAX_HEADERS_PER_REQUEST, PUBLIC_KEYS_FILE_PATH,
+                      VERIFY_CACHE_SIZE, UniversityNode, negotiated, not_modified, verification)
+from verifycache import VerificationCache
+
+logger = logging.getLogger(__name__)
+
+PARENT_CHECK_INTERVAL = 1
+
+app = Flask(__name__)
+
+
+class ReadNode:
+    """
+    Answers the read routes of a node from a ChainView
+    """
+
+    def __init__(self, path):
+        self.view = ChainView(path)
+        self.ciph = crypto.Crypto()
+        self.key_registry = KeyRegistry(PUBLIC_KEYS_FILE_PATH)
+        self.verify_cache = VerificationCache(VERIFY_CACHE_SIZE)
+        self.key_generation = self.key_registry.generation
+
+    # Checked exactly as the writing node checks them
+    refresh_keys = UniversityNode.refresh_keys
+    verify_record = UniversityNode.verify_record
+    verify_key = staticmethod(UniversityNode.verify_key)
+
+    def match_students(self, first_name, last_name, student_id, fuzzy=False):
+        """
+        Look up the records for a student as UniversityNode.match_students does: those
+        that match exactly, then but for case, spacing and Unicode form, then if fuzzy
+        is set, those with the same student id and a similar name, most similar first
+        :return: List of (how the record matched, StudentRecord), best matches first
+        """
+
+        with self.view.snapshot() as view:
+            matches = [('exact', found) for found in view.locate(first_name, last_name, student_id)]
+            matches += [('normalized', found) for found in view.locate_normalized(first_name, last_name, student_id)]
+            if fuzzy:
+                matches += [('fuzzy', found) for found in self.locate_similar(view, first_name, last_name, student_id)]
+
+        found, seen = [], set()
+        for match, (location, student) in matches:
+            if location not in seen:
+                seen.add(location)
+                found.append((match, student))
+        return found
+
+    @staticmethod
+    def locate_similar(view, first_name, last_name, student_id):
+        """
+        The records with a student id and a name like the student's, as StudentIndex.locate_similar finds them
+        :return: List of ((block position, position in the block), StudentRecord), most similar name first
+        """
+
+        grams = trigrams(f'{normalize(first_name)} {normalize(last_name)}')
+        if not grams:
+            return []
+
+        # Each name is scored once, and names scoring the same keep the order they were first seen in
+        names, scored = {}, []
+        for name, location, student in view.with_student_id(student_id):
+            if name not in names:
+                names[name] = (similarity(grams, trigrams(f'{name[0]} {name[1]}')), len(names))
+            score, seen = names[name]
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, seen, location, student))
+        scored.sort(key=lambda match: match[:2])
+        return [(location, student) for _, _, location, student in scored]
+
+    def verified(self, values):
+        """
+        The first record of a student whose signature checks out
+        :param values: Dict with first_name, last_name and student_id, and fuzzy to match names fuzzily
+        :return: (how the record matched, StudentRecord), or None if there is none
+        """
+
+        matches = self.match_students(values['first_name'], values['last_name'], values['student_id'],
+                                      values.get('fuzzy') is True)
+        for match, student in matches:
+            if self.verify_record(student):
+                return match, student
+        return None
+
+    def record_proof(self, record_id):
+        with self.view.snapshot():
+            found = self.view.record_proof(record_id)
+        if found is None:
+            return None
+        record, header, leaves, slot = found
+
+        return {
+            'record_id': record_id,
+            'record': record,
+            'header': header,
+            'path': merkle.merkle_path(leaves, slot),
+        }
+
+
+reader = None
+
+
+def verified_result(values):
+    found = reader.verified(values)
+    if found is None:
+        return {"result" : False}
+    match, student = found
+    return verification(student, match)
+
+
+@app.route('/verify', methods=['POST'])
+def verify_student():
+    values = request.get_json()
+
+    required = ['first_name', 'last_name', 'student_id']
+    if not all(k in values for k in required):
+        return 'Missing values', 400
+
+    return jsonify(verified_result(values)), 200
+
+
+@app.route('/verify/batch', methods=['POST'])
+def verify_students():
+    queries = request.get_json(silent=True)
+    if not isinstance(queries, list):
+        return 'Expected a JSON array of students', 400
+
+    required = ['first_name', 'last_name', 'student_id']
+    results = []
+    for values in queries:
+        if isinstance(values, dict) and all(k in values for k in required):
+            results.append(verified_result(values))
+        else:
+            results.append({"result" : False, "error" : 'Missing values'})
+
+    return jsonify({'results': results}), 200
+
+
+@app.route('/proof/<record_id>', methods=['GET'])
+def record_proof(record_id):
+    proof = reader.record_proof(record_id)
+    if proof is None:
+        return 'Unknown record', 404
+    return negotiated(proof), 200
+
+
+@app.route('/chain', methods=['GET'])
+def full_chain():
+    view = reader.view
+    # Held until the response has been sent, so the blocks streamed match the ETag
+    view.begin()
+    length, tip = view.tip()
+    cached = not_modified(tip)
+    if cached is not None:
+        view.end()
+        return cached
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', length, type=int)
+    end = min(length, offset + max(limit, 0))
+
+    def generate():
+        yield '{"chain": ['
+        for position, block in enumerate(view.blocks(offset, end)):
+            if position:
+                yield ', '
+            yield json.dumps(block)
+        yield f'], "length": {length}}}'
+
+    response = Response(generate(), mimetype='application/json')
+    response.call_on_close(view.end)
+    response.set_etag(tip)
+    return response
+
+
+@app.route('/chain/length', methods=['GET'])
+def chain_length():
+    length, tip = reader.view.tip()
+    cached = not_modified(tip)
+    if cached is not None:
+        return cached
+
+    response = jsonify({
+        'length': length,
+        'hash': tip,
+    })
+    response.set_etag(tip)
+    return response
+
+
+@app.route('/chain/headers', methods=['GET'])
+def chain_headers():
+    with reader.view.snapshot() as view:
+        length, _ = view.tip()
+        start = max(request.args.get('from', 0, type=int), 0)
+        end = min(request.args.get('to', length, type=int), length, start + MAX_HEADERS_PER_REQUEST)
+        headers = view.headers(start, end)
+
+    response = {
+        'headers': headers,
+        'length': length,
+    }
+    return negotiated(response), 200
+
+
+@app.route('/blocks', methods=['GET'])
+def blocks():
+    with reader.view.snapshot() as view:
+        length, _ = view.tip()
+        start = max(request.args.get('from', 0, type=int), 0)
+        end = request.args.get('to', length, type=int)
+        end = min(end, length, start + MAX_BLOCKS_PER_REQUEST)
+        blocks = list(view.blocks(start, end))
+
+    response = {
+        'blocks': blocks,
+        'length': length,
+    }
+    return negotiated(response), 200
+
+
+def serve(path, fd, host, port):
+    """
+    Run one worker, accepting connections on a socket shared with the others
+    :param path: Path of the SQLite chain database
+    :param fd: File descriptor of the listening socket
+    """
+
+    global reader
+    # Each process opens its own connection; they must not cross a fork
+    reader = ReadNode(path)
+    server = make_server(host, port, app, fd=fd)
+
+    # Stop along with the node, however it was stopped
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            sleep(PARENT_CHECK_INTERVAL)
+        server.shutdown()
+    Thread(target=watch, daemon=True).start()
+    server.serve_forever()
+
+
+def start_workers(path, port, workers, host='0.0.0.0'):
+    """
+    Start worker processes answering reads from a chain database. They share
+    one listening socket, and the kernel hands each connection to one of them.
+    :param path: Path of the SQLite chain database, written by the node
+    :param port: Port the workers listen on
+    :param workers: Number of worker processes
+    :return: List of the worker processes
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=serve, args=(path, sock.fileno(), host, port), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    sock.close()
+    logger.info('Started %d read workers on port %d', workers, port)
+    return processes
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', default=5100, type=int, help='port to listen on')
+    parser.add_argument('-f', '--chain-file', required=True, type=str, help='SQLite chain file written by a node started with --read-workers')
+    parser.add_argument('-n', '--workers', default=multiprocessing.cpu_count(), type=int, help='number of worker processes')
+    parser.add_argument('-l', '--log-level', default='INFO', type=str, help='logging level')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    for process in start_workers(args.chain_file, args.port, args.workers):
+        process.join()
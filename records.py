@@ -0,0 +1,163 @@
+import sys
+
+import merkle
+
+STUDENT_FIELDS = ['first_name', 'last_name', 'student_id', 'date_enrolled_through']
+
+
+def valid_field(value):
+    """
+    Check that a value can go in one of the STUDENT_FIELDS: a string or a number
+    """
+
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def valid_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class StudentRecord:
+    """
+    A signed student record. Records use __slots__ instead of a dict, share
+    one copy of each institution name and keep their signature as raw bytes;
+    to_dict gives the JSON shape used by the API, the Merkle tree and peers.
+    """
+
+    __slots__ = ('first_name', 'last_name', 'student_id', 'date_enrolled_through', 'institution_name', 'signature')
+
+    def __init__(self, first_name, last_name, student_id, date_enrolled_through, institution_name, signature=b''):
+        """
+        :param signature: <bytes> The institution's signature over sign_string()
+        """
+
+        self.first_name = first_name
+        self.last_name = last_name
+        self.student_id = student_id
+        self.date_enrolled_through = date_enrolled_through
+        self.institution_name = sys.intern(institution_name)
+        self.signature = signature
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Build a record from its JSON shape
+        :param values: Dict with the fields in STUDENT_FIELDS, institution_name and a hex signature
+        :raises KeyError, TypeError, ValueError: If the dict is not a student record
+        """
+
+        fields = [values[field] for field in STUDENT_FIELDS]
+        if not all(valid_field(value) for value in fields) or not isinstance(values['institution_name'], str):
+            raise TypeError('student record fields must be strings or numbers')
+        return cls(*fields, values['institution_name'], bytes.fromhex(values['signature']))
+
+    def to_dict(self):
+        return {
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'student_id': self.student_id,
+            'date_enrolled_through': self.date_enrolled_through,
+            'institution_name': self.institution_name,
+            'signature': self.signature.hex(),
+        }
+
+    @property
+    def signature_hex(self):
+        return self.signature.hex()
+
+    def sign_string(self):
+        """
+        The string an institution signs for this record
+        """
+
+        return str(self.first_name) + str(self.last_name) + str(self.student_id) + str(self.date_enrolled_through) + str(self.institution_name)
+
+    def record_id(self):
+        """
+        Merkle leaf hash of the record, which identifies it in the chain
+        """
+
+        return merkle.leaf_hash(self.to_dict())
+
+    def __eq__(self, other):
+        return isinstance(other, StudentRecord) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'StudentRecord({self.to_dict()!r})'
+
+
+class Block:
+    """
+    A block of the chain, holding its students as StudentRecords.
+    merkle_root and difficulty are None for blocks made before blocks carried them.
+    producer and signature are only set on blocks made by proof of authority,
+    signature being the producing institution's signature as bytes.
+    """
+
+    __slots__ = ('index', 'timestamp', 'students', 'merkle_root', 'difficulty', 'proof', 'previous_hash',
+                 'producer', 'signature')
+
+    def __init__(self, index, timestamp, students, merkle_root, proof, previous_hash, difficulty=None,
+                 producer=None, signature=None):
+        self.index = index
+        self.timestamp = timestamp
+        self.students = students
+        self.merkle_root = merkle_root
+        self.difficulty = difficulty
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.producer = producer
+        self.signature = signature
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Build a block from its JSON shape. Fields are checked to have the types
+        blocks are made with, since a peer's block is compared and hashed by them.
+        :raises KeyError, TypeError, ValueError: If the dict is not a block
+        """
+
+        index, timestamp, proof, difficulty = values['index'], values['timestamp'], values['proof'], values.get('difficulty')
+        if not (valid_int(index) and valid_int(proof) and (difficulty is None or valid_int(difficulty))):
+            raise TypeError('index, proof and difficulty must be integers')
+        if not valid_field(timestamp) or isinstance(timestamp, str):
+            raise TypeError('timestamp must be a number')
+        if not isinstance(values['previous_hash'], str):
+            raise TypeError('previous_hash must be a string')
+        for key in ('merkle_root', 'producer', 'signature'):
+            if values.get(key) is not None and not isinstance(values[key], str):
+                raise TypeError(f'{key} must be a string')
+        if not isinstance(values['students'], list):
+            raise TypeError('students must be a list')
+
+        students = [StudentRecord.from_dict(student) for student in values['students']]
+        signature = values.get('signature')
+        return cls(index, timestamp, students, values.get('merkle_root'), proof, values['previous_hash'], difficulty,
+                   values.get('producer'), None if signature is None else bytes.fromhex(signature))
+
+    def to_dict(self, students=True):
+        """
+        The JSON shape of the block
+        :param students: False to leave the students out, as in a header
+        """
+
+        block = {'index': self.index, 'timestamp': self.timestamp}
+        if students:
+            block['students'] = [student.to_dict() for student in self.students]
+        if self.merkle_root is not None:
+            block['merkle_root'] = self.merkle_root
+        if self.difficulty is not None:
+            block['difficulty'] = self.difficulty
+        block['proof'] = self.proof
+        block['previous_hash'] = self.previous_hash
+        if self.producer is not None:
+            block['producer'] = self.producer
+        if self.signature is not None:
+            block['signature'] = self.signature.hex()
+        return block
+
+    def __eq__(self, other):
+        return isinstance(other, Block) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'Block({self.to_dict()!r})'
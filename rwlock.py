@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from threading import Condition, get_ident
+
+
+class ReadWriteLock:
+    """
+    Lets any number of threads read at once, or one thread write.
+    Writers waiting for the lock go ahead of readers that arrive after
+    them, so a steady stream of readers cannot hold a writer off. The
+    thread holding the write lock may take it again, for reading or
+    writing; a reader must not take the lock again or upgrade to writing.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.readers = 0
+        self.writer = None
+        # How many times the writing thread holds the lock
+        self.writes = 0
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            nested = self.writer == get_ident()
+            if not nested:
+                while self.writer is not None or self.waiting_writers:
+                    self.condition.wait()
+                self.readers += 1
+        try:
+            yield
+        finally:
+            if not nested:
+                with self.condition:
+                    self.readers -= 1
+                    if not self.readers:
+                        self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = get_ident()
+        with self.condition:
+            if self.writer != me:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+            self.writes += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writes -= 1
+                if not self.writes:
+                    self.writer = None
+                    self.condition.notify_all()
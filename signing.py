@@ -0,0 +1,170 @@
+from multiprocessing import get_context
+from threading import Lock
+
+from Crypto.PublicKey import RSA
+import crypto
+
+# Pools are started from a server process rather than forked from the node, which runs threads
+_context = get_context('forkserver')
+
+# Imported once in each pool worker, never in the process that owns the pool
+_ciph = None
+_key = None
+_public_keys = None
+
+
+def _init_signer(private_key):
+    global _ciph, _key
+    _ciph = crypto.Crypto()
+    _key = RSA.importKey(private_key)
+
+
+def _sign(message):
+    return _ciph.asymmetric_sign(message, _key)
+
+
+def _init_verifier(public_keys):
+    global _ciph, _public_keys
+    _ciph = crypto.Crypto()
+    _public_keys = {name: RSA.importKey(pem) for name, pem in public_keys.items()}
+
+
+def _verify(record):
+    sign_string, signature, institution_name = record
+    public_key = _public_keys.get(institution_name)
+    return public_key is not None and _ciph.asymmetric_verify(sign_string, signature, public_key)
+
+
+class BatchSigner:
+    """
+    Signs many messages with an institution's private key, spread over a
+    pool of worker processes
+    """
+
+    def __init__(self, private_key, workers=1, chunk_size=64):
+        """
+        :param private_key: PEM encoded RSA private key
+        :param workers: Number of signing processes, 1 signs in this process
+        :param chunk_size: Messages handed to a worker at a time
+        """
+
+        self.private_key = private_key
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.lock = Lock()
+        # Used when signing in this process; pool workers import their own
+        self.ciph = None
+        self.key = None
+
+    def sign_all(self, messages):
+        """
+        Sign every message
+        :param messages: List of str
+        :return: List of signatures, in the same order
+        """
+
+        if self.workers <= 1 or len(messages) < self.chunk_size:
+            if self.key is None:
+                self.ciph = crypto.Crypto()
+                self.key = RSA.importKey(self.private_key)
+            return [self.ciph.asymmetric_sign(message, self.key) for message in messages]
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = _context.Pool(self.workers, initializer=_init_signer, initargs=(self.private_key,))
+            return self.pool.map(_sign, messages, chunksize=self.chunk_size)
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+
+class BatchVerifier:
+    """
+    Checks many record signatures against the institutions' public keys,
+    spread over a pool of worker processes
+    """
+
+    def __init__(self, workers=1, chunk_size=64):
+        """
+        :param workers: Number of verifying processes, 1 verifies in this process
+        :param chunk_size: Records handed to a worker at a time
+        """
+
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.generation = None
+        # Request threads using each pool, which is only closed once the last of them is done with it
+        self.users = {}
+        # Held to get or replace the pool, not while it verifies
+        self.lock = Lock()
+        # Used when verifying in this process
+        self.ciph = None
+
+    def verify_all(self, records, key_registry):
+        """
+        Verify every record
+        :param records: List of (sign_string, signature, institution_name)
+        :param key_registry: KeyRegistry the public keys come from
+        :return: List of bool, in the same order
+        """
+
+        if self.workers <= 1 or len(records) < self.chunk_size:
+            if self.ciph is None:
+                self.ciph = crypto.Crypto()
+            return [self.verify(record, key_registry) for record in records]
+
+        pool = self.take_pool(key_registry)
+        try:
+            return pool.map(_verify, records, chunksize=self.chunk_size)
+        finally:
+            self.give_back(pool)
+
+    def verify(self, record, key_registry):
+        sign_string, signature, institution_name = record
+        public_key = key_registry.get(institution_name)
+        return public_key is not None and self.ciph.asymmetric_verify(sign_string, signature, public_key)
+
+    def take_pool(self, key_registry):
+        """
+        The pool verifying with the registry's current keys, to give back once done with
+        """
+
+        retired = None
+        with self.lock:
+            # Workers hold their own copies of the keys, so start new ones when the keys change
+            if self.pool is not None and self.generation != key_registry.generation:
+                if not self.users[self.pool]:
+                    del self.users[self.pool]
+                    retired = self.pool
+                self.pool = None
+            if self.pool is None:
+                self.generation = key_registry.generation
+                self.pool = _context.Pool(self.workers, initializer=_init_verifier, initargs=(key_registry.pems,))
+                self.users[self.pool] = 0
+            self.users[self.pool] += 1
+            pool = self.pool
+        if retired is not None:
+            retired.terminate()
+        return pool
+
+    def give_back(self, pool):
+        with self.lock:
+            self.users[pool] -= 1
+            if pool is self.pool or self.users[pool]:
+                return
+            # Replaced while in use, and no longer
+            del self.users[pool]
+        pool.terminate()
+
+    def close(self):
+        with self.lock:
+            pools = list(self.users)
+            self.users = {}
+            self.pool = None
+        for pool in pools:
+            pool.terminate()
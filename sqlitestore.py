@@ -0,0 +1,658 @@
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+from math import ceil
+from queue import Empty, SimpleQueue
+
+import codec
+from records import STUDENT_FIELDS, Block, StudentRecord
+from studentindex import date_key, normalize, similarity, trigrams
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    position INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    header BLOB NOT NULL,
+    block BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS students (
+    position INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    record_id TEXT NOT NULL,
+    first_name,
+    last_name,
+    student_id,
+    record BLOB NOT NULL,
+    normalized_first_name TEXT,
+    normalized_last_name TEXT,
+    normalized_student_id TEXT,
+    PRIMARY KEY (position, slot)
+);
+CREATE INDEX IF NOT EXISTS students_by_name ON students (first_name, last_name, student_id);
+CREATE INDEX IF NOT EXISTS students_by_record ON students (record_id);
+"""
+
+# Names and student ids as studentindex.normalize gives them, added after the table first was
+NORMALIZED_COLUMNS = ['normalized_first_name', 'normalized_last_name', 'normalized_student_id']
+
+NORMALIZED_INDEXES = """
+CREATE INDEX IF NOT EXISTS students_by_normalized_name
+    ON students (normalized_student_id, normalized_first_name, normalized_last_name);
+"""
+
+# Tables of a SQLiteStudentIndex. Names are normalized, expiry is expiry_number(date key).
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    position INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    name_id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    UNIQUE (first_name, last_name)
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    gram TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    PRIMARY KEY (gram, name_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS students (
+    position INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    record_id TEXT NOT NULL,
+    institution_name TEXT NOT NULL,
+    expiry INTEGER,
+    normalized_student_id TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    PRIMARY KEY (position, slot)
+);
+CREATE INDEX IF NOT EXISTS students_by_record ON students (record_id);
+CREATE INDEX IF NOT EXISTS students_by_student_id ON students (normalized_student_id, name_id);
+CREATE INDEX IF NOT EXISTS students_by_name ON students (name_id);
+CREATE INDEX IF NOT EXISTS students_by_institution ON students (institution_name, expiry, position, slot);
+CREATE INDEX IF NOT EXISTS students_by_expiry ON students (expiry, position, slot);
+"""
+
+# Range of SQLite's integers
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1
+
+
+def expiry_number(key):
+    """
+    A date key from studentindex.date_key as one integer that sorts the same
+    :param key: (year, month, day), or None
+    :return: The integer, or None if key is None
+    """
+
+    if key is None:
+        return None
+    year, month, day = key
+    # Years too far off to store sort as the furthest ones that can be
+    return min(max(year * 10000 + month * 100 + day, MIN_INTEGER), MAX_INTEGER)
+
+
+class SQLiteBlockStore:
+    """
+    Chain store in an SQLite database in WAL mode. Each block is kept with
+    its hash and header in the binary encoding from codec, and each student
+    record in a table indexed by name and by record id, so that other
+    processes can answer reads from the database through a ChainView
+    while this one keeps writing. Only one process may write.
+    """
+
+    # The node keeps its own copy of the chain in memory to write from
+    mapped = False
+
+    def __init__(self, path):
+        self.path = path
+        # Used from whichever thread holds the node's chain lock for writing
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript(SCHEMA)
+        self.add_normalized_columns()
+        self.db.executescript(NORMALIZED_INDEXES)
+
+    def add_normalized_columns(self):
+        # Databases written before names were matched normalized lack the columns
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(students)')}
+        missing = [column for column in NORMALIZED_COLUMNS if column not in columns]
+        if not missing:
+            return
+        logger.info('Adding normalized names to block store %s', self.path)
+        with self.transaction():
+            for column in missing:
+                self.db.execute(f'ALTER TABLE students ADD COLUMN {column} TEXT')
+            rows = self.db.execute('SELECT first_name, last_name, student_id, position, slot FROM students').fetchall()
+            self.db.executemany('UPDATE students SET normalized_first_name = ?, normalized_last_name = ?, '
+                                'normalized_student_id = ? WHERE position = ? AND slot = ?',
+                                [(normalize(first_name), normalize(last_name), normalize(student_id), position, slot)
+                                 for first_name, last_name, student_id, position, slot in rows])
+
+    def close(self):
+        self.db.close()
+
+    def load(self, hash_block):
+        """
+        Read the chain back from the database. Each block must link to the
+        stored hash of the one before it and the tip must hash to its stored
+        hash; anything after the first block that does not is dropped.
+        :param hash_block: Function computing the hash of a Block
+        :return: (chain, hashes), empty if the database is new
+        """
+
+        chain, hashes = [], []
+        for position, block_hash, data in self.db.execute('SELECT position, hash, block FROM blocks ORDER BY position'):
+            try:
+                if position != len(chain):
+                    raise ValueError('a block is missing')
+                block = Block.from_dict(codec.loads(data))
+                if hashes and block.previous_hash != hashes[-1]:
+                    raise ValueError('block does not link to the one before it')
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning('Block store %s is damaged after %d blocks: %s', self.path, len(chain), e)
+                break
+            chain.append(block)
+            hashes.append(block_hash)
+
+        if chain and hash_block(chain[-1]) != hashes[-1]:
+            logger.warning('Block store %s has a damaged tip', self.path)
+            chain.pop()
+            hashes.pop()
+
+        with self.transaction():
+            self.truncate(len(chain))
+        return chain, hashes
+
+    @contextmanager
+    def transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def append(self, block, block_hash):
+        """
+        Persist a new block at the end of the chain
+        :param block: Block
+        :param block_hash: Hash of the Block
+        """
+
+        with self.transaction():
+            # position is the rowid, so its maximum is found without scanning the table
+            position = self.db.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM blocks').fetchone()[0]
+            self.write(position, [block], [block_hash])
+
+    def replace(self, fork, blocks, hashes):
+        """
+        Persist a replaced chain. Readers see either the old chain or the new one.
+        :param fork: Number of leading blocks kept from the old chain
+        :param blocks: Blocks of the new chain after the fork
+        :param hashes: Hashes of those blocks
+        """
+
+        with self.transaction():
+            self.truncate(fork)
+            self.write(fork, blocks, hashes)
+
+    def truncate(self, length):
+        self.db.execute('DELETE FROM blocks WHERE position >= ?', (length,))
+        self.db.execute('DELETE FROM students WHERE position >= ?', (length,))
+
+    def write(self, position, blocks, hashes):
+        for offset, (block, block_hash) in enumerate(zip(blocks, hashes)):
+            self.db.execute('INSERT INTO blocks VALUES (?, ?, ?, ?)',
+                            (position + offset, block_hash, codec.dumps(block.to_dict(students=False)),
+                             codec.dumps(block.to_dict())))
+            self.db.executemany('INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (position + offset, slot, student.record_id(), student.first_name, student.last_name,
+                 student.student_id, codec.dumps(student.to_dict()), normalize(student.first_name),
+                 normalize(student.last_name), normalize(student.student_id))
+                for slot, student in enumerate(block.students)
+            ])
+
+
+class ChainView:
+    """
+    Read-only view of a chain kept by an SQLiteBlockStore, for processes
+    that answer reads while another process writes. Blocks are decoded
+    as they are asked for, so the chain is never held in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, isolation_level=None)
+
+    def begin(self):
+        """
+        Read from one version of the chain until end(), however the writer changes it meanwhile
+        """
+
+        self.db.execute('BEGIN')
+
+    def end(self):
+        if self.db.in_transaction:
+            self.db.execute('COMMIT')
+
+    @contextmanager
+    def snapshot(self):
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.end()
+
+    def tip(self):
+        """
+        :return: (length of the chain, hash of its last block)
+        """
+
+        row = self.db.execute('SELECT position, hash FROM blocks ORDER BY position DESC LIMIT 1').fetchone()
+        return (row[0] + 1, row[1]) if row else (0, None)
+
+    def blocks(self, start, end):
+        """
+        The blocks in [start, end), as dicts
+        """
+
+        rows = self.db.execute('SELECT block FROM blocks WHERE position >= ? AND position < ? ORDER BY position',
+                               (start, end))
+        return (codec.loads(data) for data, in rows)
+
+    def headers(self, start, end):
+        """
+        The headers of the blocks in [start, end), with their hashes
+        """
+
+        rows = self.db.execute('SELECT header, hash FROM blocks WHERE position >= ? AND position < ? ORDER BY position',
+                               (start, end))
+        return [dict(codec.loads(data), hash=block_hash) for data, block_hash in rows]
+
+    def locate(self, first_name, last_name, student_id):
+        """
+        Look up the records matching a student, with where they are
+        :return: List of ((block position, position in the block), StudentRecord), oldest first
+        """
+
+        rows = self.db.execute('SELECT position, slot, record FROM students '
+                               'WHERE first_name = ? AND last_name = ? AND student_id = ? ORDER BY position, slot',
+                               (first_name, last_name, student_id))
+        return [((position, slot), StudentRecord.from_dict(codec.loads(data))) for position, slot, data in rows]
+
+    def locate_normalized(self, first_name, last_name, student_id):
+        """
+        Look up the records of a student, ignoring case, spacing and Unicode form
+        :return: List of ((block position, position in the block), StudentRecord), oldest first
+        """
+
+        rows = self.db.execute('SELECT position, slot, record FROM students WHERE normalized_student_id = ? '
+                               'AND normalized_first_name = ? AND normalized_last_name = ? ORDER BY position, slot',
+                               (normalize(student_id), normalize(first_name), normalize(last_name)))
+        return [((position, slot), StudentRecord.from_dict(codec.loads(data))) for position, slot, data in rows]
+
+    def with_student_id(self, student_id):
+        """
+        The records with a student id, ignoring case, spacing and Unicode form
+        :return: List of ((normalized first name, normalized last name), (block position, position in the block),
+                 StudentRecord), oldest first
+        """
+
+        rows = self.db.execute('SELECT normalized_first_name, normalized_last_name, position, slot, record FROM students '
+                               'WHERE normalized_student_id = ? ORDER BY position, slot', (normalize(student_id),))
+        return [((first_name, last_name), (position, slot), StudentRecord.from_dict(codec.loads(data)))
+                for first_name, last_name, position, slot, data in rows]
+
+    def record_proof(self, record_id):
+        """
+        The record with the given id, the header of its block and the record ids of
+        every record in that block, in order
+        :return: (record, header, leaves, slot), or None if there is no such record
+        """
+
+        row = self.db.execute('SELECT position, slot, record FROM students WHERE record_id = ? '
+                              'ORDER BY position LIMIT 1', (record_id,)).fetchone()
+        if row is None:
+            return None
+        position, slot, record = row
+        header = self.headers(position, position + 1)[0]
+        leaves = [leaf for leaf, in self.db.execute('SELECT record_id FROM students WHERE position = ? ORDER BY slot',
+                                                    (position,))]
+        return codec.loads(record), header, leaves, slot
+
+
+class SQLiteStudentIndex:
+    """
+    Student index of a chain kept by a BlockStore, held in an SQLite file
+    beside the block log rather than in memory, so that neither memory nor
+    the time to restart a node grows with the chain. It answers the same
+    queries as StudentIndex. Each record is stored alongside where it is, so
+    a record that is looked up is read on its own rather than with the rest
+    of its block: its STUDENT_FIELDS as a JSON array, which decodes faster
+    than the binary encoding one record at a time, and its signature as bytes.
+
+    The hash of every block indexed is kept too. A restarted node only
+    indexes the blocks it stored but did not get to index, and drops any
+    the block log no longer has, so the index is not written durably: a
+    write lost in a crash is made again on the next start.
+    """
+
+    def __init__(self, path, hash_block):
+        """
+        :param path: Path of the database, created if it does not exist
+        :param hash_block: Function computing the hash of a Block
+        """
+
+        self.path = path
+        self.hash_block = hash_block
+        # Used from whichever thread holds the node's chain lock for writing
+        self.db = self.connect()
+        self.db.executescript(INDEX_SCHEMA)
+        # Connections for the threads reading, which are taken and given back by reading()
+        self.readers = SimpleQueue()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    transaction = SQLiteBlockStore.transaction
+
+    @contextmanager
+    def reading(self):
+        # Readers share no connection, so they run at the same time
+        try:
+            db = self.readers.get_nowait()
+        except Empty:
+            db = self.connect()
+        try:
+            yield db
+        finally:
+            self.readers.put(db)
+
+    def close(self):
+        self.db.close()
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except Empty:
+                return
+
+    def sync(self, chain, hashes):
+        """
+        Bring the index in line with a chain loaded from the block log. The
+        blocks indexed before are kept as far as they agree with the chain.
+        :param chain: The chain
+        :param hashes: Hash of every block in the chain
+        """
+
+        indexed = self.db.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM blocks').fetchone()[0]
+        # A block being the same commits to every block before it being the same
+        low, high = 0, min(indexed, len(hashes))
+        while low < high:
+            middle = (low + high + 1) // 2
+            stored = self.db.execute('SELECT hash FROM blocks WHERE position = ?', (middle - 1,)).fetchone()[0]
+            if stored == hashes[middle - 1]:
+                low = middle
+            else:
+                high = middle - 1
+        if low == indexed == len(chain):
+            return
+
+        logger.info('Indexing %d blocks of %s', len(chain) - low, self.path)
+        with self.transaction():
+            self.truncate(low)
+            for position in range(low, len(chain)):
+                self.insert(position, self.entries(chain[position]))
+
+    def entries(self, block):
+        """
+        What the index keeps of a block, worked out without changing the index,
+        so that a block that cannot be indexed leaves it as it was
+        :param block: Block
+        :return: (hash of the block, [(slot, record id, institution_name, expiry number, normalized student_id,
+                 normalized first_name, normalized last_name, fields as JSON, signature)])
+        """
+
+        rows = []
+        for slot, student in enumerate(block.students):
+            fields = json.dumps([getattr(student, field) for field in STUDENT_FIELDS])
+            rows.append((slot, student.record_id(), student.institution_name,
+                         expiry_number(date_key(student.date_enrolled_through)), normalize(student.student_id),
+                         normalize(student.first_name), normalize(student.last_name), fields, student.signature))
+        return self.hash_block(block), rows
+
+    def add_block(self, position, block, entries=None):
+        """
+        Index every student record in a block
+        :param position: Position of the block in the chain
+        :param block: Block
+        :param entries: The block's entries(), if they have been worked out already
+        """
+
+        with self.transaction():
+            self.insert(position, self.entries(block) if entries is None else entries)
+
+    def add_blocks(self, start, blocks):
+        """
+        Index the records of consecutive blocks
+        :param start: Position of the first block in the chain
+        :param blocks: The blocks
+        """
+
+        with self.transaction():
+            for position, block in enumerate(blocks, start):
+                self.insert(position, self.entries(block))
+
+    def replace_chain(self, old_chain, new_chain, fork, added=None):
+        """
+        Bring the index in line with a replaced chain. Only the blocks
+        after the point where both chains agree are touched.
+        :param old_chain: The chain that is being replaced
+        :param new_chain: The chain that replaces it
+        :param fork: Number of leading blocks both chains share
+        :param added: entries() of each block of new_chain after the fork, if they have been worked out already
+        """
+
+        if added is None:
+            added = [self.entries(new_chain[position]) for position in range(fork, len(new_chain))]
+        with self.transaction():
+            self.truncate(fork)
+            for position, entries in enumerate(added, fork):
+                self.insert(position, entries)
+
+    def truncate(self, length):
+        # Names stay numbered and in the trigram index, with fewer or no records
+        self.db.execute('DELETE FROM blocks WHERE position >= ?', (length,))
+        self.db.execute('DELETE FROM students WHERE position >= ?', (length,))
+
+    def insert(self, position, entries):
+        block_hash, rows = entries
+        self.db.execute('INSERT INTO blocks VALUES (?, ?)', (position, block_hash))
+        for slot, record_id, institution_name, expiry, student_id, first_name, last_name, fields, signature in rows:
+            self.db.execute('INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (position, slot, record_id, institution_name, expiry, student_id,
+                             self.name_id(first_name, last_name), fields, signature))
+
+    def name_id(self, first_name, last_name):
+        # The number of a normalized name, adding it and its trigrams if it is new
+        row = self.db.execute('SELECT name_id FROM names WHERE first_name = ? AND last_name = ?',
+                              (first_name, last_name)).fetchone()
+        if row is not None:
+            return row[0]
+        name_id = self.db.execute('INSERT INTO names (first_name, last_name) VALUES (?, ?)',
+                                  (first_name, last_name)).lastrowid
+        self.db.executemany('INSERT INTO trigrams VALUES (?, ?)',
+                            [(gram, name_id) for gram in trigrams(f'{first_name} {last_name}')])
+        return name_id
+
+    def student(self, chain, position, slot):
+        """
+        A record the index located, decoded from the index rather than its block
+        :param chain: The chain the index is over
+        :return: StudentRecord
+        """
+
+        with self.reading() as db:
+            row = db.execute('SELECT fields, institution_name, signature FROM students WHERE position = ? AND slot = ?',
+                             (position, slot)).fetchone()
+        return self.record(*row)
+
+    @staticmethod
+    def record(fields, institution_name, signature):
+        return StudentRecord(*json.loads(fields), institution_name, signature)
+
+    def find(self, chain, first_name, last_name, student_id):
+        """
+        Look up the records matching a student
+        :param chain: The chain the index is over
+        :return: List of matching student records, oldest first
+        """
+
+        return [student for _, student in self.exact(first_name, last_name, student_id)]
+
+    def exact(self, first_name, last_name, student_id):
+        # Found by their normalized names, as every record that matches exactly is among those
+        key = (first_name, last_name, student_id)
+        return [(location, student) for location, student in self.normalized(first_name, last_name, student_id)
+                if (student.first_name, student.last_name, student.student_id) == key]
+
+    def normalized(self, first_name, last_name, student_id):
+        with self.reading() as db:
+            rows = db.execute('SELECT position, slot, fields, institution_name, signature FROM students '
+                              'JOIN names USING (name_id) WHERE normalized_student_id = ? AND first_name = ? '
+                              'AND last_name = ? ORDER BY position, slot',
+                              (normalize(student_id), normalize(first_name), normalize(last_name))).fetchall()
+        return [((position, slot), self.record(*record)) for position, slot, *record in rows]
+
+    def locate_student(self, first_name, last_name, student_id):
+        """
+        Where the records matching a student are
+        :return: [(block position, position in the block)], oldest first
+        """
+
+        return [location for location, _ in self.exact(first_name, last_name, student_id)]
+
+    def locate(self, record_id):
+        """
+        Where a record is in the chain
+        :param record_id: Merkle leaf hash of the record
+        :return: (block position, position in the block), or None if it is not indexed
+        """
+
+        with self.reading() as db:
+            # The latest copy of a record, as StudentIndex keeps
+            return db.execute('SELECT position, slot FROM students WHERE record_id = ? '
+                              'ORDER BY position DESC, slot DESC LIMIT 1', (record_id,)).fetchone()
+
+    def with_student_id(self, student_id, offset, limit):
+        """
+        Records with a student_id, oldest first
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        with self.reading() as db:
+            rows = db.execute('SELECT position, slot, fields FROM students WHERE normalized_student_id = ? '
+                              'ORDER BY position, slot', (normalize(student_id),)).fetchall()
+        # Matched exactly, as StudentIndex keys records on their student_id as it is
+        locations = [(position, slot) for position, slot, fields in rows
+                     if json.loads(fields)[STUDENT_FIELDS.index('student_id')] == student_id]
+        return len(locations), locations[offset:offset + limit]
+
+    def of_institution(self, institution_name, enrolled_on, offset, limit):
+        """
+        Records of an institution, in order of date_enrolled_through
+        :param enrolled_on: Date key to only give records enrolled through it or later, or None for all
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        where, args = 'institution_name = ?', (institution_name,)
+        if enrolled_on is not None:
+            where, args = where + ' AND expiry >= ?', args + (expiry_number(enrolled_on),)
+        return self.page(where, args, offset, limit)
+
+    def expiring_before(self, before, offset, limit):
+        """
+        Records whose date_enrolled_through is before a date, soonest first
+        :param before: Date key
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        # Records whose date cannot be read have no expiry, so are left out
+        return self.page('expiry < ?', (expiry_number(before),), offset, limit)
+
+    def page(self, where, args, offset, limit):
+        with self.reading() as db:
+            total = db.execute(f'SELECT COUNT(*) FROM students WHERE {where}', args).fetchone()[0]
+            rows = db.execute(f'SELECT position, slot FROM students WHERE {where} '
+                              'ORDER BY expiry, position, slot LIMIT ? OFFSET ?', args + (limit, offset)).fetchall()
+        return total, rows
+
+    def locate_normalized(self, first_name, last_name, student_id):
+        """
+        Where the records of a student are, ignoring case, spacing and Unicode form
+        :return: [(block position, position in the block)], oldest first
+        """
+
+        return [location for location, _ in self.normalized(first_name, last_name, student_id)]
+
+    def locate_similar(self, first_name, last_name, student_id=None, threshold=0.4, limit=None):
+        """
+        Where the records with names like a student's are, found as StudentIndex.locate_similar finds them
+        :param student_id: Student id the records must have, normalized, or None for any
+        :param threshold: Least similarity of a matching name
+        :param limit: Most records to give, or None for all
+        :return: [(similarity, block position, position in the block)], most similar first
+        """
+
+        first_name, last_name = normalize(first_name), normalize(last_name)
+        grams = trigrams(f'{first_name} {last_name}')
+        if not grams:
+            return []
+
+        with self.reading() as db:
+            if student_id is not None:
+                student_id = normalize(student_id)
+                candidates = db.execute('SELECT DISTINCT name_id, first_name, last_name FROM students '
+                                        'JOIN names USING (name_id) WHERE normalized_student_id = ?',
+                                        (student_id,)).fetchall()
+            else:
+                # The names in the lists of all but the longest trigrams it need not share, as in StudentIndex
+                needed = max(1, ceil(threshold * len(grams)))
+                counts = sorted((db.execute('SELECT COUNT(*) FROM trigrams WHERE gram = ?', (gram,)).fetchone()[0], gram)
+                                for gram in grams)
+                shortest = [gram for _, gram in counts[:len(grams) - needed + 1]]
+                candidates = db.execute('SELECT DISTINCT name_id, first_name, last_name FROM trigrams '
+                                        f'JOIN names USING (name_id) WHERE gram IN ({", ".join("?" * len(shortest))})',
+                                        shortest).fetchall()
+
+            scored = []
+            for name_id, first, last in candidates:
+                score = similarity(grams, trigrams(f'{first} {last}'))
+                if score >= threshold:
+                    scored.append((score, name_id))
+            scored.sort(key=lambda match: (-match[0], match[1]))
+
+            found = []
+            for score, name_id in scored:
+                # As many as are still wanted, -1 being no limit
+                wanted = -1 if limit is None else limit - len(found)
+                if student_id is None:
+                    rows = db.execute('SELECT position, slot FROM students WHERE name_id = ? '
+                                      'ORDER BY position, slot LIMIT ?', (name_id, wanted))
+                else:
+                    rows = db.execute('SELECT position, slot FROM students WHERE normalized_student_id = ? '
+                                      'AND name_id = ? ORDER BY position, slot LIMIT ?', (student_id, name_id, wanted))
+                found.extend((score, position, slot) for position, slot in rows)
+                if limit is not None and len(found) >= limit:
+                    return found
+            return found
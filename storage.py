@@ -0,0 +1,538 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+from threading import Lock
+
+import codec
+from records import Block
+
+logger = logging.getLogger(__name__)
+
+# Length and CRC-32 of the encoded entry that follows
+ENTRY_HEADER = struct.Struct('>II')
+
+# Offset of a block's entry in the log and the block's hash, one per block in the index
+INDEX_ENTRY = struct.Struct('>Q32s')
+
+# Position in the chain of the first entry of an index segment, which starts each segment but the first
+SEGMENT_HEADER = struct.Struct('>Q')
+
+# Decoded blocks kept in memory, shared by every view of a store
+BLOCK_CACHE_SIZE = 256
+
+
+class BlockStore:
+    """
+    Append-only log of the blocks in a chain. Each entry is a block and
+    its hash in the binary encoding from codec, framed by its length and
+    a CRC-32. Beside the log is an index file with one fixed-width entry
+    per block of the chain: where its entry starts in the log, and its hash.
+
+    The chain is not held in memory. load() returns views that map both
+    files and decode a block only when it is asked for. Neither file is
+    ever cut short while the node runs, so a view stays valid however the
+    chain changes after it was taken: appending adds an index entry after
+    the ones existing views can see, and replacing the chain appends the
+    new blocks to the log and their entries to a new index segment.
+    Blocks dropped by a replacement stay in the log, unindexed, until the
+    log is compacted.
+
+    The index is kept in segments. The first, "<file>.idx", starts at the
+    start of the chain, and "<file>.idx.<n>" at the position in its
+    header. Each segment holds the chain from where it starts up to where
+    the next one does, and the last one holds the rest, so a replacement
+    writes only the entries of the blocks after the fork. A segment made
+    after another and starting no later than it takes its place. Segments
+    are merged whenever one is no more than twice the size of the next, so
+    there are only logarithmically many.
+    """
+
+    # The node reads its chain back through views() rather than keeping it in lists
+    mapped = True
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        # (sequence number, position of the first entry) of each segment of the index in use
+        self.segments = [(0, 0)]
+        self.cache = OrderedDict()
+        self.cache_lock = Lock()
+
+    def load(self, hash_block):
+        """
+        Open the chain kept in the log. The index is trusted up to its last
+        entry, which must still match the log; a tip cut short by a crash is
+        dropped. Without an index, the log is read through and one is written.
+        :param hash_block: Function computing the hash of a Block
+        :return: (chain, hashes) views, empty if there is no log yet
+        """
+
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        with open(self.path, 'rb') as log:
+            start = log.read(1)
+        if start == b'{':
+            with open(self.path, 'rb') as log:
+                self.migrate(log.read(), hash_block)
+        elif not os.path.exists(self.index_path):
+            self.reindex(hash_block)
+        self.segments = self.live_segments()
+
+        chain, hashes = self.views()
+        length = len(chain)
+        while length and not self.valid_tip(chain, hashes, length, hash_block):
+            logger.warning('Block log %s has a damaged tip', self.path)
+            length -= 1
+
+        # Anything after the tip's entry was never indexed
+        if length:
+            offset = chain.index.offset(length - 1)
+            end = offset + ENTRY_HEADER.size + ENTRY_HEADER.unpack_from(chain.log, offset)[0]
+        else:
+            end = 0
+        del chain, hashes
+        self.cut(length)
+        with open(self.path, 'r+b') as log:
+            log.truncate(end)
+        # A dropped tip may have been cached where the next block will be written
+        self.cache.clear()
+        return self.views()
+
+    def valid_tip(self, chain, hashes, length, hash_block):
+        try:
+            offset = chain.index.offset(length - 1)
+            entry_length, checksum = ENTRY_HEADER.unpack_from(chain.log, offset)
+            payload = chain.log[offset + ENTRY_HEADER.size:offset + ENTRY_HEADER.size + entry_length]
+            if len(payload) != entry_length or zlib.crc32(payload) != checksum:
+                return False
+            return hash_block(chain.decode(offset)) == hashes[length - 1]
+        except (ValueError, KeyError, TypeError, struct.error):
+            return False
+
+    def reindex(self, hash_block):
+        """
+        Write the index for a log that has none, as logs made before there
+        was an index. The log is replayed: a block that goes in the place of
+        one already in the chain replaced the blocks from there on, so it must
+        link to the block before that place. Anything after the first entry
+        that does not is cut off.
+        """
+
+        with open(self.path, 'rb') as log:
+            data = log.read()
+
+        entries, hashes = [], []
+        offset = 0
+        while offset < len(data):
+            try:
+                length, checksum = ENTRY_HEADER.unpack_from(data, offset)
+                payload = data[offset + ENTRY_HEADER.size:offset + ENTRY_HEADER.size + length]
+                if len(payload) != length or zlib.crc32(payload) != checksum:
+                    # A write cut short by a crash, or a damaged entry
+                    raise ValueError('entry does not match its checksum')
+                entry = codec.loads(payload)
+                block, block_hash = Block.from_dict(entry['block']), entry['hash']
+                position = block.index - 1
+                if not 0 <= position <= len(hashes):
+                    raise ValueError('block is not in the chain')
+                if position and block.previous_hash != hashes[position - 1]:
+                    raise ValueError('block does not link to the one before it')
+            except (ValueError, KeyError, TypeError, struct.error) as e:
+                logger.warning('Block log %s is damaged after %d blocks: %s', self.path, len(hashes), e)
+                break
+            del entries[position:], hashes[position:]
+            entries.append(INDEX_ENTRY.pack(offset, bytes.fromhex(block_hash)))
+            hashes.append(block_hash)
+            offset += ENTRY_HEADER.size + length
+
+        logger.info('Indexing %d blocks in block log %s', len(hashes), self.path)
+        self.remove_segments()
+        self.write_segment(0, 0, b''.join(entries))
+
+    def migrate(self, data, hash_block):
+        """
+        Rewrite a log from before the binary encoding, which held one JSON line per block
+        """
+
+        chain, hashes = [], []
+        for line in data.splitlines(keepends=True):
+            try:
+                entry = json.loads(line)
+                block, block_hash = Block.from_dict(entry['block']), entry['hash']
+                if hashes and block.previous_hash != hashes[-1]:
+                    raise ValueError('block does not link to the one before it')
+            except (ValueError, KeyError, TypeError):
+                break
+            if not line.endswith(b'\n'):
+                break
+            chain.append(block)
+            hashes.append(block_hash)
+
+        if chain and hash_block(chain[-1]) != hashes[-1]:
+            chain.pop()
+            hashes.pop()
+
+        logger.info('Converting block log %s to the binary format', self.path)
+        open(self.path, 'wb').close()
+        self.remove_segments()
+        self.write_segment(0, 0, self.write(chain, hashes))
+
+    def views(self, length=None):
+        """
+        The chain as it is in the files now
+        :param length: Number of blocks to include, all of the indexed ones by default
+        :return: (MappedChain, MappedHashes)
+        """
+
+        log = self.map(self.path)
+        index = MappedIndex([(first, self.map(self.segment_path(sequence)), SEGMENT_HEADER.size if sequence else 0)
+                             for sequence, first in self.segments])
+        if length is None:
+            length = len(index)
+        return MappedChain(self, log, index, 0, length), MappedHashes(index, 0, length)
+
+    @staticmethod
+    def map(path):
+        with open(path, 'rb') as mapped:
+            if os.fstat(mapped.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(mapped.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def segment_path(self, sequence):
+        return f'{self.index_path}.{sequence}' if sequence else self.index_path
+
+    def stored_segments(self):
+        """
+        Every segment of the index on disk, clearing away any left half written
+        :return: [(sequence number, position of the first entry)], oldest first
+        """
+
+        directory, name = os.path.split(self.index_path)
+        segments = [(0, 0)]
+        for file_name in os.listdir(directory or '.'):
+            if not file_name.startswith(name + '.'):
+                continue
+            path = os.path.join(directory, file_name)
+            sequence = file_name[len(name) + 1:]
+            if sequence.isdigit():
+                with open(path, 'rb') as segment:
+                    header = segment.read(SEGMENT_HEADER.size)
+                segments.append((int(sequence), SEGMENT_HEADER.unpack(header)[0]))
+            elif file_name.endswith('.new'):
+                os.remove(path)
+        return sorted(segments)
+
+    def live_segments(self):
+        """
+        The segments of the index holding the chain, removing those another took the place of
+        :return: [(sequence number, position of the first entry)], oldest first
+        """
+
+        live, start = [], None
+        for sequence, first in reversed(self.stored_segments()):
+            if start is None or first < start:
+                live.append((sequence, first))
+                start = first
+            elif sequence:
+                os.remove(self.segment_path(sequence))
+        live.reverse()
+
+        # A segment cut short ends the chain, whatever the segments after it hold
+        for i, (sequence, first) in enumerate(live[:-1]):
+            if first + self.segment_length(sequence) < live[i + 1][1]:
+                for later, _ in live[i + 1:]:
+                    os.remove(self.segment_path(later))
+                return live[:i + 1]
+        return live
+
+    def segment_length(self, sequence):
+        # Number of whole entries in a segment, including any after where the next one starts
+        header = SEGMENT_HEADER.size if sequence else 0
+        return (os.path.getsize(self.segment_path(sequence)) - header) // INDEX_ENTRY.size
+
+    def write_segment(self, sequence, first, entries):
+        """
+        Write a segment of the index in full, taking the place of any segment with its sequence number
+        :param entries: <bytes> Its index entries
+        """
+
+        path = self.segment_path(sequence)
+        with open(path + '.new', 'wb') as segment:
+            if sequence:
+                segment.write(SEGMENT_HEADER.pack(first))
+            segment.write(entries)
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.replace(path + '.new', path)
+
+    def remove_segments(self):
+        for sequence, _ in self.stored_segments():
+            if sequence:
+                os.remove(self.segment_path(sequence))
+        self.segments = [(0, 0)]
+
+    def segment_size(self, i):
+        # Number of blocks of the chain in the i-th segment in use
+        sequence, first = self.segments[i]
+        if i + 1 < len(self.segments):
+            return self.segments[i + 1][1] - first
+        return self.segment_length(sequence)
+
+    def read_entries(self, i):
+        # The entries of the i-th segment in use
+        sequence, _ = self.segments[i]
+        with open(self.segment_path(sequence), 'rb') as segment:
+            segment.seek(SEGMENT_HEADER.size if sequence else 0)
+            return segment.read(self.segment_size(i) * INDEX_ENTRY.size)
+
+    def cut(self, length):
+        """
+        Cut the index down to the first length blocks of the chain. Only done
+        on load, while there are no views of the files.
+        """
+
+        while len(self.segments) > 1 and self.segments[-1][1] >= length:
+            sequence, _ = self.segments.pop()
+            os.remove(self.segment_path(sequence))
+        sequence, first = self.segments[-1]
+        header = SEGMENT_HEADER.size if sequence else 0
+        with open(self.segment_path(sequence), 'r+b') as segment:
+            segment.truncate(header + (length - first) * INDEX_ENTRY.size)
+
+    def cached(self, offset):
+        with self.cache_lock:
+            block = self.cache.get(offset)
+            if block is not None:
+                self.cache.move_to_end(offset)
+            return block
+
+    def remember(self, offset, block):
+        # Entries never move in the log, so a block is cached under where its entry starts
+        with self.cache_lock:
+            self.cache[offset] = block
+            while len(self.cache) > BLOCK_CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def append(self, block, block_hash):
+        """
+        Persist a new block at the end of the chain
+        :param block: Block
+        :param block_hash: Hash of the Block
+        """
+
+        entries = self.write([block], [block_hash])
+        with open(self.segment_path(self.segments[-1][0]), 'ab') as index:
+            index.write(entries)
+            index.flush()
+            os.fsync(index.fileno())
+
+    def replace(self, fork, blocks, hashes):
+        """
+        Persist a replaced chain. The new blocks go at the end of the log and
+        their entries in a new segment of the index starting at the fork,
+        which takes the place of the segments holding the old chain after it.
+        :param fork: Number of leading blocks kept from the old chain
+        :param blocks: Blocks of the new chain after the fork
+        :param hashes: Hashes of those blocks
+        """
+
+        entries = self.write(blocks, hashes)
+        sequence = self.segments[-1][0] + 1
+        self.write_segment(sequence, fork, entries)
+        # The first segment is kept even when none of it is in use, since without it the log is reindexed
+        for replaced, _ in [segment for segment in self.segments if segment[1] >= fork and segment[0]]:
+            os.remove(self.segment_path(replaced))
+        self.segments = [segment for segment in self.segments if segment[1] < fork] + [(sequence, fork)]
+        self.merge()
+
+    def merge(self):
+        """
+        Merge segments of the index in use until each is more than twice the size of the next.
+        A merged segment is written in the place of the earlier one, the later one taking
+        the place of its end until it is removed.
+        """
+
+        i = len(self.segments) - 2
+        while i >= 0:
+            if self.segment_size(i) > 2 * self.segment_size(i + 1):
+                i -= 1
+                continue
+            sequence, first = self.segments[i]
+            self.write_segment(sequence, first, self.read_entries(i) + self.read_entries(i + 1))
+            os.remove(self.segment_path(self.segments[i + 1][0]))
+            del self.segments[i + 1]
+            i = min(i, len(self.segments) - 2)
+
+    def compact(self, hash_block):
+        """
+        Rewrite the log with only the blocks of the chain, dropping those that
+        replacements left in it, and the index as a single segment. Only done
+        while there are no views of the files, before the chain is loaded.
+        :param hash_block: Function computing the hash of a Block
+        """
+
+        chain, hashes = self.load(hash_block)
+        size = os.path.getsize(self.path)
+        entries = []
+        with open(self.path + '.new', 'wb') as log:
+            for position in range(len(chain)):
+                offset = chain.index.offset(position)
+                length = ENTRY_HEADER.size + ENTRY_HEADER.unpack_from(chain.log, offset)[0]
+                entries.append(INDEX_ENTRY.pack(log.tell(), bytes.fromhex(hashes[position])))
+                log.write(chain.log[offset:offset + length])
+            log.flush()
+            os.fsync(log.fileno())
+            compacted = log.tell()
+        del chain, hashes
+
+        # Without an index the log is replayed, so a crash part way through leaves either log readable
+        self.remove_segments()
+        os.remove(self.index_path)
+        os.replace(self.path + '.new', self.path)
+        self.write_segment(0, 0, b''.join(entries))
+        self.cache.clear()
+        logger.info('Compacted block log %s from %d to %d bytes', self.path, size, compacted)
+
+    def write(self, blocks, hashes):
+        """
+        Append blocks to the log
+        :return: <bytes> Their index entries
+        """
+
+        entries = []
+        with open(self.path, 'ab') as log:
+            offset = log.tell()
+            for block, block_hash in zip(blocks, hashes):
+                payload = codec.dumps({'hash': block_hash, 'block': block.to_dict()})
+                log.write(ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                entries.append(INDEX_ENTRY.pack(offset, bytes.fromhex(block_hash)))
+                offset += ENTRY_HEADER.size + len(payload)
+            log.flush()
+            os.fsync(log.fileno())
+        return b''.join(entries)
+
+
+class MappedIndex:
+    """
+    The segments of a chain's index in use, mapped
+    """
+
+    def __init__(self, segments):
+        """
+        :param segments: [(position of the first entry, mapped segment, size of its header)], in order
+        """
+
+        self.firsts = [first for first, _, _ in segments]
+        self.segments = segments
+        first, mapped, header = segments[-1]
+        self.length = first + ((len(mapped) - header) // INDEX_ENTRY.size if mapped is not None else 0)
+
+    def __len__(self):
+        return self.length
+
+    def entry(self, position):
+        # The offset of a block's entry in the log and the block's hash
+        first, mapped, header = self.segments[bisect_right(self.firsts, position) - 1]
+        return INDEX_ENTRY.unpack_from(mapped, header + (position - first) * INDEX_ENTRY.size)
+
+    def offset(self, position):
+        return self.entry(position)[0]
+
+
+class MappedChain(Sequence):
+    """
+    Blocks [start, stop) of a chain kept by a BlockStore. Blocks are decoded
+    from the mapped log when asked for, and slicing gives another view
+    without reading anything.
+    """
+
+    def __init__(self, store, log, index, start, stop):
+        self.store = store
+        self.log = log
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            start, stop, step = position.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return MappedChain(self.store, self.log, self.index, self.start + start, self.start + max(start, stop))
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('chain index out of range')
+        return self.decode(self.index.offset(self.start + position))
+
+    def decode(self, offset):
+        block = self.store.cached(offset)
+        if block is None:
+            length, _ = ENTRY_HEADER.unpack_from(self.log, offset)
+            start = offset + ENTRY_HEADER.size
+            block = Block.from_dict(codec.loads(memoryview(self.log)[start:start + length])['block'])
+            self.store.remember(offset, block)
+        return block
+
+    def __add__(self, blocks):
+        return Joined(self, list(blocks))
+
+
+class MappedHashes(Sequence):
+    """
+    Hashes of blocks [start, stop) of a chain kept by a BlockStore, read from the mapped index
+    """
+
+    def __init__(self, index, start, stop):
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            start, stop, step = position.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return MappedHashes(self.index, self.start + start, self.start + max(start, stop))
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('hash index out of range')
+        return self.index.entry(self.start + position)[1].hex()
+
+    def __add__(self, hashes):
+        return Joined(self, list(hashes))
+
+
+class Joined(Sequence):
+    """
+    A mapped view followed by a list, such as our chain up to a fork followed by a peer's blocks
+    """
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.head) + len(self.tail)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if position < len(self.head):
+            return self.head[position]
+        return self.tail[position - len(self.head)]
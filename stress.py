@@ -0,0 +1,181 @@
+"""
+Concurrency stress test for a node. Run with "python3 stress.py".
+
+Threads enroll students through the Flask app, one at a time and in
+batches, while others verify them, read the chain, mine blocks and swap
+in competing chains that drop the newest blocks. Once everything has
+been mined, every enrolled student must be in the chain exactly once
+and the chain must still be valid.
+"""
+
+import json
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from glob import escape, glob
+from threading import Event, Thread
+from time import sleep
+
+import uninode2
+from storage import BlockStore
+from uninode2 import UniversityNode
+
+
+def guarded(target, errors):
+    # Threads report what went wrong instead of dying quietly
+    def run(*args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(f'{target.__name__}: {e!r}')
+    return run
+
+
+def enroll(thread, students, enrolled):
+    client = uninode2.app.test_client()
+    batch = []
+    for i in range(students):
+        student = {
+            'first_name': f'First{thread}',
+            'last_name': f'Last{i}',
+            'student_id': f'{thread}-{i}',
+            'date_enrolled_through': '12/15/2018',
+        }
+        # Every third student goes through /student/new, the rest in batches of five
+        if i % 3 == 0:
+            response = client.post('/student/new', json=student)
+            assert response.status_code == 201, response.data
+        else:
+            batch.append(student)
+        if len(batch) == 5 or (batch and i == students - 1):
+            response = client.post('/students/batch', json=batch)
+            assert response.status_code == 201 and response.get_json()['rejected'] == 0, response.data
+            batch = []
+        enrolled.append(student)
+
+
+def verify(enrolled, done, counts):
+    client = uninode2.app.test_client()
+    while not done.is_set():
+        if not enrolled:
+            sleep(0.01)
+            continue
+        student = random.choice(enrolled)
+        response = client.post('/verify', json=student)
+        assert response.status_code == 200, response.data
+        counts['verified' if response.get_json()['result'] else 'pending'] += 1
+
+
+def read_chain(done, counts):
+    client = uninode2.app.test_client()
+    while not done.is_set():
+        length = client.get('/chain/length').get_json()['length']
+        chain = json.loads(client.get(f'/chain?offset={max(length - 5, 0)}').data)
+        assert chain['length'] >= length, chain['length']
+        blocks = client.get('/blocks', query_string={'from': max(length - 5, 0)}, headers={'Accept': 'application/json'})
+        assert blocks.status_code == 200, blocks.data
+        counts['reads'] += 1
+
+
+def mine(node, done, counts):
+    while not done.is_set():
+        if not node.current_students:
+            sleep(0.01)
+            continue
+        node.mine()
+        counts['blocks'] += 1
+
+
+def swap_chains(node, rival, swaps, counts):
+    # A rival mines a longer chain from a few blocks back, which the node then adopts
+    for _ in range(swaps):
+        sleep(0.1)
+        chain, hashes, length = node.snapshot()
+        fork = max(1, length - 2)
+        rival.replace_chain(chain[:fork], hashes[:fork])
+        # Keep going until the rival is ahead, as the node is mining too
+        while len(rival.chain) <= len(node.chain):
+            rival.mine()
+        if node.adopt_chain(node.validate_chain(rival.chain)):
+            counts['swaps'] += 1
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-t', '--threads', default=8, type=int, help='threads enrolling students')
+    parser.add_argument('-n', '--students', default=50, type=int, help='students each thread enrolls')
+    parser.add_argument('-v', '--verifiers', default=4, type=int, help='threads verifying students')
+    parser.add_argument('-s', '--swaps', default=5, type=int, help='competing chains swapped in')
+    parser.add_argument('-f', '--chain-file', default=None, type=str, help='keep the chain in a new block log at this path instead of in memory')
+    args = parser.parse_args()
+
+    with open('./berkeley.json') as data_file:
+        institution_properties = json.load(data_file, strict=False)
+    with open('./losangeles.json') as data_file:
+        rival_properties = json.load(data_file, strict=False)
+    # A short target block time keeps the proof of work cheap
+    store = None
+    if args.chain_file:
+        paths = [args.chain_file + suffix for suffix in ('', '.idx', '.students.db', '.students.db-wal', '.students.db-shm')]
+        for path in paths + glob(escape(args.chain_file + '.idx.') + '*'):
+            if os.path.exists(path):
+                os.remove(path)
+        store = BlockStore(args.chain_file)
+    node = UniversityNode(institution_properties, 'berkeley', store=store, target_block_time=0.01)
+    rival = UniversityNode(rival_properties, 'losangeles', target_block_time=0.01)
+    uninode2.node = node
+
+    enrolled = []
+    counts = {'verified': 0, 'pending': 0, 'reads': 0, 'blocks': 0, 'swaps': 0}
+    errors = []
+    done = Event()
+    enrollers = [Thread(target=guarded(enroll, errors), args=(thread, args.students, enrolled))
+                 for thread in range(args.threads)]
+    background = [Thread(target=guarded(verify, errors), args=(enrolled, done, counts)) for _ in range(args.verifiers)]
+    background += [Thread(target=guarded(read_chain, errors), args=(done, counts)),
+                   Thread(target=guarded(mine, errors), args=(node, done, counts))]
+    swapper = Thread(target=guarded(swap_chains, errors), args=(node, rival, args.swaps, counts))
+
+    for thread in enrollers + background + [swapper]:
+        thread.start()
+    for thread in enrollers + [swapper]:
+        thread.join()
+    done.set()
+    for thread in background:
+        thread.join()
+
+    # Mine whatever is still waiting, including records from blocks that were swapped out
+    while node.current_students:
+        node.mine()
+
+    failures = list(errors)
+    validated = node.validate_chain(node.chain)
+    if validated is None or list(validated[1]) != list(node.hashes):
+        failures.append('the chain is not valid')
+    in_chain = {}
+    for block in node.chain:
+        for student in block.students:
+            in_chain[student.student_id] = in_chain.get(student.student_id, 0) + 1
+    for student in enrolled:
+        copies = in_chain.get(student['student_id'], 0)
+        if copies != 1:
+            failures.append(f"student {student['student_id']} is in the chain {copies} times")
+            continue
+        found = node.find_students(student['first_name'], student['last_name'], student['student_id'])
+        if len(found) != 1 or not node.verify_record(found[0]):
+            failures.append(f"student {student['student_id']} does not verify")
+
+    print(f"{len(enrolled)} students enrolled by {args.threads} threads, {len(node.chain)} blocks, "
+          f"{counts['swaps']} chains swapped in")
+    print(f"{counts['verified']} verifications succeeded, {counts['pending']} were not mined yet, "
+          f"{counts['reads']} chain reads")
+    for failure in failures[:20]:
+        print('FAIL:', failure)
+    if failures:
+        sys.exit(1)
+    print('OK: no records lost or duplicated')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from math import ceil
+from threading import Lock
+
+# Sort key of a record whose date_enrolled_through cannot be read, before every real date
+UNKNOWN_DATE = (0, 0, 0)
+
+NO_NAMES = array('I')
+
+
+def normalize(text):
+    """
+    A name or student id as it is compared when case, spacing and the form
+    of Unicode characters should not matter
+    """
+
+    return ' '.join(unicodedata.normalize('NFKC', str(text)).casefold().split())
+
+
+def trigrams(text):
+    """
+    The three-letter pieces of each word of a normalized name, padded so
+    that the start and end of a word count for more
+    """
+
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(grams, other):
+    """
+    Share of trigrams two names have in common, from 0 to 1
+    """
+
+    if not grams or not other:
+        return 0.0
+    return len(grams & other) / len(grams | other)
+
+
+def date_key(date):
+    """
+    Sort key of a date_enrolled_through
+    :param date: Date as MM/DD/YYYY
+    :return: (year, month, day), or None if the date cannot be read
+    """
+
+    try:
+        month, day, year = (int(part) for part in date.split('/'))
+    except (AttributeError, ValueError):
+        return None
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return (year, month, day)
+
+
+class StudentIndex:
+    """
+    In-memory index over the student records stored in a chain.
+    Records are keyed on (first_name, last_name, student_id) so that a
+    verification is a single dictionary lookup instead of a chain scan.
+    Only where each record is in the chain is kept, not the record itself,
+    so the chain can stay on disk.
+
+    Registrar queries go through secondary indexes: a hash index on
+    student_id, and per institution and over all records, lists sorted by
+    date_enrolled_through, so a page of results is found by bisection
+    rather than a scan. The records of a new block are inserted in order;
+    a chain loaded or replaced in bulk is appended and sorted once.
+
+    Names and student ids are also indexed normalized (see normalize), so
+    that misspelled names can be matched by similarity against the names
+    seen with a student id. For searches by name alone, every distinct
+    normalized name is broken into trigrams, in an index built the first
+    time one is made.
+    """
+
+    def __init__(self):
+        # (first_name, last_name, student_id) -> [(block position, position in the block)]
+        self.by_name = {}
+        # record id (Merkle leaf hash) -> (block position, position in the block)
+        self.by_record = {}
+        # student_id -> [(block position, position in the block)]
+        self.by_student_id = {}
+        # institution_name -> [(date key, block position, position in the block)] of its records,
+        # and None -> the same for every record with a readable date
+        self.by_expiry = {None: []}
+        # Keys of by_expiry whose lists are not sorted, while blocks are added in bulk
+        self.unsorted = set()
+        # Normalized (first_name, last_name, student_id) -> [(block position, position in the block)]
+        self.by_normalized = {}
+        # Every normalized (first_name, last_name) seen, numbered in order
+        self.names = []
+        self.name_ids = {}
+        # Name number -> [(block position, position in the block)] of records with that name
+        self.name_records = []
+        # Normalized student_id -> numbers of the names seen with it
+        self.names_by_id = {}
+        # Trigram -> numbers of the names it is in, or None until a search by name needs it
+        self.trigrams = None
+        self.trigram_lock = Lock()
+
+    @staticmethod
+    def key(first_name, last_name, student_id):
+        return (first_name, last_name, student_id)
+
+    def entries(self, block):
+        """
+        What the index keeps of each record in a block, worked out without
+        changing the index, so that a record that cannot be indexed leaves it as it was
+        :param block: Block
+        :return: List of (key, record id, institution_name, date key, normalized key), one per record
+        """
+
+        entries = []
+        for student in block.students:
+            key = self.key(student.first_name, student.last_name, student.student_id)
+            entries.append((key, student.record_id(), student.institution_name,
+                            date_key(student.date_enrolled_through), tuple(normalize(field) for field in key)))
+        return entries
+
+    def add_block(self, position, block, entries=None):
+        """
+        Index every student record in a block
+        :param position: Position of the block in the chain
+        :param block: Block
+        :param entries: The block's entries(), if they have been worked out already
+        """
+
+        self.insert(position, self.entries(block) if entries is None else entries)
+
+    def add_blocks(self, start, blocks):
+        """
+        Index the records of consecutive blocks, as when a chain is loaded
+        :param start: Position of the first block in the chain
+        :param blocks: The blocks
+        """
+
+        self.add_entries(start, (self.entries(block) for block in blocks))
+
+    def add_entries(self, start, added):
+        # Cheaper than inserting every record in order when there are many
+        for position, entries in enumerate(added, start):
+            self.insert(position, entries, keep_sorted=False)
+        for institution_name in self.unsorted:
+            self.by_expiry[institution_name].sort()
+        self.unsorted.clear()
+
+    def insert(self, position, entries, keep_sorted=True):
+        for slot, (key, record_id, institution_name, expiry, normalized) in enumerate(entries):
+            self.by_name.setdefault(key, []).append((position, slot))
+            self.by_record[record_id] = (position, slot)
+            self.by_student_id.setdefault(key[2], []).append((position, slot))
+
+            self.add_expiry(institution_name, (expiry or UNKNOWN_DATE, position, slot), keep_sorted)
+            if expiry is not None:
+                self.add_expiry(None, (expiry, position, slot), keep_sorted)
+
+            first_name, last_name, student_id = normalized
+            self.by_normalized.setdefault(normalized, []).append((position, slot))
+            name_id = self.name_id(first_name, last_name)
+            self.name_records[name_id].append((position, slot))
+            self.names_by_id.setdefault(student_id, set()).add(name_id)
+
+    def add_expiry(self, institution_name, entry, keep_sorted):
+        entries = self.by_expiry.setdefault(institution_name, [])
+        if keep_sorted:
+            insort(entries, entry)
+        else:
+            entries.append(entry)
+            self.unsorted.add(institution_name)
+
+    def name_id(self, first_name, last_name):
+        # The number of a normalized name, adding it and its trigrams if it is new
+        name = (first_name, last_name)
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            self.name_records.append([])
+            if self.trigrams is not None:
+                self.add_trigrams(name_id)
+        return name_id
+
+    def add_trigrams(self, name_id):
+        first_name, last_name = self.names[name_id]
+        for gram in trigrams(f'{first_name} {last_name}'):
+            self.trigrams.setdefault(gram, array('I')).append(name_id)
+
+    def trigram_index(self):
+        """
+        Trigram -> numbers of the names it is in, building the index if this is its first use
+        """
+
+        with self.trigram_lock:
+            if self.trigrams is None:
+                self.trigrams = {}
+                for name_id in range(len(self.names)):
+                    self.add_trigrams(name_id)
+            return self.trigrams
+
+    def remove_block(self, position, block):
+        """
+        Drop the records a block contributed to the index
+        :param position: Position of the block in the chain
+        :param block: Block
+        """
+
+        for slot, student in enumerate(block.students):
+            key = self.key(student.first_name, student.last_name, student.student_id)
+            entries = [entry for entry in self.by_name.get(key, []) if entry[0] != position]
+            if entries:
+                self.by_name[key] = entries
+            else:
+                self.by_name.pop(key, None)
+
+            record_id = student.record_id()
+            if self.by_record.get(record_id, (None,))[0] == position:
+                del self.by_record[record_id]
+
+            entries = [entry for entry in self.by_student_id.get(student.student_id, []) if entry[0] != position]
+            if entries:
+                self.by_student_id[student.student_id] = entries
+            else:
+                self.by_student_id.pop(student.student_id, None)
+
+            expiry = date_key(student.date_enrolled_through)
+            entries = self.expiry_list(student.institution_name)
+            self.discard(entries, (expiry or UNKNOWN_DATE, position, slot))
+            if not entries:
+                self.by_expiry.pop(student.institution_name, None)
+            if expiry is not None:
+                self.discard(self.expiry_list(None), (expiry, position, slot))
+
+            # Names stay numbered and in the trigram index, with fewer or no records
+            normalized = tuple(normalize(field) for field in key)
+            entries = [entry for entry in self.by_normalized.get(normalized, []) if entry[0] != position]
+            if entries:
+                self.by_normalized[normalized] = entries
+            else:
+                self.by_normalized.pop(normalized, None)
+            name_id = self.name_ids[normalized[:2]]
+            self.name_records[name_id] = [entry for entry in self.name_records[name_id] if entry[0] != position]
+
+    @staticmethod
+    def discard(entries, entry):
+        # Remove an entry from a sorted list, if it is there
+        at = bisect_left(entries, entry)
+        if at < len(entries) and entries[at] == entry:
+            del entries[at]
+
+    def expiry_list(self, institution_name):
+        """
+        The records of an institution, or of every institution, sorted by date_enrolled_through
+        :param institution_name: Name of the institution, or None for all of them
+        :return: Sorted [(date key, block position, position in the block)]
+        """
+
+        return self.by_expiry.get(institution_name, [])
+
+    def replace_chain(self, old_chain, new_chain, fork, added=None):
+        """
+        Bring the index in line with a replaced chain. Only the blocks
+        after the point where both chains agree are touched.
+        :param old_chain: The chain that is being replaced
+        :param new_chain: The chain that replaces it
+        :param fork: Number of leading blocks both chains share
+        :param added: entries() of each block of new_chain after the fork, if they have been worked out already
+        """
+
+        if added is None:
+            added = [self.entries(new_chain[position]) for position in range(fork, len(new_chain))]
+        for position in range(fork, len(old_chain)):
+            self.remove_block(position, old_chain[position])
+        self.add_entries(fork, added)
+
+    def student(self, chain, position, slot):
+        """
+        A record the index located
+        :param chain: The chain the index is over
+        :return: StudentRecord
+        """
+
+        return chain[position].students[slot]
+
+    def find(self, chain, first_name, last_name, student_id):
+        """
+        Look up the records matching a student
+        :param chain: The chain the index is over
+        :return: List of matching student records, oldest first
+        """
+
+        return [chain[position].students[slot] for position, slot in self.locate_student(first_name, last_name, student_id)]
+
+    def locate_student(self, first_name, last_name, student_id):
+        """
+        Where the records matching a student are
+        :return: [(block position, position in the block)], oldest first
+        """
+
+        return self.by_name.get(self.key(first_name, last_name, student_id), [])
+
+    def locate(self, record_id):
+        """
+        Where a record is in the chain
+        :param record_id: Merkle leaf hash of the record
+        :return: (block position, position in the block), or None if it is not indexed
+        """
+
+        return self.by_record.get(record_id)
+
+    def with_student_id(self, student_id, offset, limit):
+        """
+        Records with a student_id, oldest first
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        entries = self.by_student_id.get(student_id, [])
+        return len(entries), entries[offset:offset + limit]
+
+    def of_institution(self, institution_name, enrolled_on, offset, limit):
+        """
+        Records of an institution, in order of date_enrolled_through
+        :param enrolled_on: Date key to only give records enrolled through it or later, or None for all
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        entries = self.expiry_list(institution_name)
+        start = bisect_left(entries, (enrolled_on,)) if enrolled_on is not None else 0
+        page = entries[start + offset:start + offset + limit]
+        return len(entries) - start, [(position, slot) for _, position, slot in page]
+
+    def expiring_before(self, before, offset, limit):
+        """
+        Records whose date_enrolled_through is before a date, soonest first
+        :param before: Date key
+        :return: (number of such records, [(block position, position in the block)] of the page)
+        """
+
+        entries = self.expiry_list(None)
+        end = bisect_left(entries, (before,))
+        page = entries[offset:min(offset + limit, end)]
+        return end, [(position, slot) for _, position, slot in page]
+
+    def locate_normalized(self, first_name, last_name, student_id):
+        """
+        Where the records of a student are, ignoring case, spacing and Unicode form
+        :return: [(block position, position in the block)], oldest first
+        """
+
+        return self.by_normalized.get((normalize(first_name), normalize(last_name), normalize(student_id)), [])
+
+    def locate_similar(self, first_name, last_name, student_id=None, threshold=0.4, limit=None):
+        """
+        Where the records with names like a student's are. With a student id,
+        only names seen with that id are compared; without one, the names
+        sharing enough trigrams with the student's are found through the
+        trigram index.
+        :param student_id: Student id the records must have, normalized, or None for any
+        :param threshold: Least similarity of a matching name
+        :param limit: Most records to give, or None for all
+        :return: [(similarity, block position, position in the block)], most similar first
+        """
+
+        first_name, last_name = normalize(first_name), normalize(last_name)
+        grams = trigrams(f'{first_name} {last_name}')
+        if not grams:
+            return []
+
+        if student_id is not None:
+            student_id = normalize(student_id)
+            candidates = self.names_by_id.get(student_id, ())
+        else:
+            # A name at least threshold similar shares that share of our trigrams,
+            # so it is in one of the trigrams' lists of names, leaving out the
+            # longest lists but for as many as it need not share
+            needed = max(1, ceil(threshold * len(grams)))
+            index = self.trigram_index()
+            postings = sorted((index.get(gram, NO_NAMES) for gram in grams), key=len)
+            candidates = set()
+            for names in postings[:len(grams) - needed + 1]:
+                candidates.update(names)
+
+        scored = []
+        for name_id in candidates:
+            name = self.names[name_id]
+            score = similarity(grams, trigrams(f'{name[0]} {name[1]}'))
+            if score >= threshold:
+                scored.append((score, name_id))
+        scored.sort(key=lambda match: (-match[0], match[1]))
+
+        found = []
+        for score, name_id in scored:
+            if student_id is None:
+                locations = self.name_records[name_id]
+            else:
+                locations = self.by_normalized.get(self.names[name_id] + (student_id,), [])
+            found.extend((score, position, slot) for position, slot in locations)
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+        return found
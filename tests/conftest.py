@@ -0,0 +1,17 @@
+import json
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def institution(monkeypatch):
+    """
+    Properties of the institution nodes are started as, run from where the key files are
+    """
+
+    monkeypatch.chdir(ROOT)
+    with open('berkeley.json') as data_file:
+        return json.load(data_file, strict=False)
@@ -0,0 +1,153 @@
+import json
+
+import pytest
+
+import codec
+from records import Block
+
+
+def varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def student(i, **fields):
+    values = {
+        'first_name': f'First{i}',
+        'last_name': f'Last{i}',
+        'student_id': str(3030000000 + i),
+        'date_enrolled_through': '12/15/2018',
+        'institution_name': 'University of California, Berkeley',
+        'signature': 'ab' * 64,
+    }
+    values.update(fields)
+    return values
+
+
+def block(students):
+    return {
+        'index': 2,
+        'timestamp': 1540000000.25,
+        'students': students,
+        'merkle_root': 'cd' * 32,
+        'difficulty': 16,
+        'proof': 35293,
+        'previous_hash': 'ef' * 32,
+    }
+
+
+@pytest.mark.parametrize('value', [
+    None, True, False, 0, 1, -1, 63, -64, 2 ** 70, -2 ** 70, 0.5, -1e300, '', 'text', 'Zoë', [], {},
+    [1, [2, [3]]], {'b': 1, 'a': {'c': None}}, [{'a': 1}, {'b': 2}], [{'a': 1}, 5], [{}], [{}, {}],
+])
+def test_round_trip(value):
+    assert codec.loads(codec.dumps(value)) == value
+
+
+@pytest.mark.parametrize('name', ['ab', 'deadbeef', 'abc', 'AB', 'Ab', '0', '00', 'cafe babe', 'ff' * 100])
+def test_hex_like_strings_round_trip_unchanged(name):
+    # Lowercase hex of even length is stored as raw bytes, anything else as text
+    value = {'first_name': name, 'hashes': [name]}
+    decoded = codec.loads(codec.dumps(value))
+    assert decoded == value
+    assert type(decoded['first_name']) is str
+
+
+def test_negative_and_large_ints_keep_their_value_and_type():
+    values = [-1, -2, -(2 ** 63), 2 ** 63, -129, 128]
+    decoded = codec.loads(codec.dumps(values))
+    assert decoded == values
+    assert all(type(value) is int for value in decoded)
+    # Neither bools nor floats come back as ints
+    assert codec.loads(codec.dumps([True, 1, 1.0])) == [True, 1, 1.0]
+    assert [type(value) for value in codec.loads(codec.dumps([True, 1, 1.0]))] == [bool, int, float]
+
+
+def test_block_round_trips_as_a_table_and_hashes_the_same():
+    students = [student(i) for i in range(10)]
+    # Numbers where a string is expected, and a hex-like name
+    students.append(student(10, student_id=3030000010, first_name='bead'))
+    values = block(students)
+
+    data = codec.dumps(values)
+    decoded = codec.loads(data)
+    assert decoded == values
+    assert json.dumps(decoded, sort_keys=True) == json.dumps(values, sort_keys=True)
+    assert Block.from_dict(decoded).to_dict() == values
+    # The institution name is written once however many students share it
+    assert data.count(b'University of California, Berkeley') == 1
+
+
+def test_rows_with_different_keys_are_not_a_table():
+    rows = [student(0), dict(student(1), extra='x'), student(2)]
+    assert codec.loads(codec.dumps(rows)) == rows
+    rows = [student(0), {key: value for key, value in student(1).items() if key != 'signature'}]
+    assert codec.loads(codec.dumps(rows)) == rows
+
+
+def test_equal_dicts_encode_the_same():
+    assert codec.dumps({'a': 1, 'b': 2}) == codec.dumps({'b': 2, 'a': 1})
+
+
+@pytest.mark.parametrize('data', [b'', b'SC', b'XX\x01\x00\x00', codec.MAGIC + b'\x00\x63'])
+def test_invalid_documents_raise_codec_errors(data):
+    with pytest.raises(codec.CodecError):
+        codec.loads(data)
+
+
+def test_truncated_and_padded_documents_raise_codec_errors():
+    data = codec.dumps(block([student(i) for i in range(3)]))
+    for end in range(len(codec.MAGIC), len(data)):
+        with pytest.raises(codec.CodecError):
+            codec.loads(data[:end])
+    with pytest.raises(codec.CodecError):
+        codec.loads(data + b'\x00')
+
+
+def test_unencodable_values_raise_type_errors():
+    with pytest.raises(TypeError):
+        codec.dumps({'a': object()})
+
+
+@pytest.mark.parametrize('body', [
+    # A table of rows without keys, which would take no bytes however many there were
+    bytes([codec.TABLE]) + varint(0) + varint(3000000),
+    bytes([codec.TABLE]) + varint(0) + varint(2 ** 62),
+    # Counts of items the rest of the document cannot hold
+    bytes([codec.LIST]) + varint(2 ** 62),
+    bytes([codec.LIST]) + varint(3) + bytes([codec.NONE, codec.NONE]),
+    bytes([codec.DICT]) + varint(2 ** 40),
+    bytes([codec.STR]) + varint(2 ** 40) + b'x',
+])
+def test_counts_larger_than_the_document_raise_codec_errors(body):
+    with pytest.raises(codec.CodecError):
+        codec.loads(codec.MAGIC + varint(0) + body)
+
+
+def test_table_rows_must_fit_in_the_document():
+    # Two keys, so each row takes at least two bytes
+    header = codec.MAGIC + varint(2) + varint(1) + b'a' + varint(1) + b'b'
+    table = bytes([codec.TABLE]) + varint(2) + varint(0) + varint(1)
+    assert codec.loads(header + table + varint(2) + bytes([codec.NONE] * 4)) == [{'a': None, 'b': None}] * 2
+    with pytest.raises(codec.CodecError):
+        codec.loads(header + table + varint(3) + bytes([codec.NONE] * 4))
+
+
+def test_string_table_must_fit_in_the_document():
+    with pytest.raises(codec.CodecError):
+        codec.loads(codec.MAGIC + varint(2 ** 40) + bytes([codec.NONE]))
+
+
+def test_nesting_is_limited():
+    value = None
+    for _ in range(codec.MAX_DEPTH):
+        value = [value]
+    assert codec.loads(codec.dumps(value)) == value
+    with pytest.raises(codec.CodecError):
+        codec.loads(codec.dumps([value]))
+    with pytest.raises(codec.CodecError):
+        codec.loads(codec.MAGIC + varint(0) + bytes([codec.LIST, 1]) * 100000 + bytes([codec.NONE]))
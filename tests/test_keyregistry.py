@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+from keyregistry import KeyRegistry
+
+BERKELEY = 'University of California, Berkeley'
+LOS_ANGELES = 'University of California, Los Angeles'
+
+
+@pytest.fixture
+def pems():
+    with open(os.path.join(ROOT, 'publickeys.json')) as pub_file:
+        return json.load(pub_file, strict=False)
+
+
+@pytest.fixture
+def path(tmp_path, pems):
+    path = str(tmp_path / 'publickeys.json')
+    write(path, json.dumps({BERKELEY: pems[BERKELEY]}), 1)
+    return path
+
+
+def write(path, text, mtime):
+    # The registry goes by the file's mtime, set so that every write changes it
+    with open(path, 'w') as pub_file:
+        pub_file.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_keys_are_imported_once(path):
+    registry = KeyRegistry(path)
+    assert registry.get(BERKELEY) is registry.get(BERKELEY)
+    assert registry.get(LOS_ANGELES) is None
+    assert registry.institutions() == [BERKELEY]
+    assert registry.generation == 1
+
+
+def test_changed_file_is_reloaded(path, pems):
+    registry = KeyRegistry(path)
+    write(path, json.dumps(pems), 2)
+    assert registry.get(LOS_ANGELES) is not None
+    assert registry.institutions() == [BERKELEY, LOS_ANGELES]
+    assert registry.generation == 2
+
+
+@pytest.mark.parametrize('text', [
+    '{"University of California, Berkeley": "-----BEGIN PUBLIC',  # Half written
+    '["not", "an", "object"]',
+    '{"University of California, Berkeley": 5}',
+    '{"University of California, Berkeley": "not a key"}',
+])
+def test_malformed_file_keeps_the_keys(path, pems, text):
+    registry = KeyRegistry(path)
+    key = registry.get(BERKELEY)
+    write(path, text, 2)
+    assert registry.get(BERKELEY) is key
+    assert registry.generation == 1
+    # Not read again until it changes, then taken once it is whole
+    assert registry.mtime == 2
+    write(path, json.dumps(pems), 3)
+    assert registry.get(LOS_ANGELES) is not None
+    assert registry.generation == 2
+
+
+def test_missing_file_keeps_the_keys(path):
+    registry = KeyRegistry(path)
+    key = registry.get(BERKELEY)
+    os.remove(path)
+    assert registry.get(BERKELEY) is key
+
+
+def test_malformed_file_at_start_is_an_error(path):
+    write(path, '[]', 2)
+    with pytest.raises(ValueError):
+        KeyRegistry(path)
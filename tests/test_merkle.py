@@ -0,0 +1,68 @@
+import hashlib
+
+import pytest
+
+import merkle
+
+
+def leaves(count):
+    return [merkle.leaf_hash({'student_id': str(i)}) for i in range(count)]
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 6, 7, 9, 13, 16, 17])
+def test_every_leaf_has_a_path_to_the_root(count):
+    hashes = leaves(count)
+    root = merkle.merkle_root(hashes)
+    for position, leaf in enumerate(hashes):
+        assert merkle.verify_path(leaf, merkle.merkle_path(hashes, position), root)
+
+
+@pytest.mark.parametrize('count', [3, 5, 7, 9])
+def test_last_leaf_of_an_odd_level_is_carried_up(count):
+    hashes = leaves(count)
+    path = merkle.merkle_path(hashes, count - 1)
+    # It has no sibling on the first level, so its path is shorter than its neighbour's
+    assert len(path) < len(merkle.merkle_path(hashes, count - 2))
+    assert all(step['side'] == 'left' for step in path)
+
+
+def test_single_leaf_is_its_own_root():
+    hashes = leaves(1)
+    assert merkle.merkle_root(hashes) == hashes[0]
+    assert merkle.merkle_path(hashes, 0) == []
+
+
+def test_empty_block_has_a_fixed_root():
+    assert merkle.merkle_root([]) == hashlib.sha256(b'').hexdigest()
+
+
+@pytest.mark.parametrize('count', [3, 5, 7])
+def test_paths_do_not_verify_other_leaves_or_roots(count):
+    hashes = leaves(count)
+    root = merkle.merkle_root(hashes)
+    changed = merkle.merkle_root(hashes[:-1] + [merkle.leaf_hash({'student_id': 'x'})])
+    for position in range(count):
+        path = merkle.merkle_path(hashes, position)
+        assert not merkle.verify_path(hashes[(position + 1) % count], path, root)
+        assert not merkle.verify_path(hashes[position], path, changed)
+
+
+def test_changing_a_leaf_changes_the_root():
+    hashes = leaves(7)
+    changed = hashes[:6] + [merkle.leaf_hash({'student_id': 'x'})]
+    assert merkle.merkle_root(changed) != merkle.merkle_root(hashes)
+
+
+def test_duplicating_the_odd_leaf_does_not_give_the_same_root():
+    # Trees that pad odd levels by duplicating the last node let [a, b, c] and [a, b, c, c] share a root
+    hashes = leaves(3)
+    assert merkle.merkle_root(hashes) != merkle.merkle_root(hashes + hashes[-1:])
+
+
+def test_a_node_cannot_pass_for_a_leaf():
+    hashes = leaves(4)
+    interior = merkle.node_hash(hashes[0], hashes[1])
+    root = merkle.merkle_root(hashes)
+    assert merkle.verify_path(interior, [{'hash': merkle.node_hash(hashes[2], hashes[3]), 'side': 'right'}], root)
+    # but no record hashes to it as a leaf
+    assert merkle.leaf_hash({'left': hashes[0], 'right': hashes[1]}) != interior
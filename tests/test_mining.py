@@ -0,0 +1,115 @@
+import hashlib
+from time import time
+
+import pytest
+
+from mining import (DEFAULT_DIFFICULTY, MAX_CLOCK_DRIFT, MAX_DIFFICULTY, MIN_DIFFICULTY, RETARGET_BLOCKS,
+                    meets_difficulty, next_difficulty, next_turn, required_difficulty, required_producer, search)
+
+TARGET = 60
+
+
+def window(block_time, difficulty=20, start=1540000000):
+    # The blocks before a retarget, block_time seconds apart
+    return [(start + i * block_time, difficulty) for i in range(RETARGET_BLOCKS)]
+
+
+@pytest.mark.parametrize('block_time, step', [
+    (60, 0), (45, 0), (90, 0), (30, 1), (20, 1), (15, 2), (1, 2), (0, 2), (120, -1), (200, -1), (240, -2), (6000, -2),
+])
+def test_retarget_steps_towards_the_target_block_time(block_time, step):
+    assert next_difficulty(RETARGET_BLOCKS * 3, window(block_time), TARGET) == 20 + step
+
+
+def test_difficulty_only_changes_every_retarget_blocks():
+    for position in range(RETARGET_BLOCKS * 3 + 1, RETARGET_BLOCKS * 4):
+        assert next_difficulty(position, window(1), TARGET) == 20
+    # Nor before there are enough blocks to measure
+    assert next_difficulty(RETARGET_BLOCKS, window(1)[1:], TARGET) == 20
+
+
+def test_retarget_stays_within_bounds():
+    assert next_difficulty(RETARGET_BLOCKS, window(1, MAX_DIFFICULTY), TARGET) == MAX_DIFFICULTY
+    assert next_difficulty(RETARGET_BLOCKS, window(6000, MIN_DIFFICULTY), TARGET) == MIN_DIFFICULTY
+
+
+def test_blocks_without_a_difficulty_are_followed_at_the_default():
+    assert next_difficulty(5, [(0, None)], TARGET) == DEFAULT_DIFFICULTY
+    assert required_difficulty(5, [(0, None)], None, 10, TARGET) == DEFAULT_DIFFICULTY
+    assert required_difficulty(5, [(0, None)], DEFAULT_DIFFICULTY, 10, TARGET) == DEFAULT_DIFFICULTY
+    # Once blocks carry a difficulty, they all must
+    assert required_difficulty(5, [(0, 16)], None, 10, TARGET) is None
+
+
+def test_required_difficulty_checks_the_difficulty_carried():
+    before = window(30)
+    assert required_difficulty(RETARGET_BLOCKS, before, 21, before[-1][0] + 30, TARGET) == 21
+    assert required_difficulty(RETARGET_BLOCKS, before, 20, before[-1][0] + 30, TARGET) is None
+    assert required_difficulty(RETARGET_BLOCKS + 1, before, 20, before[-1][0] + 30, TARGET) == 20
+
+
+def test_timestamps_may_not_go_backwards_or_run_ahead():
+    now = time()
+    before = [(now - 100, 16)]
+    assert required_difficulty(1, before, 16, now - 100, TARGET) == 16
+    assert required_difficulty(1, before, 16, now - 101, TARGET) is None
+    assert required_difficulty(1, before, 16, now + MAX_CLOCK_DRIFT - 10, TARGET) == 16
+    assert required_difficulty(1, before, 16, now + MAX_CLOCK_DRIFT + 10, TARGET) is None
+
+
+@pytest.mark.parametrize('digest, difficulty, meets', [
+    (bytes(32), 64, True), (b'\x00\x00\x7f' + bytes(29), 17, True), (b'\x00\x00\x7f' + bytes(29), 18, False),
+    (b'\x00\x01' + bytes(30), 15, True), (b'\x00\x01' + bytes(30), 16, False), (b'\x80' + bytes(31), 1, False),
+])
+def test_meets_difficulty_counts_leading_zero_bits(digest, difficulty, meets):
+    assert meets_difficulty(digest, difficulty) is meets
+
+
+def test_search_finds_the_first_proof():
+    last_hash = hashlib.sha256(b'test').hexdigest()
+
+    def valid(proof):
+        return meets_difficulty(hashlib.sha256(f'35293{proof}{last_hash}'.encode()).digest(), 8)
+    proof = search(35293, last_hash, 0, 100000, 8)
+    assert valid(proof) and not any(valid(earlier) for earlier in range(proof))
+    # Starting past it finds the next one, across batches of nonces
+    later = search(35293, last_hash, proof + 1, 100000, 8)
+    assert valid(later) and not any(valid(between) for between in range(proof + 1, later))
+
+
+PRODUCERS = ['A', 'B', 'C']
+
+
+def test_producers_take_the_slots_in_turn():
+    start = 1540000000 // TARGET * TARGET
+    assert [required_producer(start, start + slot * TARGET + 1, PRODUCERS, TARGET) for slot in range(1, 5)] == \
+        [PRODUCERS[(start // TARGET + slot) % 3] for slot in range(1, 5)]
+
+
+def test_one_block_per_slot():
+    start = 1540000000 // TARGET * TARGET
+    assert required_producer(start, start + TARGET - 1, PRODUCERS, TARGET) is None
+    assert required_producer(start + 1, start, PRODUCERS, TARGET) is None
+    assert required_producer(start, start + TARGET, PRODUCERS, TARGET) is not None
+
+
+def test_producer_timestamp_bounds():
+    now = time()
+    assert required_producer(now - TARGET, now + MAX_CLOCK_DRIFT + TARGET, PRODUCERS, TARGET) is None
+    assert required_producer(now - TARGET, float('nan'), PRODUCERS, TARGET) is None
+    assert required_producer(now - TARGET, float('-inf'), PRODUCERS, TARGET) is None
+    assert required_producer(now - TARGET, now, [], TARGET) is None
+
+
+def test_next_turn_is_the_producers_next_slot():
+    now = time()
+    last = now - 10 * TARGET
+    for producer in PRODUCERS:
+        turn = next_turn(last, PRODUCERS, producer, TARGET)
+        # Not a slot that has already passed
+        assert now - TARGET < turn <= now + 2 * TARGET
+        assert required_producer(last, turn, PRODUCERS, TARGET) == producer
+    # Nor the slot of the last block
+    last = now
+    assert next_turn(last, PRODUCERS, 'A', TARGET) > now
+    assert next_turn(last, PRODUCERS, 'D', TARGET) is None
@@ -0,0 +1,85 @@
+from threading import Barrier, Event, Thread
+
+from rwlock import ReadWriteLock
+
+# Long enough for a thread that is not blocked to get where it is going
+WAIT = 5
+
+
+def start(target):
+    thread = Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_hold_the_lock_together():
+    lock = ReadWriteLock()
+    both = Barrier(2, timeout=WAIT)
+
+    def read():
+        with lock.read():
+            both.wait()
+    threads = [start(read) for _ in range(2)]
+    for thread in threads:
+        thread.join(WAIT)
+    assert not both.broken and lock.readers == 0
+
+
+def test_writer_waits_for_readers():
+    lock = ReadWriteLock()
+    events = []
+    wrote = Event()
+
+    def write():
+        with lock.write():
+            events.append('write')
+        wrote.set()
+    with lock.read():
+        start(write)
+        assert not wrote.wait(0.1)
+        events.append('read')
+    assert wrote.wait(WAIT)
+    assert events == ['read', 'write']
+
+
+def test_waiting_writer_goes_ahead_of_new_readers():
+    lock = ReadWriteLock()
+    events = []
+    reader_done = Event()
+
+    def write():
+        with lock.write():
+            events.append('write')
+
+    def read():
+        with lock.read():
+            events.append('read')
+        reader_done.set()
+    with lock.read():
+        writer = start(write)
+        while not lock.waiting_writers:
+            writer.join(0.01)
+        # A reader arriving after the writer waits behind it, though only readers hold the lock
+        start(read)
+        assert not reader_done.wait(0.1)
+    assert reader_done.wait(WAIT)
+    assert events == ['write', 'read']
+
+
+def test_writer_may_take_the_lock_again():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+        # Still held until the outermost write ends
+        assert lock.writes == 1
+        read = Event()
+
+        def reader():
+            with lock.read():
+                read.set()
+        start(reader)
+        assert not read.wait(0.1)
+    assert read.wait(WAIT)
+    assert lock.writer is None
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import signing
+from conftest import ROOT
+from keyregistry import KeyRegistry
+from signing import BatchSigner, BatchVerifier
+
+
+class FakePool:
+    """
+    Pool verifying in this process, to see when pools are started and closed
+    """
+
+    def __init__(self, workers, initializer, initargs):
+        initializer(*initargs)
+        self.terminated = False
+
+    def map(self, function, items, chunksize):
+        assert not self.terminated
+        return [function(item) for item in items]
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeContext:
+    Pool = FakePool
+
+
+@pytest.fixture
+def registry():
+    return KeyRegistry(os.path.join(ROOT, 'publickeys.json'))
+
+
+@pytest.fixture
+def records(institution):
+    name = institution['name']
+    messages = [f'record {i}' for i in range(4)]
+    signatures = BatchSigner(institution['private_key']).sign_all(messages)
+    return [(message, signature, name) for message, signature in zip(messages, signatures)] + \
+        [('forged', signatures[0], name), ('record 0', signatures[0], 'Nowhere')]
+
+
+def test_small_batches_are_verified_in_this_process(registry, records, monkeypatch):
+    monkeypatch.setattr(signing, '_context', None)
+    verifier = BatchVerifier(workers=4, chunk_size=len(records) + 1)
+    assert verifier.verify_all(records, registry) == [True] * 4 + [False, False]
+    assert verifier.pool is None
+
+
+def test_pools_verify_large_batches(registry, records, monkeypatch):
+    monkeypatch.setattr(signing, '_context', FakeContext)
+    verifier = BatchVerifier(workers=4, chunk_size=2)
+    assert verifier.verify_all(records, registry) == [True] * 4 + [False, False]
+    pool = verifier.pool
+    assert verifier.verify_all(records, registry) == [True] * 4 + [False, False]
+    assert verifier.pool is pool and verifier.users == {pool: 0}
+
+
+def test_replaced_pool_is_closed_once_no_one_uses_it(registry, monkeypatch):
+    monkeypatch.setattr(signing, '_context', FakeContext)
+    verifier = BatchVerifier(workers=4)
+    old = verifier.take_pool(registry)
+    # The keys change while a request is still verifying with the old pool
+    registry.generation += 1
+    new = verifier.take_pool(registry)
+    assert new is not old and not old.terminated
+    verifier.give_back(new)
+    verifier.give_back(old)
+    assert old.terminated and not new.terminated
+    assert verifier.users == {new: 0}
+
+    # A pool no one is using is closed when it is replaced
+    registry.generation += 1
+    newer = verifier.take_pool(registry)
+    assert new.terminated
+    verifier.close()
+    assert newer.terminated and verifier.pool is None
@@ -0,0 +1,105 @@
+import pytest
+
+from sqlitestore import SQLiteStudentIndex
+from storage import BlockStore
+from test_storage import hash_block
+from test_studentindex import SHARED, build, chains  # noqa: F401 (chains is a fixture)
+from uninode2 import UniversityNode
+
+QUERIES = [
+    ('locate_student', 'Ann', 'Lee', '1'),
+    ('locate_student', 'Eve', 'Poe', '5'),
+    ('locate_normalized', ' ann', 'LEE ', '1'),
+    ('with_student_id', '1', 0, 10),
+    ('with_student_id', '4', 1, 10),
+    ('of_institution', 'Berkeley', None, 0, 10),
+    ('of_institution', 'Berkeley', (2030, 5, 15), 1, 10),
+    ('of_institution', 'Davis', None, 0, 10),
+    ('expiring_before', (2030, 3, 1), 0, 10),
+    ('expiring_before', (2030, 3, 1), 1, 1),
+    ('locate_similar', 'Ann', 'Leigh', '1', 0.3),
+    ('locate_similar', 'Dann', 'Orr'),
+    ('locate_similar', 'Dan', 'Or', None, 0.4, 1),
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'test.chain.students.db')
+
+
+def indexed(path, chain):
+    index = SQLiteStudentIndex(path, hash_block)
+    index.sync(chain, [hash_block(block) for block in chain])
+    return index
+
+
+def assert_same(index, chain):
+    fresh = build(chain)
+    for name, *args in QUERIES:
+        assert getattr(index, name)(*args) == getattr(fresh, name)(*args), name
+    for position, block in enumerate(chain):
+        for slot, student in enumerate(block.students):
+            assert index.locate(student.record_id()) == (position, slot)
+            assert index.student(chain, position, slot).to_dict() == student.to_dict()
+
+
+def test_queries_match_the_memory_index(path, chains):
+    old, new = chains
+    assert_same(indexed(path, old), old)
+    assert_same(indexed(path, new), new)
+
+
+def test_replace_chain_matches_a_fresh_index(path, chains):
+    old, new = chains
+    index = indexed(path, old)
+    index.replace_chain(old, new, len(SHARED))
+    assert_same(index, new)
+    for student in old[3].students:
+        assert index.locate(student.record_id()) is None
+
+
+def test_added_blocks_are_indexed(path, chains):
+    old, _ = chains
+    index = SQLiteStudentIndex(path, hash_block)
+    index.add_blocks(0, old[:2])
+    for position in range(2, len(old)):
+        index.add_block(position, old[position])
+    assert_same(index, old)
+    assert [record.to_dict() for record in index.find(old, 'Ann', 'Lee', '1')] == \
+        [old[0].students[0].to_dict(), old[2].students[1].to_dict()]
+
+
+# Indexed the first blocks of the old chain, then restarted with the chain the log has
+@pytest.mark.parametrize('before, fork, after, reindexed', [
+    (2, 'old', 4, [2, 3]),  # Behind the log
+    (4, 'old', 2, []),  # Ahead of it
+    (4, 'new', 4, [2, 3]),  # Replaced past the fork point
+    (4, 'new', 5, [2, 3, 4]),
+])
+def test_sync_catches_up_with_the_chain(path, chains, before, fork, after, reindexed, monkeypatch):
+    old, new = chains
+    indexed(path, old[:before]).close()
+    chain = (old if fork == 'old' else new)[:after]
+    inserted = []
+    insert = SQLiteStudentIndex.insert
+    monkeypatch.setattr(SQLiteStudentIndex, 'insert',
+                        lambda self, position, entries: inserted.append(position) or insert(self, position, entries))
+    assert_same(indexed(path, chain), chain)
+    assert inserted == reindexed
+
+
+def test_node_restart_reads_the_index(institution, tmp_path, monkeypatch):
+    chain_file = str(tmp_path / 'test.chain')
+    node = UniversityNode(institution, 'berkeley', store=BlockStore(chain_file))
+    node.new_transaction('Ann', 'Lee', '1', '05/15/2030')
+    node.mine()
+    found = [record.to_dict() for record in node.find_students('Ann', 'Lee', '1')]
+    assert found
+    node.index.close()
+
+    # None of the blocks are indexed again
+    monkeypatch.setattr(SQLiteStudentIndex, 'insert', None)
+    restarted = UniversityNode(institution, 'berkeley', store=BlockStore(chain_file))
+    assert len(restarted.chain) == 2
+    assert [record.to_dict() for record in restarted.find_students('Ann', 'Lee', '1')] == found
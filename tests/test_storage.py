@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from records import Block, StudentRecord
+from storage import INDEX_ENTRY, SEGMENT_HEADER, BlockStore
+
+
+def hash_block(block):
+    return hashlib.sha256(json.dumps(block.to_dict(), sort_keys=True).encode()).hexdigest()
+
+
+def make_chain(length, fork_from=None, tag=''):
+    """
+    A chain of linked blocks, or one that shares the first fork_from[1] blocks of fork_from[0]
+    :return: (blocks, hashes)
+    """
+
+    blocks, hashes = [], []
+    if fork_from is not None:
+        chain, shared = fork_from
+        blocks, hashes = list(chain[0][:shared]), list(chain[1][:shared])
+    while len(blocks) < length:
+        position = len(blocks)
+        students = [StudentRecord(f'First{tag}{position}', 'Last', str(position), '12/15/2030', 'U', b'\x01' * 8)]
+        block = Block(position + 1, 1540000000 + position, students, None, position, hashes[-1] if hashes else '1')
+        blocks.append(block)
+        hashes.append(hash_block(block))
+    return blocks, hashes
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'test.chain')
+
+
+def write(path, blocks, hashes):
+    store = BlockStore(path)
+    store.load(hash_block)
+    for block, block_hash in zip(blocks, hashes):
+        store.append(block, block_hash)
+    return store
+
+
+def reopen(path):
+    chain, hashes = BlockStore(path).load(hash_block)
+    return list(chain), list(hashes)
+
+
+def test_new_store_is_empty(path):
+    chain, hashes = BlockStore(path).load(hash_block)
+    assert len(chain) == 0 and len(hashes) == 0
+    assert os.path.getsize(path) == 0 and os.path.getsize(path + '.idx') == 0
+
+
+def test_appended_blocks_are_reloaded(path):
+    blocks, hashes = make_chain(5)
+    write(path, blocks, hashes)
+    assert reopen(path) == (blocks, hashes)
+
+
+def test_views_taken_before_an_append_do_not_change(path):
+    blocks, hashes = make_chain(4)
+    store = write(path, blocks[:3], hashes[:3])
+    chain, old_hashes = store.views()
+    store.append(blocks[3], hashes[3])
+    assert list(chain) == blocks[:3] and list(old_hashes) == hashes[:3]
+    assert list(store.views()[0]) == blocks
+
+
+def test_slices_are_views(path):
+    blocks, hashes = make_chain(6)
+    chain, chain_hashes = write(path, blocks, hashes).views()
+    assert list(chain[2:5]) == blocks[2:5]
+    assert list(chain_hashes[-2:]) == hashes[-2:]
+    assert chain[1:][0] == blocks[1]
+    assert list(chain[::2]) == blocks[::2]
+    with pytest.raises(IndexError):
+        chain[6]
+
+
+def test_torn_log_entry_drops_the_tip(path):
+    blocks, hashes = make_chain(4)
+    write(path, blocks, hashes)
+    # A crash part way through writing the last block to the log
+    with open(path, 'r+b') as log:
+        log.truncate(os.path.getsize(path) - 10)
+    assert reopen(path) == (blocks[:3], hashes[:3])
+    # The torn entry is cut off, so the next block goes where it was
+    store = BlockStore(path)
+    store.load(hash_block)
+    store.append(blocks[3], hashes[3])
+    assert reopen(path) == (blocks, hashes)
+
+
+def test_damaged_tip_is_dropped(path):
+    blocks, hashes = make_chain(3)
+    write(path, blocks, hashes)
+    with open(path, 'r+b') as log:
+        log.seek(-3, os.SEEK_END)
+        log.write(b'\xff\xff\xff')
+    assert reopen(path) == (blocks[:2], hashes[:2])
+
+
+def test_torn_index_entry_is_dropped(path):
+    blocks, hashes = make_chain(3)
+    write(path, blocks, hashes)
+    # A crash part way through writing an index entry
+    with open(path + '.idx', 'ab') as index:
+        index.write(b'\x00' * (INDEX_ENTRY.size // 2))
+    assert reopen(path) == (blocks, hashes)
+    assert os.path.getsize(path + '.idx') == 3 * INDEX_ENTRY.size
+
+
+def test_log_entry_without_an_index_entry_is_dropped(path):
+    blocks, hashes = make_chain(3)
+    store = write(path, blocks[:2], hashes[:2])
+    # A crash after the log was written but before the index was
+    store.write(blocks[2:], hashes[2:])
+    assert reopen(path) == (blocks[:2], hashes[:2])
+    store = BlockStore(path)
+    store.load(hash_block)
+    store.append(blocks[2], hashes[2])
+    assert reopen(path) == (blocks, hashes)
+
+
+def test_replace_keeps_the_shared_blocks(path):
+    old = make_chain(5)
+    new = make_chain(7, fork_from=(old, 2), tag='new')
+    store = write(path, *old)
+    before = store.views()
+    store.replace(2, new[0][2:], new[1][2:])
+    assert reopen(path) == new
+    # Views of the old chain still read the old blocks
+    assert list(before[0]) == old[0] and list(before[1]) == old[1]
+
+
+def test_missing_index_is_rebuilt(path):
+    blocks, hashes = make_chain(5)
+    write(path, blocks, hashes)
+    with open(path + '.idx', 'rb') as index:
+        written = index.read()
+    os.remove(path + '.idx')
+    assert reopen(path) == (blocks, hashes)
+    with open(path + '.idx', 'rb') as index:
+        assert index.read() == written
+
+
+def test_reindex_replays_replacements(path):
+    old = make_chain(5)
+    new = make_chain(6, fork_from=(old, 3), tag='new')
+    store = write(path, *old)
+    store.replace(3, new[0][3:], new[1][3:])
+    os.remove(path + '.idx')
+    assert reopen(path) == new
+
+
+def test_reindex_replays_a_replaced_genesis(path):
+    old = make_chain(3)
+    new = make_chain(4, tag='new')
+    store = write(path, *old)
+    store.replace(0, *new)
+    os.remove(path + '.idx')
+    assert reopen(path) == new
+
+
+def test_reindex_stops_at_a_damaged_entry(path):
+    blocks, hashes = make_chain(5)
+    write(path, blocks, hashes)
+    os.remove(path + '.idx')
+    with open(path, 'r+b') as log:
+        log.truncate(os.path.getsize(path) - 1)
+    assert reopen(path) == (blocks[:4], hashes[:4])
+
+
+def test_reindex_stops_at_a_block_that_does_not_link(path):
+    blocks, hashes = make_chain(4)
+    unlinked = make_chain(4, tag='other')
+    store = write(path, blocks[:2], hashes[:2])
+    store.write(unlinked[0][2:3], unlinked[1][2:3])
+    store.write(blocks[2:], hashes[2:])
+    os.remove(path + '.idx')
+    assert reopen(path) == (blocks[:2], hashes[:2])
+
+
+def test_json_lines_log_is_converted(path):
+    blocks, hashes = make_chain(3)
+    with open(path, 'w') as log:
+        for block, block_hash in zip(blocks, hashes):
+            log.write(json.dumps({'hash': block_hash, 'block': block.to_dict()}) + '\n')
+        # A line cut short by a crash
+        log.write('{"hash": "')
+    assert reopen(path) == (blocks, hashes)
+    assert reopen(path) == (blocks, hashes)
+
+
+def segments(path):
+    # Index segments on disk besides the first
+    directory, name = os.path.split(path + '.idx')
+    return sorted(file_name for file_name in os.listdir(directory) if file_name.startswith(name + '.'))
+
+
+def test_replace_only_writes_the_new_entries(path):
+    old = make_chain(20)
+    new = make_chain(22, fork_from=(old, 15), tag='new')
+    store = write(path, *old)
+    store.replace(15, new[0][15:], new[1][15:])
+    assert os.path.getsize(path + '.idx') == 20 * INDEX_ENTRY.size
+    assert segments(path) == ['test.chain.idx.1']
+    assert os.path.getsize(path + '.idx.1') == SEGMENT_HEADER.size + 7 * INDEX_ENTRY.size
+    assert reopen(path) == new
+
+    # Blocks after a replacement are appended to its segment
+    longer = make_chain(23, fork_from=(new, 22), tag='new')
+    store.append(longer[0][22], longer[1][22])
+    assert os.path.getsize(path + '.idx.1') == SEGMENT_HEADER.size + 8 * INDEX_ENTRY.size
+    assert reopen(path) == longer
+
+
+def test_replacements_keep_few_segments(path):
+    chain = make_chain(10)
+    store = write(path, *chain)
+    views = []
+    for step in range(1, 40):
+        # Each replacement drops the tip and adds two blocks
+        fork = len(chain[0]) - 1
+        chain = make_chain(fork + 2, fork_from=(chain, fork), tag=f'r{step}')
+        store.replace(fork, chain[0][fork:], chain[1][fork:])
+        views.append((store.views(), chain))
+        assert len(segments(path)) <= 4
+    assert reopen(path) == chain
+    for (old_chain, old_hashes), (blocks, hashes) in views:
+        assert list(old_chain) == blocks and list(old_hashes) == hashes
+
+
+def test_replacing_the_genesis_block(path):
+    old = make_chain(10)
+    new = make_chain(11, tag='new')
+    store = write(path, *old)
+    store.replace(0, *new)
+    assert reopen(path) == new
+    store = BlockStore(path)
+    store.load(hash_block)
+    longer = make_chain(12, fork_from=(new, 11), tag='new')
+    store.append(longer[0][11], longer[1][11])
+    assert reopen(path) == longer
+
+
+def test_damaged_tip_in_a_new_segment_is_dropped(path):
+    old = make_chain(10)
+    new = make_chain(11, fork_from=(old, 10), tag='new')
+    store = write(path, *old)
+    store.replace(10, new[0][10:], new[1][10:])
+    with open(path, 'r+b') as log:
+        log.truncate(os.path.getsize(path) - 10)
+    assert reopen(path) == old
+    assert segments(path) == []
+    store = BlockStore(path)
+    store.load(hash_block)
+    store.append(new[0][10], new[1][10])
+    assert reopen(path) == new
+
+
+def test_leftover_segments_are_removed(path):
+    old = make_chain(10)
+    new = make_chain(11, fork_from=(old, 8), tag='new')
+    store = write(path, *old)
+    store.replace(9, old[0][9:], old[1][9:])
+    with open(path + '.idx.1', 'rb') as segment:
+        replaced = segment.read()
+    store.replace(8, new[0][8:], new[1][8:])
+    # A crash before the segment it took the place of was removed, and one part way through writing another
+    with open(path + '.idx.1', 'wb') as segment:
+        segment.write(replaced)
+    with open(path + '.idx.3.new', 'wb') as segment:
+        segment.write(b'\x00' * 5)
+    assert reopen(path) == new
+    assert segments(path) == ['test.chain.idx.2']
+
+
+def test_compact_drops_replaced_blocks(path):
+    old = make_chain(10)
+    new = make_chain(12, fork_from=(old, 4), tag='new')
+    store = write(path, *old)
+    store.replace(4, new[0][4:], new[1][4:])
+    size = os.path.getsize(path)
+
+    store = BlockStore(path)
+    store.compact(hash_block)
+    assert os.path.getsize(path) < size
+    assert segments(path) == []
+    assert reopen(path) == new
+    fresh = path + '.fresh'
+    write(fresh, *new)
+    with open(path, 'rb') as log, open(fresh, 'rb') as expected:
+        assert log.read() == expected.read()
+    # The compacted log replays to the same chain
+    os.remove(path + '.idx')
+    assert reopen(path) == new
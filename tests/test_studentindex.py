@@ -0,0 +1,152 @@
+import pytest
+
+from records import Block, StudentRecord
+from studentindex import StudentIndex
+
+
+def make_block(position, students, fork=0):
+    # Records are told apart from those of another fork by their signatures
+    records = [StudentRecord(first_name, last_name, student_id, date, institution_name, bytes([fork, position, slot]))
+               for slot, (first_name, last_name, student_id, date, institution_name) in enumerate(students)]
+    return Block(position + 1, 1540000000 + position, records, None, position, str(position))
+
+
+def build(chain):
+    index = StudentIndex()
+    index.add_blocks(0, chain)
+    return index
+
+
+def records_by_name(index):
+    # Names stay numbered after their records go, so compare what each name locates
+    return {index.names[name_id]: records for name_id, records in enumerate(index.name_records) if records}
+
+
+def assert_same(index, fresh):
+    assert index.by_name == fresh.by_name
+    assert index.by_record == fresh.by_record
+    assert index.by_student_id == fresh.by_student_id
+    assert index.by_expiry == fresh.by_expiry
+    assert index.by_normalized == fresh.by_normalized
+    assert records_by_name(index) == records_by_name(fresh)
+    assert not index.unsorted
+    for entries in index.by_expiry.values():
+        assert entries == sorted(entries)
+
+
+SHARED = [
+    [('Ann', 'Lee', '1', '05/15/2030', 'Berkeley'), ('Bob', 'Ray', '2', '12/15/2029', 'Berkeley')],
+    [('Cat', 'Day', '3', '05/15/2031', 'Stanford')],
+]
+OLD = [
+    [('Dan', 'Orr', '4', '01/15/2030', 'Stanford'), ('Ann', 'Lee', '1', '05/15/2032', 'Berkeley')],
+    [('Eve', 'Poe', '5', 'someday', 'Davis'), ('Fay', 'Ng', '6', '02/15/2030', 'Davis')],
+]
+NEW = [
+    [('Gus', 'Kim', '7', '03/15/2030', 'Berkeley')],
+    [('Ann', 'Lee', '1', '05/15/2033', 'Berkeley'), ('Dan', 'Orr', '4', '01/15/2030', 'Stanford')],
+    [('Hal', 'Fox', '8', '04/15/2030', 'Stanford')],
+]
+
+
+@pytest.fixture
+def chains():
+    shared = [make_block(position, students) for position, students in enumerate(SHARED)]
+    old = shared + [make_block(position, students) for position, students in enumerate(OLD, len(shared))]
+    new = shared + [make_block(position, students, 1) for position, students in enumerate(NEW, len(shared))]
+    return old, new
+
+
+def test_replace_chain_matches_a_fresh_index(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new, len(SHARED))
+    assert_same(index, build(new))
+
+
+def test_replace_chain_with_precomputed_entries(chains):
+    old, new = chains
+    index = build(old)
+    added = [index.entries(block) for block in new[len(SHARED):]]
+    index.replace_chain(old, new, len(SHARED), added)
+    assert_same(index, build(new))
+
+
+def test_orphaned_records_are_dropped(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new, len(SHARED))
+
+    for student in old[3].students:
+        assert index.locate(student.record_id()) is None
+    assert index.locate_student('Eve', 'Poe', '5') == []
+    assert index.locate_normalized('eve', 'POE', '5') == []
+    assert index.with_student_id('6', 0, 10) == (0, [])
+    assert 'Davis' not in index.by_expiry
+    assert index.of_institution('Davis', None, 0, 10) == (0, [])
+    # A record whose date cannot be read is only in its institution's list
+    assert all(position < len(new) for _, position, _ in index.expiry_list(None))
+    assert index.locate_similar('Eve', 'Poe') == []
+    # The name is still numbered, with nothing left to find
+    assert index.names_by_id['5']
+
+
+def test_records_in_both_chains_move(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new, len(SHARED))
+
+    assert index.locate_student('Dan', 'Orr', '4') == [(3, 1)]
+    assert index.locate(new[3].students[1].record_id()) == (3, 1)
+    assert index.find(new, 'Ann', 'Lee', '1') == [new[0].students[0], new[3].students[0]]
+    assert index.with_student_id('1', 0, 10) == (2, [(0, 0), (3, 0)])
+    assert [(position, slot) for _, position, slot in index.locate_similar('Ann', 'Leigh', '1', 0.3)] == [(0, 0), (3, 0)]
+
+
+def test_shared_blocks_are_kept(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new, len(SHARED))
+
+    for position in range(len(SHARED)):
+        for slot, student in enumerate(new[position].students):
+            assert index.locate(student.record_id()) == (position, slot)
+    assert index.locate_student('Cat', 'Day', '3') == [(1, 0)]
+
+
+def test_replace_with_a_shorter_chain(chains):
+    old, new = chains
+    index = build(new)
+    shorter = old[:len(SHARED) + 1]
+    index.replace_chain(new, shorter, len(SHARED))
+    assert_same(index, build(shorter))
+
+
+def test_replace_every_block(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new[len(SHARED):], 0)
+    assert_same(index, build(new[len(SHARED):]))
+
+
+
+def test_added_blocks_keep_the_expiry_lists_sorted(chains):
+    old, _ = chains
+    index = StudentIndex()
+    for position, block in enumerate(old):
+        index.add_block(position, block)
+    assert_same(index, build(old))
+    assert index.expiring_before((2030, 3, 1), 0, 10) == (3, [(0, 1), (2, 0), (3, 1)])
+    assert index.expiring_before((2030, 3, 1), 1, 1) == (3, [(2, 0)])
+
+
+def test_institution_pages_are_in_date_order(chains):
+    old, new = chains
+    index = build(old)
+    index.replace_chain(old, new, len(SHARED))
+    assert index.of_institution('Berkeley', None, 0, 10) == (4, [(0, 1), (2, 0), (0, 0), (3, 0)])
+    assert index.of_institution('Berkeley', (2030, 5, 15), 1, 10) == (2, [(3, 0)])
+    # Records whose date cannot be read come first in their institution's list only
+    index = build(old)
+    assert index.of_institution('Davis', None, 0, 10) == (2, [(3, 0), (3, 1)])
+    assert index.expiring_before((2030, 2, 1), 0, 10) == (2, [(0, 1), (2, 0)])
@@ -0,0 +1,297 @@
+import pytest
+
+import codec
+import uninode2
+from mining import producer_slot
+from uninode2 import UniversityNode
+
+# Seconds in each turn to make a block under proof of authority, short to keep the tests quick
+TURN = 0.05
+
+
+@pytest.fixture
+def peer(institution):
+    return UniversityNode(institution, 'berkeley')
+
+
+@pytest.fixture
+def node(institution, peer):
+    # Starts from the same genesis block as the peer
+    node = UniversityNode(institution, 'berkeley')
+    node.replace_chain(list(peer.chain), list(peer.hashes))
+    return node
+
+
+def pushed(peer):
+    block = peer.mine()
+    return block.to_dict(), peer.hashes[-1]
+
+
+def test_block_extending_the_tip_is_added(node, peer):
+    values, block_hash = pushed(peer)
+    assert node.accept_block(values, block_hash) == 'added'
+    assert list(node.hashes) == list(peer.hashes)
+    assert node.accept_block(values, block_hash) == 'known'
+
+
+def test_block_with_the_wrong_hash_is_rejected(node, peer):
+    values, block_hash = pushed(peer)
+    assert node.accept_block(values, 'ab' * 32) == 'rejected'
+    assert node.accept_block(dict(values, proof=values['proof'] + 1), block_hash) == 'rejected'
+    assert len(node.chain) == 1
+
+
+def test_block_with_an_invalid_proof_is_rejected(node, peer):
+    values, _ = pushed(peer)
+    values = dict(values, proof=values['proof'] + 1)
+    assert node.accept_block(values, UniversityNode.hash(values)) == 'rejected'
+    assert len(node.chain) == 1
+
+
+@pytest.mark.parametrize('field, value', [
+    ('timestamp', 'x'), ('timestamp', None), ('timestamp', True), ('index', '2'), ('index', 2.0), ('proof', 1.5),
+    ('difficulty', '16'), ('previous_hash', None), ('merkle_root', 5), ('producer', ['x']), ('students', {}),
+])
+def test_mistyped_block_is_rejected(node, peer, field, value):
+    values, _ = pushed(peer)
+    values = dict(values, **{field: value})
+    assert node.accept_block(values, UniversityNode.hash(values)) == 'rejected'
+    assert len(node.chain) == 1
+
+
+def test_mistyped_student_is_rejected(node, peer):
+    peer.new_transaction('Ann', 'Lee', '1', '05/15/2030')
+    values, block_hash = pushed(peer)
+    values['students'][0]['first_name'] = ['Ann']
+    # The Merkle root, not the students, goes into the hash
+    assert node.accept_block(values, block_hash) == 'rejected'
+    assert len(node.chain) == 1
+
+
+def test_blocks_not_ahead_of_our_chain_are_ignored(node, peer, institution):
+    values, block_hash = pushed(peer)
+    other = UniversityNode(institution, 'berkeley')
+    other.replace_chain(list(node.chain), list(node.hashes))
+    assert node.accept_block(*pushed(other)) == 'added'
+    # The peer's block at the same height is from another fork
+    assert node.accept_block(values, block_hash) == 'ignored'
+
+
+def test_block_past_our_tip_syncs_from_its_sender(node, peer, monkeypatch):
+    pushed(peer)
+    values, block_hash = pushed(peer)
+    assert node.accept_block(values, block_hash) == 'ignored'
+
+    synced = []
+    monkeypatch.setattr(node, 'sync_from', synced.append)
+    assert node.accept_block(values, block_hash, 'peer:5000') == 'syncing'
+    node.push_pool.shutdown(wait=True)
+    assert synced == ['peer:5000']
+    assert len(node.chain) == 1
+
+
+def test_accept_block_route(node, peer, monkeypatch):
+    monkeypatch.setattr(uninode2, 'node', node)
+    client = uninode2.app.test_client()
+
+    values, _ = pushed(peer)
+    mistyped = dict(values, timestamp='x')
+    response = client.post('/nodes/accept_block', json={'block': mistyped, 'hash': UniversityNode.hash(mistyped)})
+    assert response.status_code == 400 and response.get_json()['status'] == 'rejected'
+
+    response = client.post('/nodes/accept_block', json={'block': values, 'hash': peer.hashes[-1]})
+    assert response.status_code == 200 and response.get_json() == {'status': 'added', 'length': 2}
+
+    for data in [b'garbage', codec.MAGIC + b'\x00' + bytes([codec.TABLE, 0]) + b'\xc0\x8d\xb7\x01',
+                 codec.MAGIC + b'\x00' + bytes([codec.LIST, 1]) * 100000 + b'\x00']:
+        response = client.post('/nodes/accept_block', data=data, headers={'Content-Type': codec.MIMETYPE})
+        assert response.status_code == 400
+
+
+def serve(peer, header=None, block=None):
+    """
+    A stand-in for fetching from a peer, answering as the peer's routes would,
+    with each header and block passed through header() or block() if given
+    """
+
+    def fetch(address, path, headers=None, **params):
+        start = params.get('from', 0)
+        end = min(params.get('to', len(peer.chain)), len(peer.chain))
+        if path == '/chain/length':
+            return {'length': len(peer.chain), 'hash': peer.hashes[-1]}
+        if path == '/chain/headers':
+            found = [peer.header(peer.chain[position], peer.hashes[position]) for position in range(start, end)]
+            return {'headers': [header(value) for value in found] if header else found, 'length': len(peer.chain)}
+        if path == '/blocks':
+            found = [block.to_dict() for block in peer.chain[start:end]]
+            return {'blocks': [block(value) for value in found] if block else found, 'length': len(peer.chain)}
+        return None
+    return fetch
+
+
+def mistyped_tip(values, length):
+    # The peer's last block, with a timestamp that is not a number
+    if values['index'] == length:
+        values['timestamp'] = 'soon'
+    return values
+
+
+def test_sync_with_a_peer_that_is_ahead(node, peer, monkeypatch):
+    for _ in range(3):
+        pushed(peer)
+    monkeypatch.setattr(node, 'fetch', serve(peer))
+    assert node.sync_from('peer:5000')
+    assert list(node.hashes) == list(peer.hashes)
+
+
+@pytest.mark.parametrize('tamper', ['header', 'block'])
+def test_mistyped_peer_chain_is_invalid(node, peer, monkeypatch, tamper):
+    for _ in range(3):
+        pushed(peer)
+    monkeypatch.setattr(node, 'fetch', serve(peer, **{tamper: lambda values: mistyped_tip(values, 4)}))
+    node.register_node('peer:5000')
+    assert node.sync_with('peer:5000') is None
+    assert not node.resolve_conflicts()
+    assert len(node.chain) == 1
+    # Tried again on the next resolve
+    assert 'peer:5000' not in node.peer_tips
+
+
+def test_validation_errors_make_the_peer_invalid(node, peer, monkeypatch):
+    pushed(peer)
+    monkeypatch.setattr(node, 'fetch', serve(peer))
+
+    def validate_chain(chain):
+        raise TypeError("'<=' not supported between instances of 'float' and 'str'")
+    monkeypatch.setattr(node, 'validate_chain', validate_chain)
+    node.register_node('peer:5000')
+    assert node.sync_with('peer:5000') is None
+    assert not node.resolve_conflicts()
+
+
+@pytest.fixture
+def authorities(institution):
+    # Berkeley takes every other turn, its name sorting before Los Angeles
+    producer = UniversityNode(institution, 'berkeley', consensus='poa', target_block_time=TURN)
+    other = UniversityNode(institution, 'berkeley', consensus='poa', target_block_time=TURN)
+    other.replace_chain(list(producer.chain), list(producer.hashes))
+    return producer, other
+
+
+def resigned(node, block, **changes):
+    # The block changed and signed again by its producer, whose key is still good
+    values = dict(block.to_dict(), **changes)
+    values.pop('signature')
+    values['signature'] = node.ciph.asymmetric_sign(node.authority_string(values), node.privKey)
+    return values, UniversityNode.hash(values)
+
+
+def test_authority_blocks_are_made_in_the_producers_turn(authorities):
+    producer, other = authorities
+    slots = []
+    for _ in range(3):
+        block = producer.mine()
+        slots.append(producer_slot(block.timestamp, TURN))
+        assert other.accept_block(block.to_dict(), producer.hashes[-1]) == 'added'
+    assert slots == sorted(set(slots))
+    assert all(slot % 2 == 0 for slot in slots)
+
+
+def test_valid_authority(authorities):
+    producer, _ = authorities
+    block = producer.mine()
+    header = producer.header(block, producer.hashes[-1])
+    registry, ciph = producer.key_registry, producer.ciph
+    assert UniversityNode.valid_authority(header, registry, ciph)
+    assert not UniversityNode.valid_authority(dict(header, merkle_root='ab' * 32), registry, ciph)
+    assert not UniversityNode.valid_authority(dict(header, producer='University of California, Los Angeles'),
+                                              registry, ciph)
+    assert not UniversityNode.valid_authority(dict(header, producer='Nowhere'), registry, ciph)
+    assert not UniversityNode.valid_authority(dict(header, signature=None), registry, ciph)
+    unrooted = dict(header)
+    del unrooted['merkle_root']
+    assert not UniversityNode.valid_authority(unrooted, registry, ciph)
+
+
+def test_authority_blocks_out_of_turn_are_rejected(authorities):
+    producer, other = authorities
+    last = producer.last_block.timestamp
+    block = producer.mine()
+    # Signed by the producer, but in the other institution's turn, or in the turn of the block before
+    slot = producer_slot(block.timestamp, TURN)
+    assert other.accept_block(*resigned(producer, block, timestamp=(slot + 1.5) * TURN)) == 'rejected'
+    assert other.accept_block(*resigned(producer, block, timestamp=last)) == 'rejected'
+    # Or a turn far ahead of our clock
+    assert other.accept_block(*resigned(producer, block, timestamp=(slot + 2 * 10 ** 5 + 0.5) * TURN)) == 'rejected'
+    assert other.accept_block(*resigned(producer, block)) == 'added'
+
+
+def test_authority_needs_a_registered_key(authorities, monkeypatch):
+    producer, _ = authorities
+    monkeypatch.setattr(producer, 'institution_name', 'Nowhere')
+    with pytest.raises(ValueError):
+        producer.mine()
+
+
+def fake_peer(hashes, page_size=3):
+    """
+    fetch_page over a peer's chain of headers, served page_size at a time
+    :return: (fetch_page, the positions it was asked for)
+    """
+
+    asked = []
+
+    def fetch_page(start):
+        asked.append(start)
+        return {'headers': [{'hash': block_hash} for block_hash in hashes[start:start + page_size]], 'length': len(hashes)}
+    return fetch_page, asked
+
+
+def chain_hashes(length, fork=None, tag='peer'):
+    # Hashes of a chain, sharing the first fork blocks with chain_hashes(...)'s default one
+    return [f'ours{position}' if fork is None or position < fork else f'{tag}{position}' for position in range(length)]
+
+
+@pytest.mark.parametrize('ours, theirs, fork', [
+    (10, 25, 10),  # The peer is ahead of us
+    (10, 25, 7),  # Its chain left ours a few blocks back
+    (20, 40, 1),  # Or just after the genesis block
+    (10, 25, 0),  # It has a different genesis block
+    (10, 8, 8),  # It is behind us
+])
+def test_fork_headers_finds_where_the_chains_part(ours, theirs, fork):
+    hashes = chain_hashes(ours)
+    peer = chain_hashes(theirs, fork)
+    fetch_page, _ = fake_peer(peer)
+    assert UniversityNode.fork_headers(fetch_page, hashes) == (fork, [{'hash': block_hash} for block_hash in peer[fork:]])
+
+
+def test_fork_headers_doubles_the_window_back():
+    hashes = chain_hashes(1000)
+    fetch_page, asked = fake_peer(chain_hashes(1010, 990), page_size=1000)
+    fork, headers = UniversityNode.fork_headers(fetch_page, hashes)
+    assert fork == 990 and len(headers) == 20
+    assert asked == [999, 998, 996, 992, 984]
+
+
+def test_fork_headers_only_fetches_the_length_it_first_saw():
+    hashes = chain_hashes(5)
+    peer = chain_hashes(12)
+    serve, asked = fake_peer(peer)
+
+    def fetch_page(start):
+        # The peer's chain keeps growing while we fetch it
+        values = serve(start)
+        peer.append(f'peer{len(peer)}')
+        return values
+    fork, headers = UniversityNode.fork_headers(fetch_page, hashes)
+    assert fork == 5 and [header['hash'] for header in headers[:7]] == chain_hashes(12)[5:]
+    assert asked == [4, 7, 10]
+
+
+def test_fork_headers_gives_up_when_a_fetch_fails():
+    hashes = chain_hashes(5)
+    fetch_page, _ = fake_peer(chain_hashes(12))
+    assert UniversityNode.fork_headers(lambda start: None, hashes) is None
+    assert UniversityNode.fork_headers(lambda start: fetch_page(start) if start < 7 else None, hashes) is None
+    assert UniversityNode.fork_headers(lambda start: {'length': 12}, hashes) is None
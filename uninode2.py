@@ -1,24 +1,79 @@
 import hashlib
 import json
-from time import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import localtime, sleep, time
 from urllib.parse import urlparse
 from uuid import uuid4
 
 import requests
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
 from Crypto.PublicKey import RSA
+import codec
 import crypto
-from threading import Thread
+import merkle
+from mining import (DEFAULT_DIFFICULTY, RETARGET_BLOCKS, TARGET_BLOCK_TIME, ParallelMiner, meets_difficulty,
+                    next_difficulty, next_turn, required_difficulty, required_producer)
+from keyregistry import KeyRegistry
+from records import STUDENT_FIELDS, Block, StudentRecord, valid_field
+from rwlock import ReadWriteLock
+from signing import BatchSigner, BatchVerifier
+from sqlitestore import SQLiteStudentIndex
+from storage import BlockStore
+from studentindex import StudentIndex, date_key
+from verifycache import VerificationCache
+from threading import Lock, Thread
 
 INSTITUTION_INFO_FILE_PATH = './institution.json'
 PUBLIC_KEYS_FILE_PATH = './publickeys.json'
+VERIFY_CACHE_SIZE = 100000
+MINING_JOBS_KEPT = 100
+PEER_TIMEOUT = 5
+PEER_FETCH_WORKERS = 16
+MAX_BLOCKS_PER_REQUEST = 100
+MAX_HEADERS_PER_REQUEST = 1000
+# Records returned by a student query at a time
+QUERY_PAGE_SIZE = 100
+# Least share of trigrams a name must have in common with another to match it fuzzily
+FUZZY_THRESHOLD = 0.4
+# Attempts at pushing a new block to a peer, waiting PUSH_BACKOFF seconds (doubling) between them
+PUSH_ATTEMPTS = 3
+PUSH_BACKOFF = 0.5
+# pow: blocks are mined with proof of work. poa: blocks are signed by the institution that made them.
+CONSENSUS_MODES = ('pow', 'poa')
+
+logger = logging.getLogger(__name__)
 
 
 class UniversityNode:
-    def __init__(self, institution_properties, keyfile):
+    def __init__(self, institution_properties, keyfile, miner=None, store=None, signer=None, verifier=None,
+                 target_block_time=TARGET_BLOCK_TIME, consensus='pow', port=None):
+        self.consensus = consensus
+        # Port we listen on, sent with the blocks we push so peers can sync back from us
+        self.port = port
         self.current_students = []
+        self.pending_since = None
+        self.pending_lock = Lock()
         self.chain = []
+        # Taken for reading to look at the chain, its hashes or the index, and
+        # for writing to extend or replace them, so readers never see them disagree
+        self.chain_lock = ReadWriteLock()
+        # Hash of each block in the chain, kept alongside it so blocks are only hashed once
+        self.hashes = []
         self.nodes = set()
+        self.index = StudentIndex()
+
+        # Keep-alive connections to peers, shared by the threads fetching from them
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=PEER_FETCH_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept'] = f'{codec.MIMETYPE}, application/json;q=0.9'
+        self.peer_pool = ThreadPoolExecutor(PEER_FETCH_WORKERS)
+        # Pushes new blocks to peers without holding up whoever made them
+        self.push_pool = ThreadPoolExecutor(PEER_FETCH_WORKERS)
+        # Tip hash of each peer's chain as of the last time we finished looking at it
+        self.peer_tips = {}
 
         # Private properties (for this node)
         self.institution_name = institution_properties['name']
@@ -29,9 +84,31 @@ class UniversityNode:
         self.ciph = crypto.Crypto()
         self.pubKey = RSA.importKey(self.institution_public_key)
         self.privKey = RSA.importKey(self.institution_private_key)
-
-        # Create the genesis block
-        self.new_block(previous_hash='1', proof=100)
+        self.signer = signer or BatchSigner(self.institution_private_key)
+        self.key_registry = KeyRegistry(PUBLIC_KEYS_FILE_PATH)
+        self.verify_cache = VerificationCache(VERIFY_CACHE_SIZE)
+        self.verifier = verifier or BatchVerifier()
+        self.key_generation = self.key_registry.generation
+        self.miner = miner or ParallelMiner()
+        self.target_block_time = target_block_time
+        self.mining_jobs = OrderedDict()
+        self.mining_job = None
+        self.mining_lock = Lock()
+
+        # Reload the chain we had before a restart, or create the genesis block
+        self.store = store
+        # Whether the chain and its hashes are views of the store's files rather than lists
+        self.mapped = store is not None and store.mapped
+        if self.store is not None:
+            self.chain, self.hashes = self.store.load(self.hash)
+            if self.mapped:
+                # Kept on disk beside the block log, so only the blocks it missed are read
+                self.index = SQLiteStudentIndex(self.store.path + '.students.db', self.hash)
+                self.index.sync(self.chain, self.hashes)
+            else:
+                self.index.add_blocks(0, self.chain)
+        if not self.chain:
+            self.new_block(previous_hash='1', proof=100)
 
     def register_node(self, address):
         """
@@ -56,27 +133,264 @@ class UniversityNode:
         :return: True if valid, False if not
         """
 
-        last_block = chain[0]
-        current_index = 1
+        return self.validate_chain(chain) is not None
+
+    @staticmethod
+    def common_prefix(chain, hashes):
+        """
+        Number of leading blocks a chain shares with ours. A block's previous_hash
+        matching the hash of our block before it commits to everything up to that
+        point being ours, so this is a binary search over the links.
+        :param chain: A blockchain
+        :param hashes: Hashes of the blocks in our chain
+        :return: Length of the shared prefix
+        """
+
+        low, high = 0, min(len(chain) - 1, len(hashes))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if chain[middle].previous_hash == hashes[middle - 1]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def validate_chain(self, chain):
+        """
+        Validate a blockchain. Blocks it shares with our chain are already known to
+        be valid, so only the blocks after the common ancestor are checked and our
+        own copies of the shared blocks are used in the result.
+        :param chain: A blockchain
+        :return: (chain, hashes) with the hash of every block if valid, None if not
+        """
+
+        if not chain:
+            return None
+
+        own_chain, own_hashes, length = self.snapshot()
+        fork = self.common_prefix(chain, own_hashes[:length])
+        if fork:
+            shared = own_hashes[:fork]
+            chain = own_chain[:fork] + chain[fork:]
+        else:
+            shared = [self.hash(chain[0])]
+            fork = 1
 
-        while current_index < len(chain):
+        last_hash = shared[-1]
+        hashes = []
+        for current_index in range(fork, len(chain)):
+            last_block = chain[current_index - 1]
             block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
-            # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(last_block):
+            logger.debug('%s\n%s\n\n-----------\n', last_block, block)
+            previous = chain[max(0, current_index - RETARGET_BLOCKS):current_index]
+            if not self.valid_block(block, current_index, previous, last_hash):
+                return None
+            last_hash = self.hash(block)
+            hashes.append(last_hash)
+
+        return chain, shared + hashes
+
+    def valid_block(self, block, position, previous, last_hash):
+        """
+        Check a block against the blocks before it
+        :param block: Block
+        :param position: Position of the block in its chain
+        :param previous: The last RETARGET_BLOCKS blocks before it, or all of them if there are fewer
+        :param last_hash: Hash of the block before it
+        :return: True if valid, False if not
+        """
+
+        last_block = previous[-1]
+
+        # Check that the hash of the block is correct
+        if block.previous_hash != last_hash:
+            return False
+
+        if self.consensus == 'poa':
+            # Check that a registered institution produced and signed the block, in its turn
+            producer = required_producer(last_block.timestamp, block.timestamp, self.key_registry.institutions(),
+                                         self.target_block_time)
+            if producer is None or producer != block.producer:
+                return False
+            if not self.valid_authority(block.to_dict(students=False), self.key_registry, self.ciph):
+                return False
+        else:
+            # Check that the block carries the difficulty the blocks before it call for
+            window = [(earlier.timestamp, earlier.difficulty) for earlier in previous]
+            difficulty = required_difficulty(position, window, block.difficulty, block.timestamp, self.target_block_time)
+            if difficulty is None:
                 return False
 
             # Check that the Proof of Work is correct
-            if not self.valid_proof(last_block['proof'], block['proof'], block['previous_hash']):
+            if not self.valid_proof(last_block.proof, block.proof, block.previous_hash, difficulty):
                 return False
 
-            last_block = block
-            current_index += 1
+        # Check that the students are the ones the Merkle root commits to
+        return block.merkle_root is None or self.valid_merkle_root(block)
+
+    def fetch(self, node, path, headers=None, **params):
+        """
+        GET a JSON document from a peer
+        :param node: Address of the peer
+        :param path: Path on the peer, eg. '/chain/length'
+        :param headers: Extra request headers
+        :return: The decoded JSON, or None if the peer could not be reached or had nothing new
+        """
+
+        try:
+            response = self.session.get(f'http://{node}{path}', params=params, headers=headers, timeout=PEER_TIMEOUT)
+            if response.status_code != 200:
+                return None
+            if response.headers.get('Content-Type', '').startswith(codec.MIMETYPE):
+                return codec.loads(response.content)
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Skipping peer %s: %s', node, e)
+            return None
+
+    def fetch_length(self, node):
+        # A peer whose tip has not moved since we last looked answers 304 and is skipped
+        headers = {}
+        if node in self.peer_tips:
+            headers['If-None-Match'] = f'"{self.peer_tips[node]}"'
+        values = self.fetch(node, '/chain/length', headers)
+        if values is None or 'length' not in values:
+            return None
+        return values['length'], node, values.get('hash')
+
+    def find_fork(self, node):
+        """
+        Find where a peer's chain leaves ours and fetch its headers after that point
+        :param node: Address of the peer
+        :return: (number of shared blocks, headers of the peer's blocks after them), or None
+        """
+
+        def fetch_page(start):
+            return self.fetch(node, '/chain/headers', **{'from': start, 'to': start + MAX_HEADERS_PER_REQUEST})
+        return self.fork_headers(fetch_page, self.hashes)
+
+    @staticmethod
+    def fork_headers(fetch_page, hashes):
+        """
+        Find where a peer's chain leaves ours by fetching headers backwards
+        from our tip, doubling the window until one of them is a block we have,
+        then fetch the peer's headers from there a page at a time
+        :param fetch_page: Function fetching the peer's /chain/headers from a position, giving None on failure
+        :param hashes: Hashes of the blocks in our chain
+        :return: (number of shared blocks, headers of the peer's blocks after them), or None
+        """
+
+        back = 1
+        while True:
+            start = max(0, len(hashes) - back)
+            values = fetch_page(start)
+            if values is None or 'headers' not in values:
+                return None
+            page = values['headers']
+            if start == 0 or (page and page[0].get('hash') == hashes[start]):
+                break
+            back *= 2
+
+        # Only as many pages as the peer's chain had when we started are fetched
+        length = values.get('length')
+        fork, headers = start, []
+        while True:
+            for header in page:
+                if not headers and fork < len(hashes) and header.get('hash') == hashes[fork]:
+                    fork += 1
+                else:
+                    headers.append(header)
+            position = fork + len(headers)
+            if not page or not isinstance(length, int) or position >= length:
+                return fork, headers
+            values = fetch_page(position)
+            if values is None or 'headers' not in values:
+                return None
+            page = values['headers']
+
+    def valid_headers(self, fork, headers):
+        """
+        Check that headers following our first fork blocks link up and carry valid
+        Proofs of Work (or producer signatures), before any of the blocks themselves are downloaded
+        :param fork: Number of blocks shared with our chain
+        :param headers: Headers of the blocks after them
+        :return: True if valid, False if not
+        """
 
+        # (timestamp, difficulty) of the blocks before each header, for retargeting
+        window = [(block.timestamp, block.difficulty) for block in self.chain[max(0, fork - RETARGET_BLOCKS):fork]]
+        if fork:
+            last_proof, last_hash = self.chain[fork - 1].proof, self.hashes[fork - 1]
+        else:
+            # A different genesis block, which is taken as it is
+            last_proof, last_hash = headers[0]['proof'], headers[0]['hash']
+            window.append((headers[0]['timestamp'], headers[0].get('difficulty')))
+            headers = headers[1:]
+            fork = 1
+
+        for position, header in enumerate(headers, fork):
+            if header['previous_hash'] != last_hash:
+                return False
+            if self.consensus == 'poa':
+                producer = required_producer(window[-1][0], header['timestamp'], self.key_registry.institutions(),
+                                             self.target_block_time)
+                if producer is None or producer != header.get('producer'):
+                    return False
+                if not self.valid_authority(header, self.key_registry, self.ciph):
+                    return False
+            else:
+                difficulty = required_difficulty(position, window[-RETARGET_BLOCKS:], header.get('difficulty'),
+                                                 header['timestamp'], self.target_block_time)
+                if difficulty is None:
+                    return False
+                if not self.valid_proof(last_proof, header['proof'], header['previous_hash'], difficulty):
+                    return False
+            last_proof, last_hash = header['proof'], header['hash']
+            window.append((header['timestamp'], header.get('difficulty')))
         return True
 
+    def sync_with(self, node):
+        """
+        Fetch the blocks a peer has that we do not. Headers are fetched and
+        checked first, so only the blocks after the fork point are downloaded.
+        :param node: Address of the peer
+        :return: (chain, hashes) of the peer's chain if valid, None if not
+        """
+
+        found = self.find_fork(node)
+        if found is None:
+            return None
+        fork, headers = found
+        if not headers or fork + len(headers) <= len(self.chain):
+            return None
+        try:
+            if not self.valid_headers(fork, headers):
+                logger.warning('Peer %s sent invalid headers', node)
+                return None
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning('Peer %s sent malformed headers: %s', node, e)
+            return None
+
+        blocks = []
+        end = fork + len(headers)
+        while fork + len(blocks) < end:
+            start = fork + len(blocks)
+            values = self.fetch(node, '/blocks', **{'from': start, 'to': min(end, start + MAX_BLOCKS_PER_REQUEST)})
+            if not values or not values.get('blocks'):
+                return None
+            try:
+                blocks.extend(Block.from_dict(block) for block in values['blocks'])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning('Peer %s sent a malformed block: %s', node, e)
+                return None
+
+        try:
+            return self.validate_chain(self.chain[:fork] + blocks[:end - fork])
+        except (KeyError, TypeError, ValueError) as e:
+            # Whatever is wrong with the peer's chain, it must not stop us resolving against the others
+            logger.warning('Peer %s sent an invalid chain: %s', node, e)
+            return None
+
     def resolve_conflicts(self):
         """
         This is our consensus algorithm, it resolves conflicts
@@ -84,53 +398,333 @@ class UniversityNode:
         :return: True if our chain was replaced, False if not
         """
 
-        neighbours = self.nodes
-        new_chain = None
+        neighbours = list(self.nodes)
+        logger.debug('Resolving against %s', neighbours)
+
+        # Ask all the nodes in our network for their chain length at once
+        lengths = [result for result in self.peer_pool.map(self.fetch_length, neighbours) if result is not None]
+
+        # We're only looking for chains longer than ours, longest first
+        replaced = False
+        for length, node, tip in sorted(lengths, reverse=True):
+            if length > len(self.chain) and not replaced:
+                validated = self.sync_with(node)
+                if validated is None:
+                    # Try this peer again next time
+                    continue
+                # Replace our chain with the longest valid chain we discovered
+                replaced = self.adopt_chain(validated)
+            self.peer_tips[node] = tip
+
+        return replaced
+
+    def replace_chain(self, new_chain, new_hashes):
+        """
+        Swap in a new chain and update the student index for the blocks that changed.
+        Our own records in blocks the new chain drops go back on the pending list.
+        :param new_chain: A valid chain
+        :param new_hashes: Hash of every block in new_chain, as returned by validate_chain
+        """
+
+        with self.chain_lock.write():
+            fork = 0
+            shared = min(len(self.hashes), len(new_hashes))
+            while fork < shared and self.hashes[fork] == new_hashes[fork]:
+                fork += 1
+
+            added = [self.index.entries(new_chain[position]) for position in range(fork, len(new_chain))]
+            if self.store is not None:
+                self.store.replace(fork, new_chain[fork:], new_hashes[fork:])
+            self.index.replace_chain(self.chain, new_chain, fork, added)
+            orphaned = [student for block in self.chain[fork:] for student in block.students
+                        if student.institution_name == self.institution_name
+                        and self.index.locate(student.record_id()) is None]
+            if self.mapped:
+                self.chain, self.hashes = self.store.views()
+            else:
+                self.hashes = list(new_hashes)
+                self.chain = list(new_chain)
+            self.verify_cache.clear()
+
+        if orphaned:
+            logger.info('Returning %d records from replaced blocks to the pending list', len(orphaned))
+            with self.pending_lock:
+                if not self.current_students:
+                    self.pending_since = time()
+                self.current_students[:0] = orphaned
+
+    def adopt_chain(self, validated):
+        """
+        Replace our chain with a validated one if it is still longer than ours
+        :param validated: (chain, hashes) as returned by validate_chain, or None
+        :return: True if our chain was replaced, False if not
+        """
+
+        with self.chain_lock.write():
+            if validated is None or len(validated[0]) <= len(self.chain):
+                return False
+            self.replace_chain(*validated)
+        return True
+
+    def sync_from(self, node):
+        """
+        Catch up with one peer, replacing our chain if the peer's is longer and valid
+        :param node: Address of the peer
+        :return: True if our chain was replaced, False if not
+        """
+
+        return self.adopt_chain(self.sync_with(node))
+
+    def snapshot(self):
+        """
+        Our chain and its hashes as they are now. Blocks are only ever added to
+        the end of these lists and a replaced chain is a new list, so the first
+        length entries of both stay as they were however the chain changes after.
+        The same holds for views of a store, which never change once taken.
+        :return: (chain, hashes, length)
+        """
+
+        with self.chain_lock.read():
+            return self.chain, self.hashes, len(self.chain)
+
+    def accept_block(self, values, block_hash, sender=None):
+        """
+        Take a block pushed by a peer. A block that extends our tip is checked
+        and appended; one that is further ahead than that means we missed some
+        blocks, so we sync from the peer that sent it.
+        :param values: The Block, as a dict
+        :param block_hash: Hash the peer gives for the Block
+        :param sender: Address of the peer to sync from on a gap, if known
+        :return: 'added', 'known', 'ignored' (not ahead of our chain), 'syncing' or 'rejected'
+        """
 
-        # We're only looking for chains longer than ours
-        max_length = len(self.chain)
-        print(neighbours)
-        # Grab and verify the chains from all the nodes in our network
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
+        try:
+            block = Block.from_dict(values)
+            position = block.index - 1
+        except (KeyError, TypeError, ValueError):
+            return 'rejected'
+        if not isinstance(position, int) or position < 1 or self.hash(block) != block_hash:
+            return 'rejected'
+
+        with self.chain_lock.write():
+            if position < len(self.chain):
+                return 'known' if self.hashes[position] == block_hash else 'ignored'
+            if position == len(self.chain) and block.previous_hash == self.hashes[-1]:
+                if not self.valid_block(block, position, self.chain[-RETARGET_BLOCKS:], self.hashes[-1]):
+                    return 'rejected'
+                self.append_block(block, block_hash)
+                self.broadcast(block, block_hash, exclude=sender)
+                return 'added'
+
+        if sender is None:
+            return 'ignored'
+        self.push_pool.submit(self.sync_from, sender)
+        return 'syncing'
+
+    def broadcast(self, block, block_hash, exclude=None):
+        """
+        Push a block to every peer in the background
+        :param block: Block
+        :param block_hash: Hash of the Block
+        :param exclude: Address of a peer that already has it
+        """
 
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
-                # Check if the length is longer and the chain is valid
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+        payload = codec.dumps({'block': block.to_dict(), 'hash': block_hash, 'port': self.port})
+        for node in list(self.nodes):
+            if node != exclude:
+                self.push_pool.submit(self.push_block, node, payload)
 
-        # Replace our chain if we discovered a new, valid chain longer than ours
-        if new_chain:
-            self.chain = new_chain
-            return True
+    def push_block(self, node, payload):
+        """
+        POST an encoded block to a peer, retrying if the peer cannot be reached
+        :param node: Address of the peer
+        :param payload: The encoded block, hash and our port
+        :return: True if the peer took the block, False if not
+        """
 
+        delay = PUSH_BACKOFF
+        for attempt in range(PUSH_ATTEMPTS):
+            if attempt:
+                sleep(delay)
+                delay *= 2
+            try:
+                response = self.session.post(f'http://{node}/nodes/accept_block', data=payload, timeout=PEER_TIMEOUT,
+                                             headers={'Content-Type': codec.MIMETYPE})
+            except requests.RequestException as e:
+                logger.debug('Pushing a block to %s failed: %s', node, e)
+                continue
+            if response.status_code < 500:
+                return response.status_code in (200, 202)
+        logger.warning('Could not push a block to %s', node)
         return False
 
-    def new_block(self, proof, previous_hash):
+    def find_students(self, first_name, last_name, student_id):
+        """
+        Look up the records for a student in the chain
+        :return: List of matching student records
+        """
+
+        with self.chain_lock.read():
+            return self.index.find(self.chain, first_name, last_name, student_id)
+
+    def match_students(self, first_name, last_name, student_id, fuzzy=False):
+        """
+        Look up the records for a student: those that match exactly, then those
+        that match but for case, spacing and Unicode form, then if fuzzy is set,
+        those with the same student id and a similar name, most similar first
+        :return: List of (how the record matched, student record), best matches first
+        """
+
+        with self.chain_lock.read():
+            matches = [('exact', location) for location in self.index.locate_student(first_name, last_name, student_id)]
+            matches += [('normalized', location)
+                        for location in self.index.locate_normalized(first_name, last_name, student_id)]
+            if fuzzy:
+                matches += [('fuzzy', (position, slot)) for _, position, slot
+                            in self.index.locate_similar(first_name, last_name, student_id, FUZZY_THRESHOLD)]
+
+            found, seen = [], set()
+            for match, (position, slot) in matches:
+                if (position, slot) not in seen:
+                    seen.add((position, slot))
+                    found.append((match, self.index.student(self.chain, position, slot)))
+            return found
+
+    def similar_students(self, first_name, last_name, limit):
+        """
+        Look up the records with names like a student's, whatever their student id
+        :return: List of (similarity, student record), most similar first
+        """
+
+        with self.chain_lock.read():
+            return [(score, self.index.student(self.chain, position, slot)) for score, position, slot
+                    in self.index.locate_similar(first_name, last_name, None, FUZZY_THRESHOLD, limit)]
+
+    def query_students(self, query, *args):
+        """
+        Look records up through one of the student index's queries
+        :param query: Name of a query method of the student index, eg. 'of_institution'
+        :param args: Its arguments
+        :return: (number of records the query matches, the student records on the requested page)
+        """
+
+        with self.chain_lock.read():
+            total, locations = getattr(self.index, query)(*args)
+            return total, [self.index.student(self.chain, position, slot) for position, slot in locations]
+
+    def refresh_keys(self):
+        """
+        Pick up changes to the public keys, dropping results verified with the old ones
+        """
+
+        self.key_registry.refresh()
+        if self.key_registry.generation != self.key_generation:
+            self.verify_cache.clear()
+            self.key_generation = self.key_registry.generation
+
+    def verify_record(self, student):
+        """
+        Check a student record's signature against its institution's public key
+        :param student: Student record
+        :return: True if the signature is authentic, False if not
+        """
+
+        self.refresh_keys()
+        public_key = self.key_registry.keys.get(student.institution_name)
+        if public_key is None:
+            return False
+
+        key = self.verify_key(student)
+        verified = self.verify_cache.get(key)
+        if verified is None:
+            verified = self.ciph.asymmetric_verify(key[0], key[1], public_key)
+            self.verify_cache.put(key, verified)
+        return verified
+
+    def verify_records(self, students):
+        """
+        Check the signatures of many student records at once. Each distinct
+        signature is checked once, cached results are reused and the rest are
+        verified in parallel when there are verifier processes.
+        :param students: List of student records
+        :return: List of bool, in the same order
+        """
+
+        if self.verifier.workers <= 1:
+            return [self.verify_record(student) for student in students]
+
+        self.refresh_keys()
+        keys = [self.verify_key(student) for student in students]
+        results = {}
+        for key in keys:
+            if key not in results:
+                results[key] = self.verify_cache.get(key)
+
+        missing = [key for key, verified in results.items() if verified is None]
+        for key, verified in zip(missing, self.verifier.verify_all(missing, self.key_registry)):
+            results[key] = verified
+            self.verify_cache.put(key, verified)
+        return [results[key] for key in keys]
+
+    @staticmethod
+    def verify_key(student):
+        # What a signature check depends on, also the key its result is cached under
+        return student.sign_string(), student.signature_hex, student.institution_name
+
+    def new_block(self, proof, previous_hash, difficulty=DEFAULT_DIFFICULTY, timestamp=None):
         """
         Create a new Block in the Blockchain
         :param proof: The proof given by the Proof of Work algorithm
         :param previous_hash: Hash of previous Block
+        :param difficulty: The difficulty the proof was found at
+        :param timestamp: Timestamp to give the Block, or None for now
         :return: New Block
         """
 
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': time(),
-            'students': self.current_students,
-            'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Reset the current list of transactions
-        self.current_students = []
+        # Take the current list of transactions and reset it
+        with self.pending_lock:
+            students = self.current_students
+            self.current_students = []
+            self.pending_since = None
+
+        # Timestamps never go backwards, even if the last block came from a peer whose clock is ahead
+        if timestamp is None:
+            timestamp = max(time(), self.last_block.timestamp) if self.chain else time()
+        block = Block(
+            index=len(self.chain) + 1,
+            timestamp=timestamp,
+            students=students,
+            merkle_root=merkle.merkle_root([student.record_id() for student in students]),
+            difficulty=difficulty,
+            proof=proof,
+            previous_hash=previous_hash or self.hashes[-1],
+        )
+        if self.consensus == 'poa':
+            block.producer = self.institution_name
+            authority_string = self.authority_string(block.to_dict(students=False))
+            block.signature = bytes.fromhex(self.ciph.asymmetric_sign(authority_string, self.privKey))
+
+        self.append_block(block, self.hash(block))
+        return block
 
-        self.chain.append(block)
+    def append_block(self, block, block_hash):
+        """
+        Add a checked Block to the end of our chain
+        :param block: Block
+        :param block_hash: Hash of the Block
+        """
 
-        return block
+        with self.chain_lock.write():
+            # Worked out first, so that a block whose records cannot be indexed is not stored either
+            entries = self.index.entries(block)
+            if self.store is not None:
+                self.store.append(block, block_hash)
+            if self.mapped:
+                self.chain, self.hashes = self.store.views()
+            else:
+                self.hashes.append(block_hash)
+                self.chain.append(block)
+            self.index.add_block(len(self.chain) - 1, block, entries)
 
     def new_transaction(self, sender, recipient, amount, date):
         """
@@ -140,16 +734,12 @@ class UniversityNode:
         :param amount: Amount
         :return: The index of the Block that will hold this transaction
         """
-        transaction = {
-            'first_name': sender,
-            'last_name': recipient,
-            'student_id': amount,
-            'date_enrolled_through': date,
-            'institution_name': self.institution_name
-        }
-        sign_string = str(sender) + str(recipient) + str(amount) + str(date) + str(self.institution_name)
-        transaction['signature'] = self.ciph.asymmetric_sign(str(sign_string), self.privKey)
-        self.current_students.append(transaction)
+        transaction = StudentRecord(sender, recipient, amount, date, self.institution_name)
+        transaction.signature = bytes.fromhex(self.ciph.asymmetric_sign(transaction.sign_string(), self.privKey))
+        with self.pending_lock:
+            if not self.current_students:
+                self.pending_since = time()
+            self.current_students.append(transaction)
         # new_one = dict(transaction)
         # sig = new_one['signature']
         # new_one.pop('signature', None)
@@ -163,7 +753,130 @@ class UniversityNode:
         #     'contents_signature': self.institution_name
         #     # 'contents_signature': SIGN(self.institution_name)
         # })
-        return self.last_block['index'] + 1
+        return self.last_block.index + 1
+
+    def new_transactions(self, students):
+        """
+        Creates a batch of new transactions to go into the next mined Block. Every
+        student is checked before any is signed, the signatures are made in bulk
+        and the valid students are added to the pending list together.
+        :param students: List of dicts with the fields in STUDENT_FIELDS
+        :return: (index of the Block that will hold them, result for each student)
+        """
+
+        results = []
+        transactions = []
+        for values in students:
+            error = self.check_student(values)
+            results.append({'status': 'rejected', 'error': error} if error else {'status': 'added'})
+            if not error:
+                fields = [values[field] for field in STUDENT_FIELDS]
+                transactions.append(StudentRecord(*fields, self.institution_name))
+
+        signatures = self.signer.sign_all([transaction.sign_string() for transaction in transactions])
+        for transaction, signature in zip(transactions, signatures):
+            transaction.signature = bytes.fromhex(signature)
+
+        with self.pending_lock:
+            if transactions and not self.current_students:
+                self.pending_since = time()
+            self.current_students.extend(transactions)
+        return self.last_block.index + 1, results
+
+    @staticmethod
+    def check_student(values):
+        """
+        Check a student submitted for enrollment
+        :return: Why the student cannot be added, or None if it can
+        """
+
+        if not isinstance(values, dict):
+            return 'Not an object'
+        missing = [field for field in STUDENT_FIELDS if field not in values]
+        if missing:
+            return 'Missing values: ' + ', '.join(missing)
+        for field in STUDENT_FIELDS:
+            if not valid_field(values[field]):
+                return f'Invalid value for {field}'
+        return None
+
+    @staticmethod
+    def valid_merkle_root(block):
+        """
+        Check a Block's Merkle root against its students
+        :param block: Block
+        :return: True if correct, False if not
+        """
+
+        leaves = [student.record_id() for student in block.students]
+        return merkle.merkle_root(leaves) == block.merkle_root
+
+    def record_proof(self, record_id):
+        """
+        Proof that a student record is in the chain: the record, the header of
+        its block and the Merkle path from the record to the block's root
+        :param record_id: Merkle leaf hash of the record
+        :return: The proof, or None if there is no such record
+        """
+
+        with self.chain_lock.read():
+            location = self.index.locate(record_id)
+            if location is None:
+                return None
+            position, slot = location
+            block, block_hash = self.chain[position], self.hashes[position]
+        leaves = [student.record_id() for student in block.students]
+
+        return {
+            'record_id': record_id,
+            'record': block.students[slot].to_dict(),
+            'header': self.header(block, block_hash),
+            'path': merkle.merkle_path(leaves, slot),
+        }
+
+    @staticmethod
+    def authority_string(header):
+        """
+        The string the producing institution signs for a block made by proof of
+        authority: the hash of its header without the signature. The Merkle
+        root in the header commits to the students.
+        :param header: Header of the Block, as a dict
+        """
+
+        unsigned = {key: value for key, value in header.items() if key not in ('signature', 'hash')}
+        return UniversityNode.hash(unsigned)
+
+    @staticmethod
+    def valid_authority(header, key_registry, ciph):
+        """
+        Check that a block made by proof of authority is signed by its producer,
+        an institution in the key registry
+        :param header: Header of the Block, as a dict
+        :param key_registry: KeyRegistry of the consortium
+        :param ciph: Crypto instance
+        :return: True if valid, False if not
+        """
+
+        # Without a Merkle root the signed header would not cover the students
+        if 'merkle_root' not in header:
+            return False
+        public_key = key_registry.get(header.get('producer'))
+        signature = header.get('signature')
+        if public_key is None or not isinstance(signature, str):
+            return False
+        return ciph.asymmetric_verify(UniversityNode.authority_string(header), signature, public_key)
+
+    @staticmethod
+    def header(block, block_hash):
+        """
+        The header of a Block: everything but its students, plus its hash
+        :param block: Block
+        :param block_hash: Hash of the Block
+        """
+
+        header = block.to_dict(students=False)
+        header['hash'] = block_hash
+        return header
 
     @property
     def last_block(self):
@@ -172,45 +885,156 @@ class UniversityNode:
     @staticmethod
     def hash(block):
         """
-        Creates a SHA-256 hash of a Block
-        :param block: Block
+        Creates a SHA-256 hash of a Block. Blocks with a Merkle root are hashed
+        without their students, which the root already commits to.
+        :param block: Block, or the dict of a Block or header as sent between nodes
         """
 
+        if isinstance(block, Block):
+            block = block.to_dict(students=block.merkle_root is None)
+        elif 'merkle_root' in block:
+            block = {key: value for key, value in block.items() if key != 'students'}
+
         # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
         block_string = json.dumps(block, sort_keys=True).encode()
         return hashlib.sha256(block_string).hexdigest()
 
-    def proof_of_work(self, last_block):
+    def proof_of_work(self, last_block, difficulty=DEFAULT_DIFFICULTY):
         """
         Simple Proof of Work Algorithm:
-         - Find a number p' such that hash(pp') contains leading 4 zeroes
+         - Find a number p' such that hash(pp') starts with difficulty zero bits
          - Where p is the previous proof, and p' is the new proof
          
-        :param last_block: <dict> last Block
+        :param last_block: <Block> last Block
+        :param difficulty: <int> Number of leading zero bits needed
         :return: <int>
         """
 
-        last_proof = last_block['proof']
+        last_proof = last_block.proof
         last_hash = self.hash(last_block)
 
-        proof = 0
-        while self.valid_proof(last_proof, proof, last_hash) is False:
-            proof += 1
-        return proof
+        return self.miner.mine(last_proof, last_hash, difficulty)
+
+    def mining_difficulty(self):
+        """
+        The difficulty the next block on our chain must be mined at
+        :return: <int>
+        """
+
+        window = [(block.timestamp, block.difficulty) for block in self.chain[-RETARGET_BLOCKS:]]
+        return next_difficulty(len(self.chain), window, self.target_block_time)
+
+    def mine(self):
+        """
+        Run the proof of work algorithm and forge the new Block, then push it to
+        our peers. Under proof of authority the Block is signed instead, with
+        nothing to search for, once it is our turn to make one.
+        :return: New Block
+        :raises ValueError: Under proof of authority, if we have no registered key
+        """
+
+        while True:
+            chain, hashes, length = self.snapshot()
+            last_block, last_hash = chain[length - 1], hashes[length - 1]
+            timestamp = None
+            if self.consensus == 'poa':
+                difficulty, proof = None, 0
+                turn = next_turn(last_block.timestamp, self.key_registry.institutions(), self.institution_name,
+                                 self.target_block_time)
+                if turn is None:
+                    raise ValueError(f'{self.institution_name} has no registered key to sign blocks with')
+                sleep(max(0, turn - time()))
+            else:
+                difficulty = self.mining_difficulty()
+                proof = self.proof_of_work(last_block, difficulty)
+            with self.chain_lock.write():
+                if self.consensus == 'poa':
+                    # Our turn may have passed while we waited for the lock
+                    timestamp = max(time(), turn)
+                    if required_producer(last_block.timestamp, timestamp, self.key_registry.institutions(),
+                                         self.target_block_time) != self.institution_name:
+                        continue
+                # The chain may have been extended or replaced while we were mining
+                if self.hashes[-1] == last_hash:
+                    block = self.new_block(proof, last_hash, difficulty, timestamp)
+                    block_hash = self.hashes[-1]
+                    break
+
+        self.broadcast(block, block_hash)
+        return block
+
+    def start_mining(self):
+        """
+        Mine a new Block in a background thread. Only one job runs at a time;
+        if one is already running it is returned instead of starting another.
+        :return: The mining job
+        """
+
+        with self.mining_lock:
+            if self.mining_job is not None and self.mining_job['status'] == 'running':
+                return self.mining_job
+
+            job = {
+                'id': uuid4().hex,
+                'status': 'running',
+                'started': time(),
+                'finished': None,
+                'block': None,
+                'error': None,
+            }
+            self.mining_job = job
+            self.mining_jobs[job['id']] = job
+            while len(self.mining_jobs) > MINING_JOBS_KEPT:
+                self.mining_jobs.popitem(last=False)
+
+        Thread(target=self._run_mining_job, args=(job,), daemon=True).start()
+        return job
+
+    def _run_mining_job(self, job):
+        try:
+            block = self.mine()
+            job['block'] = block
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        job['finished'] = time()
+
+    def auto_mine(self, max_students=None, max_age=None, interval=1):
+        """
+        Start mining jobs on our own once the pending students pass a size or age threshold
+        :param max_students: Mine once this many students are waiting
+        :param max_age: Mine once the oldest waiting student is this many seconds old
+        :param interval: Seconds between checks
+        """
+
+        def watch():
+            while True:
+                sleep(interval)
+                with self.pending_lock:
+                    waiting = len(self.current_students)
+                    since = self.pending_since
+                if not waiting:
+                    continue
+                if (max_students is not None and waiting >= max_students) or \
+                        (max_age is not None and time() - since >= max_age):
+                    self.start_mining()
+
+        Thread(target=watch, daemon=True).start()
 
     @staticmethod
-    def valid_proof(last_proof, proof, last_hash):
+    def valid_proof(last_proof, proof, last_hash, difficulty=DEFAULT_DIFFICULTY):
         """
         Validates the Proof
         :param last_proof: <int> Previous Proof
         :param proof: <int> Current Proof
         :param last_hash: <str> The hash of the Previous Block
+        :param difficulty: <int> Number of leading zero bits needed
         :return: <bool> True if correct, False if not.
         """
 
         guess = f'{last_proof}{proof}{last_hash}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] == "0000"
+        return meets_difficulty(hashlib.sha256(guess).digest(), difficulty)
 
 
 # Instantiate the Node
@@ -223,33 +1047,45 @@ node = None
 
 @app.route('/mine', methods=['GET'])
 def mine():
-    global node
-    # We run the proof of work algorithm to get the next proof...
-    last_block = node.last_block
-    proof = node.proof_of_work(last_block)
-
-    # Forge the new Block by adding it to the chain
-    previous_hash = node.hash(last_block)
-    block = node.new_block(proof, previous_hash)
+    # Proof of work runs in the background, the job can be polled at /mine/<job_id>
+    job = node.start_mining()
 
     response = {
-        'message': "New Block Forged",
-        'index': block['index'],
-        'students': block['students'],
-        'proof': block['proof'],
-        'previous_hash': block['previous_hash'],
+        'message': "Mining started",
+        'job_id': job['id'],
+        'status': job['status'],
     }
+    return jsonify(response), 202
+
+
+@app.route('/mine/<job_id>', methods=['GET'])
+def mining_status(job_id):
+    job = node.mining_jobs.get(job_id)
+    if job is None:
+        return 'Unknown mining job', 404
+
+    response = {key: job[key] for key in ('id', 'status', 'started', 'finished', 'error')}
+    block = job['block']
+    if block is not None:
+        response.update({
+            'message': "New Block Forged",
+            'index': block.index,
+            'students': [student.to_dict() for student in block.students],
+            'difficulty': block.difficulty,
+            'proof': block.proof,
+            'previous_hash': block.previous_hash,
+        })
     return jsonify(response), 200
 
 
 @app.route('/student/new', methods=['POST'])
 def new_transaction():
-    values = request.get_json()
+    values = request.get_json(silent=True)
 
-    # Check that the required fields are in the POST'ed data
-    required = ['first_name', 'last_name', 'student_id', 'date_enrolled_through']
-    if not all(k in values for k in required):
-        return 'Missing values', 400
+    # Check that the required fields are in the POST'ed data and hold plain values
+    error = node.check_student(values)
+    if error:
+        return error, 400
 
     # Create a new Transaction
     index = node.new_transaction(values['first_name'], values['last_name'], values['student_id'], values['date_enrolled_through'])
@@ -258,13 +1094,129 @@ def new_transaction():
     return jsonify(response), 201
 
 
+@app.route('/students/batch', methods=['POST'])
+def new_transactions():
+    # Either a JSON array of students or NDJSON with one student per line
+    if request.mimetype == 'application/x-ndjson':
+        students = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                students.append(json.loads(line))
+            except ValueError:
+                students.append(None)
+    else:
+        students = request.get_json(silent=True)
+        if not isinstance(students, list):
+            return 'Expected a JSON array of students', 400
+
+    index, results = node.new_transactions(students)
+    added = sum(result['status'] == 'added' for result in results)
+
+    response = {
+        'message': f'{added} transactions will be added to Block {index}',
+        'added': added,
+        'rejected': len(results) - added,
+        'results': results,
+    }
+    return jsonify(response), 201
+
+
+def negotiated(document):
+    """
+    Respond with the binary encoding to nodes that accept it and JSON to everyone else
+    :param document: The response document
+    """
+
+    if request.accept_mimetypes.best_match(['application/json', codec.MIMETYPE]) == codec.MIMETYPE:
+        return Response(codec.dumps(document), mimetype=codec.MIMETYPE)
+    return jsonify(document)
+
+
+def not_modified(etag):
+    """
+    A 304 response if the client already has the version of the chain tagged etag
+    :param etag: Tag of the current version, the tip hash
+    :return: The 304 response, or None if the client's copy is out of date
+    """
+
+    if etag not in request.if_none_match:
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    chain, hashes, length = node.snapshot()
+    tip = hashes[length - 1]
+    cached = not_modified(tip)
+    if cached is not None:
+        return cached
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', length, type=int)
+    end = min(length, offset + max(limit, 0))
+
+    # Stream the blocks one at a time rather than building the whole document
+    def generate():
+        yield '{"chain": ['
+        for position in range(offset, end):
+            if position > offset:
+                yield ', '
+            yield json.dumps(chain[position].to_dict())
+        yield f'], "length": {length}}}'
+
+    response = Response(generate(), mimetype='application/json')
+    response.set_etag(tip)
+    return response
+
+
+@app.route('/chain/length', methods=['GET'])
+def chain_length():
+    _, hashes, length = node.snapshot()
+    tip = hashes[length - 1]
+    cached = not_modified(tip)
+    if cached is not None:
+        return cached
+
+    response = jsonify({
+        'length': length,
+        'hash': tip,
+    })
+    response.set_etag(tip)
+    return response
+
+
+@app.route('/chain/headers', methods=['GET'])
+def chain_headers():
+    # Positions are offsets into the chain, so block N has position N - 1
+    chain, hashes, length = node.snapshot()
+    start = max(request.args.get('from', 0, type=int), 0)
+    end = request.args.get('to', length, type=int)
+    positions = range(start, min(end, length, start + MAX_HEADERS_PER_REQUEST))
+
     response = {
-        'chain': node.chain,
-        'length': len(node.chain),
+        'headers': [node.header(chain[position], hashes[position]) for position in positions],
+        'length': length,
     }
-    return jsonify(response), 200
+    return negotiated(response), 200
+
+
+@app.route('/blocks', methods=['GET'])
+def blocks():
+    chain, _, length = node.snapshot()
+    start = max(request.args.get('from', 0, type=int), 0)
+    end = request.args.get('to', length, type=int)
+    end = min(end, length, start + MAX_BLOCKS_PER_REQUEST)
+
+    response = {
+        'blocks': [block.to_dict() for block in chain[start:end]],
+        'length': length,
+    }
+    return negotiated(response), 200
 
 
 @app.route('/nodes/register', methods=['POST'])
@@ -288,20 +1240,57 @@ def register_nodes():
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
     replaced = node.resolve_conflicts()
+    chain, _, length = node.snapshot()
 
     if replaced:
         response = {
             'message': 'Our chain was replaced',
-            'new_chain': node.chain
+            'new_chain': [block.to_dict() for block in chain[:length]]
         }
     else:
         response = {
             'message': 'Our chain is authoritative',
-            'chain': node.chain
+            'chain': [block.to_dict() for block in chain[:length]]
         }
 
     return jsonify(response), 200
 
+@app.route('/nodes/accept_block', methods=['POST'])
+def accept_block():
+    # Peers push blocks in the binary encoding, anything else may send JSON
+    if request.mimetype == codec.MIMETYPE:
+        try:
+            values = codec.loads(request.get_data())
+        except codec.CodecError:
+            values = None
+    else:
+        values = request.get_json(silent=True)
+    if not isinstance(values, dict) or not all(k in values for k in ('block', 'hash')):
+        return 'Missing values', 400
+
+    # The peer's address as we see it, with the port it says it listens on
+    port = values.get('port')
+    host = f'[{request.remote_addr}]' if ':' in request.remote_addr else request.remote_addr
+    sender = f'{host}:{port}' if isinstance(port, int) else None
+    status = node.accept_block(values['block'], values['hash'], sender)
+
+    response = {'status': status, 'length': len(node.chain)}
+    if status == 'rejected':
+        return jsonify(response), 400
+    return jsonify(response), 202 if status == 'syncing' else 200
+
+def verification(student, match):
+    """
+    The result of verifying a student against a record whose signature checks out
+    :param match: How the record matched the query, see UniversityNode.match_students
+    """
+
+    result = {"result" : True, "school" : student.institution_name, "signature": student.signature_hex, "record_id": student.record_id(), "match": match}
+    if match != 'exact':
+        # Let the client see who it matched
+        result.update(first_name=student.first_name, last_name=student.last_name, student_id=student.student_id)
+    return result
+
 @app.route('/verify', methods=['POST'])
 def verify_student():
     values = request.get_json()
@@ -311,25 +1300,136 @@ def verify_student():
     if not all(k in values for k in required):
         return 'Missing values', 400
 
-    for block in node.chain:
-        student_list = block['students']
-        for student in student_list:
-            if student['first_name'] == values['first_name'] and student['last_name'] == values['last_name'] and student['student_id'] == values['student_id']:
-                # check sig
-                new_one = dict(student)
-                sig = new_one['signature']
-                new_one.pop('signature', None)
-                with open(PUBLIC_KEYS_FILE_PATH) as pub_file:    
-                    pub_properties = json.load(pub_file, strict=False)
-                school_pub_key = RSA.importKey(pub_properties[student['institution_name']])
-                sign_string = str(student['first_name']) + str(student['last_name']) + str(student['student_id']) + str(student['date_enrolled_through']) + str(student['institution_name'])
-                verified = node.ciph.asymmetric_verify(str(sign_string), sig, school_pub_key)
-                if verified:
-                    print({"result" : True, "school" : student['institution_name'], "signature": sig})
-                    return jsonify({"result" : True, "school" : student['institution_name'], "signature": sig}), 200
-    print({"result" : False})
+    fuzzy = values.get('fuzzy') is True
+    for match, student in node.match_students(values['first_name'], values['last_name'], values['student_id'], fuzzy):
+        if node.verify_record(student):
+            logger.debug('Verified %s at %s', values, student.institution_name)
+            return jsonify(verification(student, match)), 200
+    logger.debug('Could not verify %s', values)
     return jsonify({"result" : False}), 200
 
+@app.route('/verify/batch', methods=['POST'])
+def verify_students():
+    queries = request.get_json(silent=True)
+    if not isinstance(queries, list):
+        return 'Expected a JSON array of students', 400
+
+    # Look every query up first, then verify all the candidates together
+    required = ['first_name', 'last_name', 'student_id']
+    candidates = []
+    for values in queries:
+        if isinstance(values, dict) and all(k in values for k in required):
+            candidates.append(node.match_students(values['first_name'], values['last_name'], values['student_id'],
+                                                  values.get('fuzzy') is True))
+        else:
+            candidates.append(None)
+
+    verified = iter(node.verify_records([student for matches in candidates if matches for _, student in matches]))
+
+    results = []
+    for matches in candidates:
+        if matches is None:
+            results.append({"result" : False, "error" : 'Missing values'})
+            continue
+        result = {"result" : False}
+        for match, student in matches:
+            if next(verified) and not result['result']:
+                result = verification(student, match)
+        results.append(result)
+
+    return jsonify({'results': results}), 200
+
+def student_page(query, *args):
+    """
+    Respond with one page of the records a student query matches, each with
+    its record id and whether its signature checks out
+    :param query: Name of a query method of the student index
+    :param args: Its arguments, before offset and limit
+    """
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', QUERY_PAGE_SIZE, type=int), 0), QUERY_PAGE_SIZE)
+    total, students = node.query_students(query, *args, offset, limit)
+    verified = node.verify_records(students)
+
+    response = {
+        'students': [dict(student.to_dict(), record_id=student.record_id(), verified=ok)
+                     for student, ok in zip(students, verified)],
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+    }
+    return jsonify(response), 200
+
+@app.route('/students/institution', methods=['GET'])
+def institution_students():
+    name = request.args.get('name')
+    if not name:
+        return 'Missing institution name', 400
+
+    # Either everyone, or only those still enrolled on a date, today if active is set
+    enrolled_on = None
+    if 'enrolled_on' in request.args:
+        enrolled_on = date_key(request.args['enrolled_on'])
+        if enrolled_on is None:
+            return 'Dates are MM/DD/YYYY', 400
+    elif request.args.get('active', '').lower() in ('1', 'true', 'yes'):
+        today = localtime()
+        enrolled_on = (today.tm_year, today.tm_mon, today.tm_mday)
+    return student_page('of_institution', name, enrolled_on)
+
+@app.route('/students/id/<student_id>', methods=['GET'])
+def student_id_students(student_id):
+    return student_page('with_student_id', student_id)
+
+@app.route('/students/search', methods=['GET'])
+def search_students():
+    first_name, last_name = request.args.get('first_name', ''), request.args.get('last_name', '')
+    if not (first_name or last_name):
+        return 'Give a first_name and/or last_name', 400
+
+    limit = min(max(request.args.get('limit', QUERY_PAGE_SIZE, type=int), 0), QUERY_PAGE_SIZE)
+    matches = node.similar_students(first_name, last_name, limit)
+    verified = node.verify_records([student for _, student in matches])
+
+    # Only records whose signatures check out are given back
+    response = {
+        'students': [dict(student.to_dict(), record_id=student.record_id(), similarity=round(score, 3))
+                     for (score, student), ok in zip(matches, verified) if ok],
+    }
+    return jsonify(response), 200
+
+@app.route('/students/expiring', methods=['GET'])
+def expiring_students():
+    before = date_key(request.args.get('before'))
+    if before is None:
+        return 'Give the date as before=MM/DD/YYYY', 400
+    return student_page('expiring_before', before)
+
+@app.route('/proof/<record_id>', methods=['GET'])
+def record_proof(record_id):
+    proof = node.record_proof(record_id)
+    if proof is None:
+        return 'Unknown record', 404
+    return negotiated(proof), 200
+
+@app.route('/verify/stats', methods=['GET'])
+def verify_stats():
+    return jsonify(node.verify_cache.stats()), 200
+
+@app.route('/keys/reload', methods=['POST'])
+def reload_keys():
+    try:
+        institutions = node.key_registry.reload()
+    except ValueError as e:
+        return jsonify({'message': f'Public keys could not be reloaded, the previous ones are kept: {e}'}), 500
+
+    response = {
+        'message': 'Public keys have been reloaded',
+        'institutions': institutions,
+    }
+    return jsonify(response), 200
+
 @app.route('/add/')
 def add():
     return render_template('add.html')
@@ -344,10 +1444,45 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
     parser.add_argument('-i', '--institution', default="berkeley", type=str, help='your institution')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='number of processes used for mining')
+    parser.add_argument('-c', '--chunk-size', default=10000, type=int, help='nonces handed to a mining process at a time')
+    parser.add_argument('-s', '--sign-workers', default=1, type=int, help='number of processes used to sign batches of students')
+    parser.add_argument('-v', '--verify-workers', default=1, type=int, help='number of processes used to verify batches of students')
+    parser.add_argument('-f', '--chain-file', default=None, type=str, help='file the chain is kept in, defaults to ./<institution>-<port>.chain')
+    parser.add_argument('-l', '--log-level', default='INFO', type=str, help='logging level, DEBUG shows blocks checked during consensus')
+    parser.add_argument('--auto-mine-size', default=None, type=int, help='mine once this many students are waiting')
+    parser.add_argument('--auto-mine-age', default=None, type=float, help='mine once a student has waited this many seconds')
+    parser.add_argument('--consensus', default='pow', choices=CONSENSUS_MODES, help='pow to mine blocks, poa to have institutions sign them, the same on every node')
+    parser.add_argument('--target-block-time', default=TARGET_BLOCK_TIME, type=float, help='seconds between blocks that mining difficulty is adjusted towards, or the length of each turn to make a block under poa, the same on every node')
+    parser.add_argument('--read-workers', default=0, type=int, help='processes answering /verify, /proof and /chain from an SQLite copy of the chain')
+    parser.add_argument('--read-port', default=None, type=int, help='port the read workers listen on, defaults to the port after this one')
+    parser.add_argument('--compact', action='store_true', help='rewrite the chain file without the blocks replaced chains left in it before starting')
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
     port = args.port
     INSTITUTION_INFO_FILE_PATH = './' + args.institution + '.json'
     with open(INSTITUTION_INFO_FILE_PATH) as data_file:    
         institution_properties = json.load(data_file, strict=False)
-    node = UniversityNode(institution_properties, args.institution)
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    if args.read_workers:
+        from readnode import start_workers
+        from sqlitestore import SQLiteBlockStore
+        chain_file = args.chain_file or f'./{args.institution}-{port}.db'
+        # The workers are forked with no database connection open in this process, which
+        # they must not inherit, and before it starts any threads or processes of its own.
+        # The tables they read are created first, on a connection that is closed again.
+        SQLiteBlockStore(chain_file).close()
+        start_workers(chain_file, args.read_port or port + 1, args.read_workers)
+        store = SQLiteBlockStore(chain_file)
+    else:
+        store = BlockStore(args.chain_file or f'./{args.institution}-{port}.chain')
+        if args.compact:
+            store.compact(UniversityNode.hash)
+    miner = ParallelMiner(args.workers, args.chunk_size)
+    signer = BatchSigner(institution_properties['private_key'], args.sign_workers)
+    verifier = BatchVerifier(args.verify_workers)
+    node = UniversityNode(institution_properties, args.institution, miner, store, signer, verifier,
+                          args.target_block_time, args.consensus, port)
+    if args.auto_mine_size is not None or args.auto_mine_age is not None:
+        node.auto_mine(args.auto_mine_size, args.auto_mine_age)
+    # Requests are served on threads of their own, sharing the node
+    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
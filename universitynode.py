@@ -11,6 +11,8 @@ from uuid import uuid4
 from flask import Flask, jsonify, request
 from urllib.parse import urlparse
 
+from mining import DEFAULT_DIFFICULTY, meets_difficulty
+
 
 # -- Constants -- #
 
@@ -174,7 +176,7 @@ class UniversityNode(object):
     def valid_block_proof(block):
         # Check if the inputted block has valid proof
         block_hash = UniversityNode.hash(block)
-        return block_hash[:4] == "0000"
+        return meets_difficulty(bytes.fromhex(block_hash), DEFAULT_DIFFICULTY)
 
 
     # @staticmethod
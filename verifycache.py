@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class VerificationCache:
+    """
+    Bounded LRU cache of signature verification results
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Cached result for a key
+        :param key: (sign_string, signature, institution_name)
+        :return: The cached result, or None on a miss
+        """
+
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.results),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }